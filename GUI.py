@@ -1,11 +1,122 @@
-import tkinter as tk
-from tkinter import ttk
-from tkinter import filedialog
-from tkinter import messagebox
+import base64
+import io
 import os
+import queue
+import threading
+from collections import namedtuple
+
+# tkinter is imported by load_tk() when a window is actually created, so importing this module stays cheap
+tk = ttk = filedialog = messagebox = None
+
+# Parameter changes within this many milliseconds are combined into one preview
+DEBOUNCE_MS = 300
+# How often the Tk main loop looks for finished previews
+POLL_MS = 50
+# Resolution of the 7x4 preview image (the figure is 16 x 28 inches)
+PREVIEW_DPI = 40
+
+# kind: 'analysis' (endpoints known, image follows), 'image' (png holds the rendered figure) or 'error' (message)
+Preview = namedtuple('Preview', ['generation', 'kind', 'analysis', 'png', 'message'])
+
+def load_tk():
+    """Import tkinter and its submodules into this module's namespace on first use."""
+    global tk, ttk, filedialog, messagebox
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as _ttk, filedialog as _filedialog, messagebox as _messagebox
+        tk, ttk, filedialog, messagebox = tkinter, _ttk, _filedialog, _messagebox
+
+class PreviewWorker:
+    """Analyses and renders Gran previews on a background thread; results arrive on the results queue.
+
+    Only the newest request is kept: submit() replaces a request that has not started yet and
+    makes a running one stale, so the worker abandons it at the next stage boundary (load,
+    analyse, render) and its results are never delivered. The data file is loaded once and
+    the figure is built once; both are reused while only the method changes.
+    """
+
+    def __init__(self, dpi=PREVIEW_DPI):
+        self.dpi = dpi
+        self.results = queue.Queue()
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._job = None
+        self._closed = False
+        self._data = None  # (path, mtime, volume, pH) of the last loaded file
+        self._figure = None
+        self._thread = threading.Thread(target=self._run, name='preview', daemon=True)
+        self._thread.start()
+
+    def submit(self, data_path, method):
+        """Request a preview of a data file under a method dict; returns the request's generation."""
+        with self._condition:
+            self._generation += 1
+            self._job = (self._generation, data_path, method)
+            self._condition.notify()
+            return self._generation
+
+    def cancel(self):
+        """Drop the pending request and make the running one stale."""
+        with self._condition:
+            self._generation += 1
+            self._job = None
+
+    def stale(self, generation):
+        return generation != self._generation
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._job = None
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._job is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                (generation, data_path, method), self._job = self._job, None
+            try:
+                self._preview(generation, data_path, method)
+            except Exception as e:
+                self._put(Preview(generation, 'error', None, None, str(e)))
+
+    def _put(self, preview):
+        if not self.stale(preview.generation):
+            self.results.put(preview)
+
+    def _load(self, data_path):
+        from loader import load_titration
+        mtime = os.stat(data_path).st_mtime_ns
+        if self._data is None or self._data[:2] != (data_path, mtime):
+            self._data = (data_path, mtime) + load_titration(data_path)
+        return self._data[2:]
+
+    def _preview(self, generation, data_path, method):
+        from method import analyse, unscaled_gran
+        volume, pH = self._load(data_path)
+        if self.stale(generation):
+            return
+        analysis = analyse(volume, pH, method)
+        self._put(Preview(generation, 'analysis', analysis, None, None))
+        if self.stale(generation):
+            return
+        if self._figure is None:
+            from render import GranFigure
+            self._figure = GranFigure(headless=True)
+        self._figure.update(analysis.volume, analysis.pH, unscaled_gran(analysis))
+        if self.stale(generation):
+            return
+        buffer = io.BytesIO()
+        self._figure.save(buffer, dpi=self.dpi)
+        self._put(Preview(generation, 'image', analysis, buffer.getvalue(), None))
+
 
 class TitrationMethodGUI:
     def __init__(self, root):
+        load_tk()
         self.root = root
         self.root.title("PyGranTitEQP - Method Parameter Selection")
         self.root.geometry("500x450")
@@ -20,8 +131,20 @@ class TitrationMethodGUI:
 
         self.method_enabled = tk.BooleanVar(value=False)
         self.method_entry_state = tk.DISABLED
+        self.status = tk.StringVar(value="Select a data file to see the Gran preview.")
+
+        self.worker = PreviewWorker()
+        self._debounce = None
+        self._generation = None
+        self._preview_window = self._preview_image = None
 
         self.create_widgets()
+        # Every parameter that changes the analysis re-renders the preview after a short pause
+        for variable in (self.titration_type, self.titration_strength, self.analyte_volume,
+                         self.titrant_concentration, self.data_file_path):
+            variable.trace_add('write', self.schedule_preview)
+        self.root.protocol("WM_DELETE_WINDOW", self.cancel_clicked)
+        self.root.after(POLL_MS, self.poll_preview)
 
     def create_widgets(self):
         # Main frame
@@ -68,13 +191,16 @@ class TitrationMethodGUI:
 
         # Method File Save Path second, disabled by default
         ttk.Label(main_frame, text="Method File Save Path:").grid(row=9, column=0, sticky=tk.W, pady=(0,0))
-        method_entry = ttk.Entry(main_frame, textvariable=self.method_file_path, width=50, state=self.method_entry_state)
-        method_entry.grid(row=9, column=1, sticky=(tk.W, tk.E), padx=5)
+        self.method_entry = ttk.Entry(main_frame, textvariable=self.method_file_path, width=50, state=self.method_entry_state)
+        self.method_entry.grid(row=9, column=1, sticky=(tk.W, tk.E), padx=5)
         ttk.Button(main_frame, text="Browse", command=self.browse_method_file).grid(row=9, column=2, padx=5)
 
+        # Preview status: endpoints of the current parameters, or why there is no preview
+        ttk.Label(main_frame, textvariable=self.status, wraplength=460, justify=tk.LEFT).grid(row=10, column=0, columnspan=3, sticky=tk.W, pady=(10,0))
+
         # Buttons Block
         button_frame = ttk.Frame(main_frame)
-        button_frame.grid(row=10, column=0, columnspan=3, pady=20)
+        button_frame.grid(row=11, column=0, columnspan=3, pady=20)
         ttk.Button(button_frame, text="OK", command=self.ok_clicked).pack(side=tk.LEFT, padx=5)
         ttk.Button(button_frame, text="Cancel", command=self.cancel_clicked).pack(side=tk.LEFT, padx=5)
 
@@ -88,8 +214,7 @@ class TitrationMethodGUI:
             self.method_entry_state = tk.NORMAL
         else:
             self.method_entry_state = tk.DISABLED
-        # For mockup, print state; in full app, reconfigure the entry
-        print(f"Method entry state: {self.method_entry_state}")
+        self.method_entry.configure(state=self.method_entry_state)
 
     def browse_data_file(self):
         filename = filedialog.askopenfilename(filetypes=[("Text files", "*.dat *.txt *.csv"), ("All files", "*.*")])
@@ -107,22 +232,106 @@ class TitrationMethodGUI:
         if filename:
             self.method_file_path.set(filename)
 
+    def current_method(self):
+        """Method dict of the current selections; raises ValueError for invalid entries."""
+        from method import make_method
+        params = dict(titration_type=self.titration_type.get(), titration_strength=self.titration_strength.get())
+        if self.analyte_volume.get().strip():
+            params['analyte_volume'] = self.analyte_volume.get()
+        if self.titrant_concentration.get().strip():
+            params['titrant_concentration'] = self.titrant_concentration.get()
+        return make_method(**params)
+
+    def schedule_preview(self, *args):
+        """Restart the debounce timer; the running preview is stale from now on."""
+        if self._debounce is not None:
+            self.root.after_cancel(self._debounce)
+        self.worker.cancel()
+        self._generation = None
+        self._debounce = self.root.after(DEBOUNCE_MS, self.start_preview)
+
+    def start_preview(self):
+        self._debounce = None
+        data_path = self.data_file_path.get()
+        if not os.path.isfile(data_path):
+            self.status.set("Select a data file to see the Gran preview.")
+            return
+        try:
+            method = self.current_method()
+        except ValueError as e:
+            self.status.set(f"Invalid parameters: {e}")
+            return
+        self._generation = self.worker.submit(data_path, method)
+        self.status.set("Computing preview...")
+
+    def poll_preview(self):
+        """Show the worker's results for the current request; runs on the Tk main loop."""
+        try:
+            while True:
+                preview = self.worker.results.get_nowait()
+                if preview.generation == self._generation:
+                    self.show_preview(preview)
+        except queue.Empty:
+            pass
+        self.root.after(POLL_MS, self.poll_preview)
+
+    def show_preview(self, preview):
+        from method import method_titrations
+        if preview.kind == 'error':
+            self.status.set(f"Preview failed: {preview.message}")
+            return
+        method = self.current_method()
+        endpoints = [f"{titration}: {endpoint.volume:.3f} mL" if endpoint is not None else f"{titration}: none"
+                     for titration, endpoint in preview.analysis.endpoints.items() if titration in method_titrations(method)]
+        self.status.set("Endpoints - " + ", ".join(endpoints) + ("" if preview.kind == 'image' else " (rendering...)"))
+        if preview.kind == 'image':
+            self.show_image(preview.png)
+
+    def show_image(self, png):
+        """Display a rendered preview in a scrollable window next to the form."""
+        if self._preview_window is None or not self._preview_window.winfo_exists():
+            self._preview_window = tk.Toplevel(self.root)
+            self._preview_window.title("PyGranTitEQP - Gran Preview")
+            self._preview_window.geometry("700x800")
+            canvas = tk.Canvas(self._preview_window)
+            scrollbar = ttk.Scrollbar(self._preview_window, orient=tk.VERTICAL, command=canvas.yview)
+            canvas.configure(yscrollcommand=scrollbar.set)
+            scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self._preview_canvas = canvas
+            self._preview_item = canvas.create_image(0, 0, anchor=tk.NW)
+        self._preview_image = tk.PhotoImage(data=base64.b64encode(png).decode('ascii'))  # keep a reference, or Tk drops the image
+        self._preview_canvas.itemconfigure(self._preview_item, image=self._preview_image)
+        self._preview_canvas.configure(scrollregion=(0, 0, self._preview_image.width(), self._preview_image.height()))
+
     def ok_clicked(self):
-        # Mockup action: Print selections
-        print("Titration Type:", self.titration_type.get())
-        print("Titration Strength:", self.titration_strength.get())
-        print("Analyte Volume:", self.analyte_volume.get())
-        print("Titrant Concentration:", self.titrant_concentration.get())
-        print("Method File Path:", self.method_file_path.get())
-        print("Data File Path:", self.data_file_path.get())
-        messagebox.showinfo("OK", "Parameters saved! (Mockup)")
+        from method import save_method
+        try:
+            method = self.current_method()
+        except ValueError as e:
+            messagebox.showerror("Invalid parameters", str(e))
+            return
+        method_path = self.method_file_path.get()
+        if not method_path:
+            if not self.data_file_path.get():
+                messagebox.showerror("No method file", "Select a data file or a method file path.")
+                return
+            method_path = os.path.join(os.path.dirname(self.data_file_path.get()), "method.json")
+        try:
+            save_method(method, method_path)
+        except OSError as e:
+            messagebox.showerror("Saving failed", str(e))
+            return
+        messagebox.showinfo("OK", f"Method saved to {method_path}")
+        self.worker.close()
         self.root.quit()
 
     def cancel_clicked(self):
-        messagebox.showinfo("Cancel", "Operation cancelled. (Mockup)")
+        self.worker.close()
         self.root.quit()
 
 if __name__ == "__main__":
+    load_tk()
     root = tk.Tk()
     app = TitrationMethodGUI(root)
     root.mainloop()
\ No newline at end of file
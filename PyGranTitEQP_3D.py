@@ -1,17 +1,20 @@
 # second_prototype.py: Script for PyGranTitEQP
 # Loads data.dat (volume in mL, pH) and plots titration curve and Schwarz functions for V=25 and varying k values
 
-import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
 
+from instrument import stage, timed
+from loader import load_titration
+from schwarz import SCHWARZ_NAMES, schwarz_functions, sweep_all
+
+@timed('load')
 def load_data(file_path):
     """Load titration data from a text file."""
+    import pandas as pd  # imported on demand: only needed to build the DataFrame
     try:
-        df = pd.read_csv(file_path, delim_whitespace=True, names=['volume', 'pH'])
-        print("Data loaded successfully:")
-        print(df.head())
-        print(f"Volume range: {df['volume'].min()} to {df['volume'].max()} mL")
+        # Delimiter and header row are detected by the loader
+        volume, pH = load_titration(file_path)
+        df = pd.DataFrame({'volume': volume, 'pH': pH})
         return df
     except FileNotFoundError:
         print(f"Error: '{file_path}' not found. Ensure the file is in the same directory.")
@@ -20,6 +23,7 @@ def load_data(file_path):
         print(f"Error loading data: {e}")
         return None
 
+@timed('validate')
 def validate_data(df):
     """Validate titration data for monotonic volumes and reasonable pH."""
     if df is None:
@@ -35,6 +39,7 @@ def validate_data(df):
 
 def plot_titration_and_schwarz(df, output_file='titration_and_schwarz.png'):
     """Plot titration curve and Schwarz functions for V=25 and varying k values in a 5x1 grid."""
+    import matplotlib.pyplot as plt  # imported on demand: the compute path only needs NumPy
     if df is None or not validate_data(df):
         print("Cannot plot: Invalid or no data.")
         return
@@ -46,68 +51,76 @@ def plot_titration_and_schwarz(df, output_file='titration_and_schwarz.png'):
     # Fixed V and k values
     V = 25
     k_values = [0.99, 0.9, 1, 1.1, 1.11]
-    k2 = k22 = k6 = k66 = 1.0  # Fixed scaling constants
-
-    # Define Schwarz functions
-    def strongacid_g1(volume, pH, k1):
-        return ((volume + V) * np.power(10, k1 - pH)) / k2
-
-    def strongbase_g1(volume, pH, k11):
-        return ((volume + V) * np.power(10, k11 + pH)) / k22
-
-    def weakacid_g1(volume, pH, k5):
-        return (volume * np.power(10, k5 - pH)) / k6  # No V dependence
-
-    def weakbase_g1(volume, pH, k55):
-        return (volume * np.power(10, k55 + pH)) / k66  # No V dependence
 
-    schwarz_types = [strongacid_g1, strongbase_g1, weakacid_g1, weakbase_g1]
-    schwarz_labels = ['Schwarz_StrongAcid_G1', 'Schwarz_StrongBase_G1', 'Schwarz_WeakAcid_G1', 'Schwarz_WeakBase_G1']
+    # All Schwarz functions for all k at once: (4, len(k_values), n)
+    with stage('compute'):
+        schwarz = schwarz_functions(volume, pH, k_values, V)
     colors = plt.cm.viridis(np.linspace(0, 1, len(k_values)))
 
-    fig, axes = plt.subplots(5, 1, figsize=(8, 25), sharex=True)
-
-    # Row 1: Titration curve
-    axes[0].plot(volume, pH, marker='o', linestyle='-', color='blue', label='Titration Data')
-    axes[0].set_ylabel('pH')
-    axes[0].set_title('Titration Curve')
-    ### axes[0].set_xlim(0, 10)
-    if pH.size > 0:
-        y_min, y_max = np.min(pH), np.max(pH)
-        y_margin = (y_max - y_min) * 0.1
-        axes[0].set_ylim(y_min - y_margin, y_max + y_margin)
-    axes[0].grid(True)
-    axes[0].legend()
-
-    # Rows 2-5: Schwarz functions with varying k
-    for row in range(1, 5):
-        schwarz_func = schwarz_types[row-1]
-        label = schwarz_labels[row-1]
-        axes[row].set_ylabel(label)
-        axes[row].set_title(f'{label} for V={V}, varying k')
-        for i, k in enumerate(k_values):
-            y = schwarz_func(volume, pH, k)
-            axes[row].plot(volume, y, label=f'k={k}', color=colors[i])
-            if y.size > 0:
-                y_min, y_max = np.min(y), np.max(y)
-                if y_max != y_min:  # Avoid zero range
-                    y_margin = (y_max - y_min) * 0.1
-                    axes[row].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[row].grid(True)
-        if row == 1:
-            axes[row].legend(ncol=3, bbox_to_anchor=(0.75, 1.0), loc='upper center', fontsize='small')
-
-    axes[-1].set_xlabel('Volume Added (mL)')
-    plt.tight_layout()
-    plt.savefig(output_file, dpi=300)
+    with stage('plot'):
+        fig, axes = plt.subplots(5, 1, figsize=(8, 25), sharex=True)
+
+        # Row 1: Titration curve
+        axes[0].plot(volume, pH, marker='o', linestyle='-', color='blue', label='Titration Data')
+        axes[0].set_ylabel('pH')
+        axes[0].set_title('Titration Curve')
+        ### axes[0].set_xlim(0, 10)
+        if pH.size > 0:
+            y_min, y_max = np.min(pH), np.max(pH)
+            y_margin = (y_max - y_min) * 0.1
+            axes[0].set_ylim(y_min - y_margin, y_max + y_margin)
+        axes[0].grid(True)
+        axes[0].legend()
+
+        # Rows 2-5: Schwarz functions with varying k
+        for row in range(1, 5):
+            label = SCHWARZ_NAMES[row-1]
+            axes[row].set_ylabel(label)
+            axes[row].set_title(f'{label} for V={V}, varying k')
+            for i, k in enumerate(k_values):
+                y = schwarz[row-1, i]
+                axes[row].plot(volume, y, label=f'k={k}', color=colors[i])
+                if y.size > 0:
+                    y_min, y_max = np.min(y), np.max(y)
+                    if y_max != y_min:  # Avoid zero range
+                        y_margin = (y_max - y_min) * 0.1
+                        axes[row].set_ylim(y_min - y_margin, y_max + y_margin)
+            axes[row].grid(True)
+            if row == 1:
+                axes[row].legend(ncol=3, bbox_to_anchor=(0.75, 1.0), loc='upper center', fontsize='small')
+
+        axes[-1].set_xlabel('Volume Added (mL)')
+        plt.tight_layout()
+    with stage('save'):
+        plt.savefig(output_file, dpi=300)
     print(f"Plots saved as '{output_file}'")
     plt.show()
 
+def print_optimal_parameters(df, V_values=np.linspace(0, 100, 10001), window=None):
+    """Sweep all Schwarz functions over V and print the most linear V per criterion.
+
+    Each function is fitted over its linear G1 branch, or over window=(vmin, vmax) if given.
+    k is not swept: it only scales the functions and does not affect the fit.
+    """
+    if df is None or not validate_data(df):
+        return
+    with stage('fit'):
+        optima = sweep_all(df['volume'].to_numpy(), df['pH'].to_numpy(), V_values, window)
+    for name, by_criterion in optima.items():
+        for criterion, optimum in by_criterion.items():
+            if optimum is not None:
+                V, value = optimum
+                at = 'independent of V' if V is None else f'at V={V:g} mL'
+                print(f"{name}: best {criterion} = {value:.6g} {at} (any k)")
+
 def main():
     """Main function to run the prototype."""
     file_path = 'data.dat'
     df = load_data(file_path)
     if df is not None:
+        print(f"Data loaded successfully: {len(df)} points")
+        print(f"Volume range: {df['volume'].min()} to {df['volume'].max()} mL")
+        print_optimal_parameters(df)
         plot_titration_and_schwarz(df)
 
 if __name__ == '__main__':
@@ -1,19 +1,30 @@
 # prototype.py: Quick and dirty PyGranTitEQP prototype
 # Loads data.dat (volume in mL, pH) and plots titration curve, all G1's and G2's, and their first and second derivatives in a 7x4 grid
-# Sets x-axis to 5-45 mL and y-axis limits based on data within this range
+# Evaluates only the analysis window of the method (default 5-45 mL) and scales the axes to the data within it
 
-import pandas as pd
-import matplotlib.pyplot as plt
-import numpy as np
+import os
 
+from gran_engine import compute_gran
+from instrument import stage, timed
+from loader import load_titration
+from method import METHOD_FILE, apply_window, load_method, make_method
+from preprocess import clean
+from render import GranFigure, REPORT_DPI
+
+# Savitzky-Golay window (points) and polynomial order of the derivative rows with smooth=True
+SMOOTHING = (7, 2)
+
+# Used when no method.json lies next to the data file
+RANGE_METHOD = make_method(analyte_volume=5.0, window=[5.0, 45.0])
+
+@timed('load')
 def load_data(file_path):
     """Load titration data from a text file."""
+    import pandas as pd  # imported on demand: only needed to build the DataFrame
     try:
-        # Assume space-separated, no headers
-        # Adjust delimiter (e.g., delimiter=',') or header (e.g., header=0) if needed
-        df = pd.read_csv(file_path, delim_whitespace=True, names=['volume', 'pH'])
-        print("Data loaded successfully:")
-        print(df.head())
+        # Delimiter and header row are detected by the loader
+        volume, pH = load_titration(file_path)
+        df = pd.DataFrame({'volume': volume, 'pH': pH})
         return df
     except FileNotFoundError:
         print(f"Error: '{file_path}' not found. Ensure the file is in the same directory.")
@@ -22,6 +33,7 @@ def load_data(file_path):
         print(f"Error loading data: {e}")
         return None
 
+@timed('validate')
 def validate_data(df):
     """Validate titration data for monotonic volumes and reasonable pH."""
     if df is None:
@@ -37,169 +49,71 @@ def validate_data(df):
     print(f"Data points: {len(df)}")
     return True
 
-def plot_titration_and_gran(df, output_file='titration_and_gran.png'):
-    """Plot titration curve, all G1's and G2's, and their first and second derivatives in a 7x4 grid."""
+def load_data_method(file_path):
+    """The method.json next to a data file, or RANGE_METHOD if there is none."""
+    method_file = os.path.join(os.path.dirname(os.path.abspath(file_path)), METHOD_FILE)
+    if os.path.exists(method_file):
+        print(f"Method loaded from '{method_file}'")
+        return load_method(method_file)
+    return RANGE_METHOD
+
+def plot_titration_and_gran(df, output_file='titration_and_gran.png', show=True, dpi=REPORT_DPI, smooth=False, method=RANGE_METHOD):
+    """Plot titration curve, all G1's and G2's, and their first and second derivatives in a 7x4 grid.
+
+    Only the method's analysis window is evaluated: the arrays are sliced before the Gran
+    functions and their derivatives are computed. The raw points are plotted with
+    finite-difference derivatives; smooth=True drops missing values and pH outliers
+    (preprocess.clean) and uses Savitzky-Golay SMOOTHING derivatives instead. With show=False
+    the figure is rendered headless (Agg) and nothing blocks.
+    """
     if df is None or not validate_data(df):
         print("Cannot plot: Invalid or no data.")
         return
-    # Set professional plot style
-    plt.style.use('seaborn-v0_8')
-    fig, axes = plt.subplots(7, 4, figsize=(16, 28), sharex=True)
-
     # Convert to NumPy arrays for plotting
     volume = df['volume'].to_numpy()
     pH = df['pH'].to_numpy()
-    V = 5.0  # Initial volume to be titrated (mL)
-
-    # Filter data for x-axis range 5-45 mL
-    mask = (volume >= 5) & (volume <= 45)
-    if not mask.any():
-        print("Warning: No data points in volume range 5-45 mL. Using full data range for y-axis scaling.")
-        mask = np.ones_like(volume, dtype=bool)  # Use all data if none in range
-    volume_filtered = volume[mask]
-    pH_filtered = pH[mask]
-
-    # Define Gran functions
-    strongacid_g1 = (volume + V) * np.power(10, -pH)  # StrongAcid_G1 = (v + V) * 10^(-pH)
-    strongacid_g2 = (volume + V) * np.power(10, pH)   # StrongAcid_G2 = (v + V) * 10^(pH)
-    strongbase_g1 = (volume + V) * np.power(10, pH)   # StrongBase_G1 = (v + V) * 10^(pH)
-    strongbase_g2 = (volume + V) * np.power(10, -pH)  # StrongBase_G2 = (v + V) * 10^(-pH)
-    weakacid_g1 = volume * np.power(10, -pH)          # WeakAcid_G1 = v * 10^(-pH)
-    weakacid_g2 = (volume + V) * np.power(10, pH)     # WeakAcid_G2 = (v + V) * 10^(pH)
-    weakbase_g1 = volume * np.power(10, pH)           # WeakBase_G1 = v * 10^(pH)
-    weakbase_g2 = (volume + V) * np.power(10, -pH)    # WeakBase_G2 = (v + V) * 10^(-pH)
-
-    # Row 1: Titration curve in all 4 columns
-    for col in range(4):
-        axes[0, col].plot(volume, pH, marker='o', linestyle='-', color='blue', label='Titration Data')
-        axes[0, col].set_ylabel('pH')
-        axes[0, col].set_title('Titration Curve')
-        axes[0, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered pH data
-        if pH_filtered.size > 0:
-            y_min, y_max = np.min(pH_filtered), np.max(pH_filtered)
-            y_margin = (y_max - y_min) * 0.1
-            axes[0, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[0, col].grid(True)
-        axes[0, col].legend()
+    V = method['analyte_volume']  # Initial volume to be titrated (mL)
+    window = method['window']
 
-    # Row 2: All G1's (StrongAcid_G1, StrongBase_G1, WeakAcid_G1, WeakBase_G1)
-    g1_list = [strongacid_g1, strongbase_g1, weakacid_g1, weakbase_g1]
-    g1_labels = ['StrongAcid_G1 = (v + V) * 10^(-pH)', 'StrongBase_G1 = (v + V) * 10^(pH)', 'WeakAcid_G1 = v * 10^(-pH)', 'WeakBase_G1 = v * 10^(pH)']
-    g1_colors = ['green', 'olive', 'orange', 'purple']
-    g1_styles = ['-', '-', '--', ':']
-    g1_markers = ['o', 'o', 's', '^']
-    for col in range(4):
-        axes[1, col].plot(volume, g1_list[col], marker=g1_markers[col], linestyle=g1_styles[col], color=g1_colors[col], label=g1_labels[col])
-        axes[1, col].set_ylabel('Gran G1')
-        axes[1, col].set_title(g1_labels[col].split(' = ')[0] + ' Plot')
-        axes[1, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered Gran data
-        if mask.any():
-            y_min, y_max = np.min(g1_list[col][mask]), np.max(g1_list[col][mask])
-            y_margin = (y_max - y_min) * 0.1
-            axes[1, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[1, col].grid(True)
-        axes[1, col].legend()
-        # Optional: Uncomment for log-scaling if values are too large/small
-        # axes[1, col].set_yscale('log')
-
-    # Row 3: First derivatives of all G1's
-    for col in range(4):
-        dg1 = np.gradient(g1_list[col], volume)  # dG1/dv
-        axes[2, col].plot(volume, dg1, marker=g1_markers[col], linestyle=g1_styles[col], color=g1_colors[col], label='d(' + g1_labels[col].split(' = ')[0] + ')/dv')
-        axes[2, col].set_ylabel('dG1/dv')
-        axes[2, col].set_title('First Derivative of ' + g1_labels[col].split(' = ')[0])
-        axes[2, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered derivative data
-        if mask.any():
-            y_min, y_max = np.min(dg1[mask]), np.max(dg1[mask])
-            y_margin = (y_max - y_min) * 0.1
-            axes[2, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[2, col].grid(True)
-        axes[2, col].legend()
-
-    # Row 4: Second derivatives of all G1's
-    for col in range(4):
-        dg1 = np.gradient(g1_list[col], volume)  # dG1/dv
-        d2g1 = np.gradient(dg1, volume)  # d²G1/dv²
-        axes[3, col].plot(volume, d2g1, marker=g1_markers[col], linestyle=g1_styles[col], color=g1_colors[col], label='d²(' + g1_labels[col].split(' = ')[0] + ')/dv²')
-        axes[3, col].set_ylabel('d²G1/dv²')
-        axes[3, col].set_title('Second Derivative of ' + g1_labels[col].split(' = ')[0])
-        axes[3, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered second derivative data
-        if mask.any():
-            y_min, y_max = np.min(d2g1[mask]), np.max(d2g1[mask])
-            y_margin = (y_max - y_min) * 0.1
-            axes[3, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[3, col].grid(True)
-        axes[3, col].legend()
-
-    # Row 5: All G2's (StrongAcid_G2, StrongBase_G2, WeakAcid_G2, WeakBase_G2)
-    g2_list = [strongacid_g2, strongbase_g2, weakacid_g2, weakbase_g2]
-    g2_labels = ['StrongAcid_G2 = (v + V) * 10^(pH)', 'StrongBase_G2 = (v + V) * 10^(-pH)', 'WeakAcid_G2 = (v + V) * 10^(pH)', 'WeakBase_G2 = (v + V) * 10^(-pH)']
-    g2_colors = ['red', 'brown', 'cyan', 'magenta']
-    g2_styles = ['-', '-', '--', ':']
-    g2_markers = ['o', 'o', 's', '^']
-    for col in range(4):
-        axes[4, col].plot(volume, g2_list[col], marker=g2_markers[col], linestyle=g2_styles[col], color=g2_colors[col], label=g2_labels[col])
-        axes[4, col].set_ylabel('Gran G2')
-        axes[4, col].set_title(g2_labels[col].split(' = ')[0] + ' Plot')
-        axes[4, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered Gran data
-        if mask.any():
-            y_min, y_max = np.min(g2_list[col][mask]), np.max(g2_list[col][mask])
-            y_margin = (y_max - y_min) * 0.1
-            axes[4, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[4, col].grid(True)
-        axes[4, col].legend()
-        # Optional: Uncomment for log-scaling if values are too large/small
-        # axes[4, col].set_yscale('log')
-
-    # Row 6: First derivatives of all G2's
-    for col in range(4):
-        dg2 = np.gradient(g2_list[col], volume)  # dG2/dv
-        axes[5, col].plot(volume, dg2, marker=g2_markers[col], linestyle=g2_styles[col], color=g2_colors[col], label='d(' + g2_labels[col].split(' = ')[0] + ')/dv')
-        axes[5, col].set_ylabel('dG2/dv')
-        axes[5, col].set_title('First Derivative of ' + g2_labels[col].split(' = ')[0])
-        axes[5, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered derivative data
-        if mask.any():
-            y_min, y_max = np.min(dg2[mask]), np.max(dg2[mask])
-            y_margin = (y_max - y_min) * 0.1
-            axes[5, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[5, col].grid(True)
-        axes[5, col].legend()
-
-    # Row 7: Second derivatives of all G2's
-    for col in range(4):
-        dg2 = np.gradient(g2_list[col], volume)  # dG2/dv
-        d2g2 = np.gradient(dg2, volume)  # d²G2/dv²
-        axes[6, col].plot(volume, d2g2, marker=g2_markers[col], linestyle=g2_styles[col], color=g2_colors[col], label='d²(' + g2_labels[col].split(' = ')[0] + ')/dv²')
-        axes[6, col].set_xlabel('Volume Added (mL)')
-        axes[6, col].set_ylabel('d²G2/dv²')
-        axes[6, col].set_title('Second Derivative of ' + g2_labels[col].split(' = ')[0])
-        axes[6, col].set_xlim(5, 45)  # Set x-axis range to 5-45 mL
-        # Set y-axis limits based on filtered second derivative data
-        if mask.any():
-            y_min, y_max = np.min(d2g2[mask]), np.max(d2g2[mask])
-            y_margin = (y_max - y_min) * 0.1
-            axes[6, col].set_ylim(y_min - y_margin, y_max + y_margin)
-        axes[6, col].grid(True)
-        axes[6, col].legend()
-
-    plt.tight_layout()
+    # Cut the curve to the analysis window once; y-axes are scaled to the data within it
+    try:
+        volume, pH = apply_window(volume, pH, window)
+    except ValueError as e:
+        print(f"Warning: {e}. Using the full data range.")
+        window = None
+
+    smoothing = None
+    if smooth:
+        # Drop missing values and pH outliers before anything is differentiated
+        volume, pH, dropped = clean(volume, pH)
+        if dropped.any():
+            print(f"Removed {dropped.sum()} outlier(s) or missing value(s)")
+        smoothing = SMOOTHING if SMOOTHING and volume.size >= SMOOTHING[0] else None
+
+    # Gran functions and their derivatives from the headless engine
+    with stage('compute'):
+        gran = compute_gran(volume, pH, V, smoothing=smoothing)
+
+    xlim = None
+    if window is not None:
+        xlim = (volume[0] if window[0] is None else window[0], volume[-1] if window[1] is None else window[1])
+    with stage('plot'):
+        figure = GranFigure(headless=not show)
+        figure.update(volume, pH, gran, xlim=xlim)
     # Save combined plot
-    plt.savefig(output_file, dpi=300)
+    with stage('save'):
+        figure.save(output_file, dpi=dpi)
     print(f"Plots saved as '{output_file}'")
-    plt.show()
+    if show:
+        figure.show()
 
 def main():
     """Main function to run the prototype."""
     file_path = 'data.dat'
     df = load_data(file_path)
     if df is not None:
-        plot_titration_and_gran(df)
+        print(f"Data loaded successfully: {len(df)} points")
+        plot_titration_and_gran(df, method=load_data_method(file_path))
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,199 @@
+# batch.py: Command-line batch evaluation for PyGranTitEQP
+# Evaluates Gran endpoints for many titration files in parallel and writes one consolidated results table
+
+import argparse
+import csv
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+
+import instrument
+from method import TITRATION_TYPES, analyse_file, make_method, unscaled_gran
+
+DATA_EXTENSIONS = ('.dat', '.txt', '.csv')
+RESULT_FIELDS = ['file', 'titration', 'points', 'volume_eq', 'ci_low', 'ci_high', 'stderr', 'r2', 'branches', 'status']
+
+# One headless figure per process, reused for every file that process renders
+_figure = None
+
+
+def expand_inputs(patterns):
+    """Expand glob patterns and directories into a sorted list of data files."""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for dirpath, _, filenames in os.walk(pattern):
+                files.update(os.path.join(dirpath, name) for name in filenames if name.lower().endswith(DATA_EXTENSIONS))
+        else:
+            files.update(path for path in glob.glob(pattern, recursive=True) if os.path.isfile(path))
+    return sorted(files)
+
+
+def render_file(file_path, volume, pH, gran, plot_dir, dpi):
+    """Render the 7x4 Gran figure of one file into plot_dir, reusing this process's figure."""
+    global _figure
+    from render import GranFigure
+    if _figure is None:
+        _figure = GranFigure(headless=True)
+    with instrument.stage('plot'):
+        _figure.update(volume, pH, gran)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    with instrument.stage('save'):
+        _figure.save(os.path.join(plot_dir, name + '_gran.png'), dpi=dpi)
+
+
+def evaluate_file(file_path, V=25.0, titrations=TITRATION_TYPES, plot_dir=None, dpi=None, dtype=np.float64, cache_dir=None,
+                  window=None):
+    """Evaluate one file; returns one result row (dict) per titration type. Never raises.
+
+    The Gran functions are fitted normalized (see gran_engine.gran_functions), so dtype=np.float32
+    gives the same endpoints with half the memory traffic. With plot_dir set, the Gran figure of
+    the file is also saved there at the given dpi. With cache_dir set, results are memoized there
+    (see cache.ResultCache). With window=(v_min, v_max) only the points inside that volume range
+    are evaluated (see method.analyse). While instrumentation is enabled (see instrument.py), every
+    stage of the file is recorded with the file name.
+    """
+    with instrument.stage('file', file=file_path):
+        return _evaluate_file(file_path, V, titrations, plot_dir, dpi, dtype, cache_dir, window)
+
+
+def _evaluate_file(file_path, V, titrations, plot_dir, dpi, dtype, cache_dir, window):
+    try:
+        method = make_method(analyte_volume=V, window=window)
+        if cache_dir:
+            from cache import ResultCache
+            analysis = ResultCache(cache_dir).analyse_file(file_path, method, dtype)
+        else:
+            analysis = analyse_file(file_path, method, dtype)
+        if plot_dir:
+            render_file(file_path, analysis.volume, analysis.pH, unscaled_gran(analysis), plot_dir, dpi)
+    except Exception as e:
+        return [dict(file=file_path, titration=titration, points='', status=f'error: {e}') for titration in titrations]
+
+    rows = []
+    for titration in titrations:
+        row = dict(file=file_path, titration=titration, points=analysis.volume.size)
+        endpoint = analysis.endpoints[titration]
+        if endpoint is None:
+            row['status'] = 'no linear region'
+        else:
+            row.update(volume_eq=endpoint.volume, ci_low=endpoint.ci_low, ci_high=endpoint.ci_high,
+                       stderr=endpoint.stderr, r2=endpoint.r2, branches=len(endpoint.fits), status='ok')
+        rows.append(row)
+    return rows
+
+
+def _evaluate_job(job):
+    """Process-pool entry point (must be a top-level function to be picklable)."""
+    return evaluate_file(*job)
+
+
+def _start_worker(profile, profile_memory):
+    """Process-pool initializer: every worker appends its stage records to the same JSONL profile."""
+    if profile:
+        instrument.enable(profile, profile_memory)
+
+
+def run_batch(files, V=25.0, titrations=TITRATION_TYPES, workers=None, plot_dir=None, dpi=None, dtype=np.float64, cache_dir=None,
+              window=None, profile=None, profile_memory=False, shared_memory=False):
+    """Evaluate all files, spreading them over a process pool; yields result rows in input order.
+
+    With profile set to a JSONL path, the stage records of every file are appended to it
+    (see instrument.py); profile_memory adds the allocation peak of each stage. With
+    shared_memory=True the curves are read by this process and evaluated through shared
+    memory (see shared_batch.py); plot_dir and cache_dir are not supported then.
+    """
+    if shared_memory:
+        if plot_dir or cache_dir:
+            raise ValueError("plot_dir and cache_dir are not supported with shared_memory.")
+        from shared_batch import run_shared_batch
+        yield from run_shared_batch(files, V, titrations, workers, dtype, window, profile, profile_memory)
+        return
+    jobs = [(file_path, V, tuple(titrations), plot_dir, dpi, dtype, cache_dir, window) for file_path in files]
+    if workers == 1 or len(jobs) <= 1:
+        with instrument.profiling(profile, profile_memory) if profile else nullcontext():
+            for job in jobs:
+                yield from _evaluate_job(job)
+        return
+    workers = workers or os.cpu_count() or 1
+    # Hand out files in chunks so that IPC overhead stays small for thousands of short files
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker, initargs=(profile, profile_memory)) as pool:
+        for rows in pool.map(_evaluate_job, jobs, chunksize=chunksize):
+            yield from rows
+
+
+def write_results(rows, output, fields=RESULT_FIELDS):
+    """Write result rows as CSV to a file path or '-' for stdout; returns the number of rows written."""
+    stream = sys.stdout if output == '-' else open(output, 'w', newline='')
+    try:
+        writer = csv.DictWriter(stream, fieldnames=fields, restval='')
+        writer.writeheader()
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+        return count
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Batch Gran endpoint evaluation of titration files.")
+    parser.add_argument('inputs', nargs='+', help="Data files, glob patterns (e.g. 'data/MT_data/*.dat') or directories")
+    parser.add_argument('-o', '--output', default='gran_results.csv', help="Results table (CSV); '-' for stdout (default: %(default)s)")
+    parser.add_argument('-j', '--workers', type=int, default=None, help="Number of worker processes (default: all CPUs)")
+    parser.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Initial volume to be titrated in mL (default: %(default)s)")
+    parser.add_argument('-w', '--window', type=float, nargs=2, metavar=('VMIN', 'VMAX'),
+                        help="Evaluate only the points between VMIN and VMAX mL (default: whole curve)")
+    parser.add_argument('-t', '--titration', choices=TITRATION_TYPES, action='append',
+                        help="Titration type(s) to evaluate; repeat for several (default: all)")
+    parser.add_argument('--plot-dir', help="Also save the 7x4 Gran figure of every file into this directory")
+    parser.add_argument('--dpi', type=int, default=None, help="Figure resolution (default: preview resolution)")
+    parser.add_argument('--float32', action='store_true', help="Compute the Gran functions in single precision")
+    parser.add_argument('--cache', metavar='DIR', help="Reuse results of unchanged files from this cache directory")
+    parser.add_argument('--shared-memory', action='store_true',
+                        help="Hand curves and results to the workers through shared memory (no --plot-dir or --cache)")
+    parser.add_argument('--profile', metavar='JSONL', help="Append per-stage timing records of every file to this file")
+    parser.add_argument('--profile-memory', action='store_true', help="Also record the allocation peak of every stage (slower)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function of the batch command-line interface."""
+    args = parse_args(argv)
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("Error: no data files matched the given inputs.", file=sys.stderr)
+        return 1
+    if args.workers is not None and args.workers < 1:
+        print("Error: --workers must be at least 1.", file=sys.stderr)
+        return 1
+    if args.window is not None and args.window[0] >= args.window[1]:
+        print("Error: --window VMIN must be smaller than VMAX.", file=sys.stderr)
+        return 1
+    if args.shared_memory and (args.plot_dir or args.cache):
+        print("Error: --shared-memory cannot be combined with --plot-dir or --cache.", file=sys.stderr)
+        return 1
+    titrations = args.titration or TITRATION_TYPES
+    dpi = None
+    if args.plot_dir:
+        from render import PREVIEW_DPI
+        os.makedirs(args.plot_dir, exist_ok=True)
+        dpi = args.dpi or PREVIEW_DPI
+    dtype = np.float32 if args.float32 else np.float64
+    rows = run_batch(files, args.initial_volume, titrations, args.workers, args.plot_dir, dpi, dtype, args.cache, args.window,
+                     args.profile, args.profile_memory, args.shared_memory)
+    count = write_results(rows, args.output)
+    if args.output != '-':
+        print(f"Evaluated {len(files)} files, {count} results written to '{args.output}'", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
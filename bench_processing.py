@@ -0,0 +1,170 @@
+# bench_processing.py: Processing benchmark and synthetic workload generator for PyGranTitEQP
+# Times loading, Gran/Schwarz evaluation, derivatives, endpoint fitting and rendering on simulated curves of 10^2-10^7 points
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from bench_startup import compare
+
+TITRATION_CURVES = {'StrongAcid': 'strong_acid_curve', 'StrongBase': 'strong_base_curve',
+                    'WeakAcid': 'weak_acid_curve', 'WeakBase': 'weak_base_curve'}
+SIZES = [10**2, 10**3, 10**4, 10**5, 10**6]  # add 10**7 with --sizes; it needs several GB of memory
+STAGES = ['load', 'gran', 'schwarz', 'derivatives', 'endpoint', 'render']
+# README: "Process datasets up to 10,000 points in under 5 seconds" (processing, i.e. every stage but rendering)
+REQUIRED_POINTS, REQUIRED_SECONDS = 10_000, 5.0
+
+
+def _simulation():
+    """The simulation module of data/simulated_data (not a package, so it is imported from its directory)."""
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'simulated_data')
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    import simulation
+    return simulation
+
+
+def synthetic_curve(titration='StrongAcid', n_points=1000, v_max=50.0, sigma_pH=0.002, seed=0):
+    """Simulated (volume, pH) curve of a titration type with n_points evenly spaced volumes and normal pH noise."""
+    curve = getattr(_simulation(), TITRATION_CURVES[titration])
+    volume = np.linspace(0.0, v_max, n_points)
+    pH = curve(volume) + np.random.default_rng(seed).normal(0.0, sigma_pH, size=n_points)
+    return volume, pH
+
+
+def write_curve(file_path, volume, pH):
+    """Write a curve in the two-column format of data.dat."""
+    np.savetxt(file_path, np.column_stack([volume, pH]), fmt='%.6f', delimiter='\t')
+
+
+def _stages(file_path, titration, V, render):
+    """The benchmark stages of one curve file as (name, callable) pairs; each stage feeds the next."""
+    from endpoint import find_endpoint
+    from gran_engine import compute_gran, gran_derivatives, gran_functions, gran_index
+    from loader import load_titration
+    from schwarz import schwarz_functions
+    state = {}
+
+    def load():
+        state['volume'], state['pH'] = load_titration(file_path)
+
+    def gran():
+        state['g'] = gran_functions(state['volume'], state['pH'], V)
+
+    def schwarz():
+        schwarz_functions(state['volume'], state['pH'], 1.0, V)
+
+    def derivatives():
+        gran_derivatives(state['g'], state['volume'])
+
+    def endpoint():
+        g = state['g']
+        find_endpoint(state['volume'], g[gran_index(titration + '_G1')], g[gran_index(titration + '_G2')])
+
+    def render_figure():
+        from render import GranFigure, PREVIEW_DPI
+        if 'figure' not in state:  # figure creation is a one-off cost, not part of the stage
+            state['figure'] = GranFigure(headless=True)
+            state['gran'] = compute_gran(state['volume'], state['pH'], V)
+        state['figure'].update(state['volume'], state['pH'], state['gran'])
+        state['figure'].save(os.path.join(os.path.dirname(file_path), 'figure.png'), dpi=PREVIEW_DPI)
+
+    stages = [('load', load), ('gran', gran), ('schwarz', schwarz), ('derivatives', derivatives), ('endpoint', endpoint)]
+    if render:
+        stages.append(('render', render_figure))
+    return stages, state
+
+
+def measure(titration, n_points, repeats=3, V=25.0, render_max=10**5, directory=None):
+    """Median time and peak traced memory of every stage for one synthetic curve; returns {stage: result}.
+
+    Every stage runs repeats times for the timing and once more under tracemalloc (which slows
+    it down) for the peak memory, so the two do not disturb each other.
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        file_path = os.path.join(tmp, f'{titration}_{n_points}.dat')
+        write_curve(file_path, *synthetic_curve(titration, n_points))
+        stages, state = _stages(file_path, titration, V, n_points <= render_max)
+        results = {}
+        for name, stage in stages:
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                stage()
+                times.append(time.perf_counter() - start)
+            tracemalloc.start()
+            stage()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            results[name] = {'seconds': statistics.median(times), 'peak_bytes': peak}
+        if 'figure' in state:
+            state['figure'].close()
+    return results
+
+
+def _count(text):
+    """Point count from the command line; accepts 1e6 as well as 1000000."""
+    return int(float(text))
+
+
+def environment():
+    """Versions that a baseline depends on."""
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+            'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PyGranTitEQP processing stages on simulated curves.")
+    parser.add_argument('-t', '--titration', choices=TITRATION_CURVES, action='append',
+                        help="Titration type(s) to simulate; repeat for several (default: all)")
+    parser.add_argument('-s', '--sizes', type=_count, nargs='+', default=SIZES,
+                        help="Curve lengths in points, e.g. 1e3 1e7 (default: 1e2 ... 1e6)")
+    parser.add_argument('-n', '--repeats', type=int, default=3, help="Timed runs per stage (default: %(default)s)")
+    parser.add_argument('--render-max', type=_count, default=10**5, help="Skip rendering above this many points (default: %(default)s)")
+    parser.add_argument('--save', metavar='JSON', help="Write the results as a baseline file")
+    parser.add_argument('--compare', metavar='JSON', help="Compare against a baseline file and fail on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown (default: %(default)s)")
+    parser.add_argument('--min-delta', type=float, default=0.005, help="Ignore slowdowns below this many seconds (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = False
+    print(f"{'titration':12s} {'points':>9s} " + ' '.join(f'{stage:>12s}' for stage in STAGES) + f" {'peak MiB':>9s}")
+    for titration in args.titration or list(TITRATION_CURVES):
+        for n_points in args.sizes:
+            stages = measure(titration, n_points, args.repeats, render_max=args.render_max)
+            for stage, result in stages.items():
+                results[f'{titration}/{n_points}/{stage}'] = result
+            times = ' '.join(f"{stages[stage]['seconds'] * 1000:9.1f} ms" if stage in stages else f"{'-':>12s}" for stage in STAGES)
+            peak = max(result['peak_bytes'] for result in stages.values()) / 2**20
+            print(f"{titration:12s} {n_points:9d} {times} {peak:9.1f}")
+            total = sum(result['seconds'] for stage, result in stages.items() if stage != 'render')
+            if n_points <= REQUIRED_POINTS and total > REQUIRED_SECONDS:
+                print(f"Requirement: processing {n_points} {titration} points took {total:.2f} s (limit {REQUIRED_SECONDS:.0f} s)")
+                failed = True
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('environment') != environment():
+            print("Note: the baseline was recorded in a different environment")
+        regressions = compare(results, baseline['results'], args.tolerance, args.min_delta)
+        for message in regressions:
+            print(f"Regression: {message}")
+        failed |= bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
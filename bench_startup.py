@@ -0,0 +1,83 @@
+# bench_startup.py: Startup-time benchmark for the PyGranTitEQP entry points
+# Imports each entry module in a fresh interpreter, times it, and checks that no heavy GUI/plotting module is loaded eagerly
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ENTRY_MODULES = ['gran_engine', 'endpoint', 'loader', 'batch', 'streaming', 'schwarz', 'potentiometric',
+                 'replicates', 'uncertainty', 'instrument', 'segmentation', 'preprocess', 'titration_set',
+                 'shared_batch', 'results_store', 'ingest', 'simulated_titrator',
+                 'PyGranTitEQP_prototype', 'PyGranTitEQP_prototype_range', 'PyGranTitEQP_3D', 'GUI']
+# Modules that must only be imported when a plot, DataFrame or window is requested
+LAZY_MODULES = ['matplotlib', 'pandas', 'tkinter']
+
+_PROBE = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "eager": [m for m in {lazy!r} if m in sys.modules]}}))
+'''
+
+
+def measure(module, repeats=5):
+    """Median import time of a module in fresh interpreters, plus any lazy modules it imported eagerly."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    times, eager = [], []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, lazy=LAZY_MODULES)],
+                             cwd=here, capture_output=True, text=True, check=True)
+        sample = json.loads(out.stdout.strip().splitlines()[-1])
+        times.append(sample['seconds'])
+        eager = sample['eager']
+    return {'seconds': statistics.median(times), 'eager': eager}
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Return messages for modules that got slower than the baseline by more than tolerance and min_delta seconds."""
+    regressions = []
+    for module, result in results.items():
+        if module not in baseline:
+            continue
+        before, after = baseline[module]['seconds'], result['seconds']
+        if after > before * (1 + tolerance) and after - before > min_delta:
+            regressions.append(f"{module}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure import (startup) time of the PyGranTitEQP entry points.")
+    parser.add_argument('modules', nargs='*', default=ENTRY_MODULES, help="Modules to measure (default: all entry points)")
+    parser.add_argument('-n', '--repeats', type=int, default=5, help="Fresh interpreters per module (default: %(default)s)")
+    parser.add_argument('--save', metavar='JSON', help="Write the results as a baseline file")
+    parser.add_argument('--compare', metavar='JSON', help="Compare against a baseline file and fail on regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed relative slowdown (default: %(default)s)")
+    parser.add_argument('--min-delta', type=float, default=0.02, help="Ignore slowdowns below this many seconds (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    results = {}
+    failed = False
+    for module in args.modules:
+        results[module] = result = measure(module, args.repeats)
+        eager = f"  EAGER IMPORTS: {', '.join(result['eager'])}" if result['eager'] else ''
+        print(f"{module:32s} {result['seconds'] * 1000:8.1f} ms{eager}")
+        failed |= bool(result['eager'])
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance, args.min_delta)
+        for message in regressions:
+            print(f"Regression: {message}")
+        failed |= bool(regressions)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
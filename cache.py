@@ -0,0 +1,143 @@
+# cache.py: On-disk result cache for PyGranTitEQP
+# Memoizes analyses keyed by the data file's content hash and the method parameters, with size-bounded LRU eviction
+
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from endpoint import Endpoint, LinearFit
+from method import Analysis, analyse_file, make_method
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pygrantiteqp')
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+CACHE_VERSION = 1  # bump when the cached arrays or their meaning change
+_SUFFIX = '.npz'
+
+# (path, size, mtime_ns) -> sha256, so an unchanged file is hashed only once per process
+_digests = {}
+
+
+def file_digest(file_path):
+    """SHA-256 of a file's content (memoized per path, size and modification time)."""
+    stat = os.stat(file_path)
+    stamp = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+    digest = _digests.get(stamp)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+        digest = _digests[stamp] = sha.hexdigest()
+    return digest
+
+
+def cache_key(digest, method, **extra):
+    """Key of one analysis: hash of the file digest, the complete method and any extra parameters."""
+    params = dict(make_method(**method), **extra, version=CACHE_VERSION)
+    text = digest + json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _encode_endpoints(endpoints):
+    return json.dumps({titration: None if endpoint is None else [*endpoint[:5], [list(map(float, fit)) for fit in endpoint.fits]]
+                       for titration, endpoint in endpoints.items()})
+
+
+def _decode_endpoints(text):
+    endpoints = {}
+    for titration, values in json.loads(text).items():
+        if values is None:
+            endpoints[titration] = None
+        else:
+            fits = tuple(LinearFit(int(fit[0]), int(fit[1]), *fit[2:]) for fit in values[5])
+            endpoints[titration] = Endpoint(*values[:5], fits)
+    return endpoints
+
+
+class ResultCache:
+    """Content-addressed cache of Analysis results in a directory, one .npz file per key.
+
+    A hit refreshes the entry's modification time; when the directory grows beyond max_bytes,
+    the least recently used entries are deleted. Entries are written to a temporary file and
+    renamed, so several processes can share one cache directory.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + _SUFFIX)
+
+    def get(self, key):
+        """Cached Analysis for a key, or None."""
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                analysis = Analysis(data['volume'], data['pH'], data['gran'], data['log_scale'],
+                                    _decode_endpoints(str(data['endpoints'])))
+            os.utime(path)  # mark as recently used
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return analysis
+
+    def put(self, key, analysis):
+        """Store an Analysis under a key, then evict old entries if the cache is too large."""
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, volume=analysis.volume, pH=analysis.pH, gran=analysis.gran,
+                         log_scale=analysis.log_scale, endpoints=np.array(_encode_endpoints(analysis.endpoints)))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def entries(self):
+        """(path, size, last use) of every cache entry, least recently used first."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(_SUFFIX) and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((entry.path, stat.st_size, stat.st_mtime_ns))
+        return sorted(entries, key=lambda entry: entry[2])
+
+    def evict(self, max_bytes=None):
+        """Delete least recently used entries until the cache fits into max_bytes; returns the number deleted."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        deleted = 0
+        for path, size, _ in entries:
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # already evicted by another process
+            total -= size
+            deleted += 1
+        return deleted
+
+    def clear(self):
+        """Delete all entries."""
+        return self.evict(0)
+
+    def analyse_file(self, file_path, method, dtype=np.float64):
+        """method.analyse_file through the cache: an unchanged file analysed with the same method is loaded, not recomputed."""
+        key = cache_key(file_digest(file_path), method, dtype=np.dtype(dtype).name)
+        analysis = self.get(key)
+        if analysis is None:
+            analysis = analyse_file(file_path, method, dtype)
+            self.put(key, analysis)
+        return analysis
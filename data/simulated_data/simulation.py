@@ -1,150 +1,220 @@
 import numpy as np
-from math import log10, sqrt
 
 Kw = 1e-14
 
-# --- Functions for each titration type ---
+# --- Vectorized curves for each titration type ---
+# Each *_curve function takes an array of titrant volumes Vs (mL) and returns the pH array.
+# All parameters broadcast against Vs, so Vs of shape (m, n) with parameters of shape (m, 1)
+# computes m curves in one call (see titration_grid).
 
-def pH_strong_acid_titration(Ca=0.100, V0=25.0, Cb=0.100, Vmax=50.0, step=1.0):
-    Vs = np.arange(0, Vmax+step, step)
-    rows = []
+def _initial_root(K, C):
+    """Positive root of x^2 + K*x - K*C = 0 (dissociation of the pure weak acid/base)."""
+    return (-K + np.sqrt(K*K + 4*K*C)) / 2
+
+def strong_acid_curve(Vs, Ca=0.100, V0=25.0, Cb=0.100):
+    Vs = np.asarray(Vs, dtype=float)
     n_acid = Ca * V0 / 1000.0
-    for V in Vs:
-        n_base = Cb * V / 1000.0
-        Vtot = (V0 + V)/1000.0
-        if n_base < n_acid:
-            H = (n_acid - n_base) / Vtot
-            pH = -log10(H)
-        elif abs(n_base - n_acid) < 1e-12:
-            pH = 7.00
-        else:
-            OH = (n_base - n_acid) / Vtot
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        rows.append((V, pH))
-    return rows
-
-def pH_strong_base_titration(Cb=0.100, V0=25.0, Ca=0.100, Vmax=50.0, step=1.0):
-    Vs = np.arange(0, Vmax+step, step)
-    rows = []
+    n_base = Cb * Vs / 1000.0
+    Vtot = (V0 + Vs)/1000.0
+    with np.errstate(divide='ignore', invalid='ignore'):  # branches masked out by np.select may be invalid
+        return np.select(
+            [n_base < n_acid, np.abs(n_base - n_acid) < 1e-12],
+            [-np.log10((n_acid - n_base) / Vtot), 7.00],
+            14.0 + np.log10((n_base - n_acid) / Vtot))
+
+def strong_base_curve(Vs, Cb=0.100, V0=25.0, Ca=0.100):
+    Vs = np.asarray(Vs, dtype=float)
     n_base = Cb * V0 / 1000.0
-    for V in Vs:
-        n_acid = Ca * V / 1000.0
-        Vtot = (V0 + V)/1000.0
-        if n_acid < n_base:
-            OH = (n_base - n_acid) / Vtot
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        elif abs(n_acid - n_base) < 1e-12:
-            pH = 7.00
-        else:
-            H = (n_acid - n_base) / Vtot
-            pH = -log10(H)
-        rows.append((V, pH))
-    return rows
-
-def pH_weak_acid_titration(Ca=0.100, V0=25.0, Cb=0.100, pKa=4.76, Vmax=50.0, step=1.0):
-    Vs = np.arange(0, Vmax+step, step)
-    Ka = 10**(-pKa)
-    rows = []
+    n_acid = Ca * Vs / 1000.0
+    Vtot = (V0 + Vs)/1000.0
+    with np.errstate(divide='ignore', invalid='ignore'):  # branches masked out by np.select may be invalid
+        return np.select(
+            [n_acid < n_base, np.abs(n_acid - n_base) < 1e-12],
+            [14.0 + np.log10((n_base - n_acid) / Vtot), 7.00],
+            -np.log10((n_acid - n_base) / Vtot))
+
+def weak_acid_curve(Vs, Ca=0.100, V0=25.0, Cb=0.100, pKa=4.76):
+    Vs = np.asarray(Vs, dtype=float)
+    Ka = 10**(-np.asarray(pKa, dtype=float))
     n_HA_init = Ca * V0 / 1000.0
-    for V in Vs:
-        n_OH = Cb * V / 1000.0
-        Vtot = (V0 + V)/1000.0
-        if n_OH == 0:
-            C = n_HA_init / Vtot
-            a=1.0; b=Ka; c=-Ka*C
-            x = (-b + sqrt(b*b - 4*a*c))/(2*a)
-            H = x
-            pH = -log10(H)
-        elif n_OH < n_HA_init - 1e-12:
-            n_A = n_OH
-            n_HA = n_HA_init - n_OH
-            pH = pKa + log10(n_A / n_HA)
-        elif abs(n_OH - n_HA_init) < 1e-12:
-            C_salt = n_OH / Vtot
-            Kb = Kw / Ka
-            OH = sqrt(Kb * C_salt)
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        else:
-            OH = (n_OH - n_HA_init) / Vtot
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        rows.append((V, pH))
-    return rows
-
-def pH_weak_base_titration(Cb=0.100, V0=25.0, Ca=0.100, pKb=4.75, Vmax=50.0, step=1.0):
-    Vs = np.arange(0, Vmax+step, step)
-    Kb = 10**(-pKb)
+    n_OH = Cb * Vs / 1000.0
+    Vtot = (V0 + Vs)/1000.0
+    Kb = Kw / Ka
+    with np.errstate(divide='ignore', invalid='ignore'):  # branches masked out by np.select may be invalid
+        return np.select(
+            [n_OH == 0, n_OH < n_HA_init - 1e-12, np.abs(n_OH - n_HA_init) < 1e-12],
+            [-np.log10(_initial_root(Ka, n_HA_init / Vtot)),
+             pKa + np.log10(n_OH / (n_HA_init - n_OH)),
+             14.0 + np.log10(np.sqrt(Kb * n_OH / Vtot))],
+            14.0 + np.log10((n_OH - n_HA_init) / Vtot))
+
+def weak_base_curve(Vs, Cb=0.100, V0=25.0, Ca=0.100, pKb=4.75):
+    Vs = np.asarray(Vs, dtype=float)
+    Kb = 10**(-np.asarray(pKb, dtype=float))
     pKa = 14.0 - pKb
-    rows = []
     n_B_init = Cb * V0 / 1000.0
-    for V in Vs:
-        n_H = Ca * V / 1000.0
-        Vtot = (V0 + V)/1000.0
-        if n_H == 0:
-            C = n_B_init / Vtot
-            a=1.0; b=Kb; c=-Kb*C
-            x = (-b + sqrt(b*b - 4*a*c))/(2*a)
-            OH = x
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        elif n_H < n_B_init - 1e-12:
-            n_B = n_B_init - n_H
-            n_BH = n_H
-            pH = pKa + log10(n_B / n_BH)
-        elif abs(n_H - n_B_init) < 1e-12:
-            C_salt = n_H / Vtot
-            Ka = Kw / Kb
-            H = sqrt(Ka * C_salt)
-            pH = -log10(H)
-        else:
-            H = (n_H - n_B_init) / Vtot
-            pH = -log10(H)
-        rows.append((V, pH))
-    return rows
-
-def pH_diprotic_acid_titration(Ca=0.050, V0=25.0, Cb=0.100, pKa1=2.00, pKa2=7.00, Vmax=50.0, step=0.5):
-    Ka1 = 10**(-pKa1)
-    Ka2 = 10**(-pKa2)
-    Vs = np.arange(0, Vmax+step, step)
-    rows = []
+    n_H = Ca * Vs / 1000.0
+    Vtot = (V0 + Vs)/1000.0
+    Ka = Kw / Kb
+    with np.errstate(divide='ignore', invalid='ignore'):  # branches masked out by np.select may be invalid
+        return np.select(
+            [n_H == 0, n_H < n_B_init - 1e-12, np.abs(n_H - n_B_init) < 1e-12],
+            [14.0 + np.log10(_initial_root(Kb, n_B_init / Vtot)),
+             pKa + np.log10((n_B_init - n_H) / n_H),
+             -np.log10(np.sqrt(Ka * n_H / Vtot))],
+            -np.log10((n_H - n_B_init) / Vtot))
+
+def diprotic_acid_curve(Vs, Ca=0.050, V0=25.0, Cb=0.100, pKa1=2.00, pKa2=7.00):
+    Vs = np.asarray(Vs, dtype=float)
+    Ka1 = 10**(-np.asarray(pKa1, dtype=float))
+    Ka2 = 10**(-np.asarray(pKa2, dtype=float))
     n_H2A = Ca * V0 / 1000.0
-    for V in Vs:
-        n_OH = Cb * V / 1000.0
-        Vtot = (V0 + V)/1000.0
-        if n_OH == 0:
-            C = n_H2A / Vtot
-            a=1.0; b=Ka1; c=-Ka1*C
-            x = (-b + sqrt(b*b - 4*a*c))/(2*a)
-            H = x
-            pH = -log10(H)
-        elif n_OH < n_H2A - 1e-12:
-            n_HA = n_OH
-            n_H2A_rem = n_H2A - n_OH
-            pH = pKa1 + log10(n_HA / n_H2A_rem)
-        elif abs(n_OH - n_H2A) < 1e-12:
-            pH = 0.5 * (pKa1 + pKa2)
-        elif n_OH < 2*n_H2A - 1e-12:
-            n_A2 = n_OH - n_H2A
-            n_HA = n_H2A - (n_OH - n_H2A)
-            pH = pKa2 + log10(n_A2 / n_HA)
-        elif abs(n_OH - 2*n_H2A) < 1e-12:
-            C_salt = n_OH / Vtot
-            Kb2 = Kw / Ka2
-            OH = sqrt(Kb2 * C_salt)
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        else:
-            OH = (n_OH - 2*n_H2A) / Vtot
-            pOH = -log10(OH)
-            pH = 14.0 - pOH
-        rows.append((V, pH))
-    return rows
+    n_OH = Cb * Vs / 1000.0
+    Vtot = (V0 + Vs)/1000.0
+    Kb2 = Kw / Ka2
+    with np.errstate(divide='ignore', invalid='ignore'):  # branches masked out by np.select may be invalid
+        return np.select(
+            [n_OH == 0,
+             n_OH < n_H2A - 1e-12,
+             np.abs(n_OH - n_H2A) < 1e-12,
+             n_OH < 2*n_H2A - 1e-12,
+             np.abs(n_OH - 2*n_H2A) < 1e-12],
+            [-np.log10(_initial_root(Ka1, n_H2A / Vtot)),
+             pKa1 + np.log10(n_OH / (n_H2A - n_OH)),
+             0.5 * (pKa1 + pKa2) + np.zeros_like(Vs),
+             pKa2 + np.log10((n_OH - n_H2A) / (n_H2A - (n_OH - n_H2A))),
+             14.0 + np.log10(np.sqrt(Kb2 * n_OH / Vtot))],
+            14.0 + np.log10((n_OH - 2*n_H2A) / Vtot))
+
+# --- Exact charge-balance solution ---
+
+def charge_balance_curve(Vs, C0=0.100, V0=25.0, Ct=0.100, pKas=(), analyte='acid', tol=1e-10, max_iter=100):
+    """pH from the full charge balance for an n-protic acid (or base) titrated with a strong base (or acid).
+
+    pKas are the stepwise acid dissociation constants of the analyte (for a base: of its
+    conjugate acids); an empty sequence means a strong, fully dissociated analyte. Each
+    entry may be an array broadcasting against Vs. [H+] is solved for every point at once
+    with a bracketed Newton iteration on ln(cations) - ln(anions) as a function of ln[H+],
+    which is monotonic and close to linear, so a handful of iterations suffice.
+    """
+    if analyte not in ('acid', 'base'):
+        raise ValueError("analyte must be 'acid' or 'base'")
+    Vs = np.asarray(Vs, dtype=float)
+    Vtot = V0 + Vs
+    C = C0 * V0 / Vtot                     # total analyte concentration
+    titrant = Ct * Vs / Vtot               # Na+ (base titrant) or Cl- (acid titrant)
+    n = len(pKas)
+    shape = np.broadcast(Vs, C, *pKas).shape
+    if analyte == 'acid':
+        pos, neg = titrant, (C if n == 0 else 0.0)
+    else:
+        pos, neg = (C if n == 0 else 0.0), titrant
+    pos = np.broadcast_to(pos, shape).ravel()
+    neg = np.broadcast_to(neg, shape).ravel()
+    C = np.broadcast_to(C, shape).ravel()
+    # log10 of the cumulative products Ka1*...*Kaj, j = 0..n, flattened to (n + 1, points)
+    log_beta = np.cumsum(np.stack([np.broadcast_to(0.0, shape)]
+                                  + [np.broadcast_to(-np.asarray(pKa, dtype=float), shape) for pKa in pKas]), axis=0)
+    log_beta = log_beta.reshape(n + 1, -1)
+    j = np.arange(n + 1, dtype=float)[:, None]
+    ln10 = np.log(10.0)
+
+    def balance(u, idx):
+        """ln(cations) - ln(anions) at u = ln[H+] for the points idx, and its derivative (always > 0)."""
+        h = np.exp(u)
+        oh = Kw / h
+        p, dp = h + pos[idx], h
+        q, dq = oh + neg[idx], -oh
+        if n:
+            # Species fractions alpha_j ~ h^(n-j) * Ka1*...*Kaj, normalised in the log domain
+            log_terms = (n - j) * (u / ln10) + log_beta[:, idx]
+            alpha = np.exp((log_terms - log_terms.max(axis=0)) * ln10)
+            alpha /= alpha.sum(axis=0)
+            nbar = (j * alpha).sum(axis=0)            # mean number of protons released
+            var = (j * j * alpha).sum(axis=0) - nbar**2
+            if analyte == 'acid':
+                q, dq = q + C[idx] * nbar, dq - C[idx] * var
+            else:
+                p, dp = p + C[idx] * (n - nbar), dp + C[idx] * var
+        return np.log(p) - np.log(q), dp / p - dq / q
+
+    size = pos.size
+    lo = np.full(size, -16.0 * ln10)
+    hi = np.full(size, 2.0 * ln10)
+    u = np.full(size, -7.0 * ln10)
+    active = np.arange(size)
+    for _ in range(max_iter):
+        g, dg = balance(u[active], active)
+        below = g < 0
+        lo[active] = np.where(below, u[active], lo[active])
+        hi[active] = np.where(below, hi[active], u[active])
+        u_new = u[active] - g / dg
+        outside = (u_new < lo[active]) | (u_new > hi[active]) | ~np.isfinite(u_new)
+        u_new = np.where(outside, 0.5 * (lo[active] + hi[active]), u_new)
+        converged = np.abs(u_new - u[active]) < tol
+        u[active] = u_new
+        active = active[~converged]
+        if active.size == 0:
+            break
+    return (-u / ln10).reshape(shape)
+
+def titration_grid(curve, Vmax=50.0, step=1.0, **params):
+    """Compute many curves in one call over a grid of parameters.
+
+    step and every keyword parameter (e.g. Ca, pKa) may be arrays; they are broadcast
+    against each other to a parameter grid of shape P. Returns (Vs, pH), both of shape
+    P + (n,), where n is the length of the curve with the smallest step. Rows with a
+    larger step are padded with nan beyond Vmax.
+    """
+    step = np.asarray(step, dtype=float)
+    arrays = np.broadcast_arrays(step, *[np.asarray(p, dtype=float) for p in params.values()])
+    step, values = arrays[0], arrays[1:]
+    n = int(np.floor(np.max(Vmax / step) + 1e-9)) + 1
+    Vs = step[..., None] * np.arange(n)
+    Vs[Vs > Vmax + 1e-9] = np.nan
+    pH = curve(Vs, **{name: value[..., None] for name, value in zip(params, values)})
+    return Vs, pH
+
+# --- Functions for each titration type (list of (V, pH) rows, as written to the .txt files) ---
+# exact=True solves the full charge balance instead of the piecewise approximations
+
+def _rows(Vs, pH):
+    return list(zip(Vs.tolist(), pH.tolist()))
+
+def pH_strong_acid_titration(Ca=0.100, V0=25.0, Cb=0.100, Vmax=50.0, step=1.0, exact=False):
+    Vs = np.arange(0, Vmax+step, step)
+    if exact:
+        return _rows(Vs, charge_balance_curve(Vs, Ca, V0, Cb))
+    return _rows(Vs, strong_acid_curve(Vs, Ca, V0, Cb))
+
+def pH_strong_base_titration(Cb=0.100, V0=25.0, Ca=0.100, Vmax=50.0, step=1.0, exact=False):
+    Vs = np.arange(0, Vmax+step, step)
+    if exact:
+        return _rows(Vs, charge_balance_curve(Vs, Cb, V0, Ca, analyte='base'))
+    return _rows(Vs, strong_base_curve(Vs, Cb, V0, Ca))
+
+def pH_weak_acid_titration(Ca=0.100, V0=25.0, Cb=0.100, pKa=4.76, Vmax=50.0, step=1.0, exact=False):
+    Vs = np.arange(0, Vmax+step, step)
+    if exact:
+        return _rows(Vs, charge_balance_curve(Vs, Ca, V0, Cb, (pKa,)))
+    return _rows(Vs, weak_acid_curve(Vs, Ca, V0, Cb, pKa))
+
+def pH_weak_base_titration(Cb=0.100, V0=25.0, Ca=0.100, pKb=4.75, Vmax=50.0, step=1.0, exact=False):
+    Vs = np.arange(0, Vmax+step, step)
+    if exact:
+        return _rows(Vs, charge_balance_curve(Vs, Cb, V0, Ca, (14.0 - pKb,), analyte='base'))
+    return _rows(Vs, weak_base_curve(Vs, Cb, V0, Ca, pKb))
+
+def pH_diprotic_acid_titration(Ca=0.050, V0=25.0, Cb=0.100, pKa1=2.00, pKa2=7.00, Vmax=50.0, step=0.5, exact=False):
+    Vs = np.arange(0, Vmax+step, step)
+    if exact:
+        return _rows(Vs, charge_balance_curve(Vs, Ca, V0, Cb, (pKa1, pKa2)))
+    return _rows(Vs, diprotic_acid_curve(Vs, Ca, V0, Cb, pKa1, pKa2))
 
 
 if __name__ == "__main__":
+    import sys
+    exact = "--exact" in sys.argv[1:]  # solve the full charge balance instead of the piecewise approximations
     all_cases = {
         "strong_acid.txt": pH_strong_acid_titration,
         "strong_base.txt": pH_strong_base_titration,
@@ -154,7 +224,7 @@ if __name__ == "__main__":
     }
 
     for filename, func in all_cases.items():
-        data = func()
+        data = func(exact=exact)
         with open(filename, "w") as f:
             for V, pH in data:
                 f.write(f"{V:.2f} {pH:.4f}\n")
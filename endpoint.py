@@ -0,0 +1,300 @@
+# endpoint.py: Linear-region detection and endpoint calculation for Gran plots
+# Searches candidate segments with prefix-sum least squares (O(1) per segment) and takes the endpoint from the fits
+
+from collections import namedtuple
+from statistics import NormalDist
+
+import numpy as np
+
+# One-sided level of the linearity test of find_linear_region, and the lowest R² it may accept
+LINEARITY_LEVEL = 0.99
+NOISY_R2_MIN = 0.9
+
+# start/stop are indices into the curve (stop exclusive); slope/intercept refer to the unscaled Gran values
+LinearFit = namedtuple('LinearFit', ['start', 'stop', 'slope', 'intercept', 'r2', 'x_intercept', 'stderr'])
+Endpoint = namedtuple('Endpoint', ['volume', 'r2', 'ci_low', 'ci_high', 'stderr', 'fits'])
+
+
+def t_quantile(p, dof):
+    """Approximate Student-t quantile (Cornish-Fisher expansion around the normal quantile)."""
+    z = NormalDist().inv_cdf(p)
+    dof = np.maximum(dof, 1.0)  # float: dof**3 overflows integers on very long segments
+    return (z + (z**3 + z) / (4 * dof) + (5 * z**5 + 16 * z**3 + 3 * z) / (96 * dof**2)
+            + (3 * z**7 + 19 * z**5 + 17 * z**3 - 15 * z) / (384 * dof**3))
+
+
+class SegmentFitter:
+    """Prefix sums of a curve so that the least-squares line of any segment costs O(1).
+
+    x is centred and y is scaled to max |y| = 1 before summing; R², x-intercepts and their
+    standard errors are invariant under this transform, and it keeps the differences of
+    prefix sums accurate for Gran values spanning many decades.
+    """
+
+    def __init__(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if x.ndim != 1 or x.shape != y.shape:
+            raise ValueError("x and y must be 1-D arrays of the same length.")
+        self.x_shift = x.mean() if x.size else 0.0
+        peak = np.max(np.abs(y)) if y.size else 0.0
+        self.y_scale = peak if peak > 0 and np.isfinite(peak) else 1.0
+        xc = x - self.x_shift
+        yc = y / self.y_scale
+        self.x = xc
+        self.y = yc
+        zero = np.zeros(1)
+        self.sx = np.concatenate([zero, np.cumsum(xc)])
+        self.sy = np.concatenate([zero, np.cumsum(yc)])
+        self.sxx = np.concatenate([zero, np.cumsum(xc * xc)])
+        self.sxy = np.concatenate([zero, np.cumsum(xc * yc)])
+        self.syy = np.concatenate([zero, np.cumsum(yc * yc)])
+
+    def __len__(self):
+        return self.x.size
+
+    def fit(self, start, stop):
+        """Fit all segments [start, stop) at once; returns (slope, intercept, r2, rss, n) in scaled units."""
+        start = np.asarray(start)
+        stop = np.asarray(stop)
+        n = (stop - start).astype(float)
+        sx = self.sx[stop] - self.sx[start]
+        sy = self.sy[stop] - self.sy[start]
+        sxx_c = (self.sxx[stop] - self.sxx[start]) - sx * sx / n
+        sxy_c = (self.sxy[stop] - self.sxy[start]) - sx * sy / n
+        syy_c = (self.syy[stop] - self.syy[start]) - sy * sy / n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = sxy_c / sxx_c
+            intercept = (sy - slope * sx) / n
+            rss = np.maximum(syy_c - slope * sxy_c, 0.0)
+            r2 = np.where(syy_c > 0, 1.0 - rss / syy_c, 0.0)
+        return slope, intercept, r2, rss, n
+
+    def x_intercept(self, start, stop, slope, intercept, rss, n):
+        """Volume where the fitted line crosses G = 0, and its standard error (inverse prediction)."""
+        sx = self.sx[stop] - self.sx[start]
+        sxx_c = (self.sxx[stop] - self.sxx[start]) - sx * sx / n
+        y_mean = (self.sy[stop] - self.sy[start]) / n
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x0 = -intercept / slope
+            s = np.sqrt(rss / np.maximum(n - 2, 1))
+            stderr = s / np.abs(slope) * np.sqrt(1.0 / n + y_mean**2 / (slope**2 * sxx_c))
+        return x0 + self.x_shift, stderr
+
+    def to_fit(self, start, stop):
+        """Return the LinearFit of a single segment in the original (unscaled) units."""
+        slope, intercept, r2, rss, n = self.fit(start, stop)
+        x0, stderr = self.x_intercept(start, stop, slope, intercept, rss, n)
+        slope_raw = float(slope * self.y_scale)
+        intercept_raw = float(intercept * self.y_scale) - slope_raw * self.x_shift
+        return LinearFit(int(start), int(stop), slope_raw, intercept_raw, float(r2), float(x0), float(stderr))
+
+
+def _candidate_windows(boundaries, min_points):
+    """All (start, stop) pairs from a sorted set of boundary indices with at least min_points points."""
+    start, stop = np.meshgrid(boundaries, boundaries, indexing='ij')
+    keep = (stop - start) >= min_points
+    return start[keep], stop[keep]
+
+
+def _relative_noise(volume, g):
+    """Relative noise variance of a Gran function, estimated from the pseudo-residuals of ln|G|.
+
+    A pH error dpH changes any Gran value G by the factor 10**dpH, so the noise is additive in
+    ln|G| and its relative size is the same over the whole curve. The pseudo-residual of a point
+    (its distance from the line through its two neighbours, Gasser et al. 1986) has the variance
+    of that noise wherever ln|G| is straight or gently curved; the median ignores the jump.
+    """
+    x, y = np.asarray(volume, dtype=float), np.asarray(g, dtype=float)
+    with np.errstate(divide='ignore'):
+        keep = np.abs(y) > 0
+        x, y = x[keep], np.log(np.abs(y[keep]))
+    if x.size < 3:
+        return 0.0
+    h1, h2 = x[1:-1] - x[:-2], x[2:] - x[1:-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.where(h1 + h2 > 0, h2 / (h1 + h2), 0.5)
+    e = a * y[:-2] + (1 - a) * y[2:] - y[1:-1]
+    # 0.4549 is the median of chi-square with one degree of freedom
+    return float(np.median(e * e / (a * a + (1 - a)**2 + 1)) / 0.4549)
+
+
+def _consistent_with_noise(fitter, start, stop, r2, rss, n, noise):
+    """True for segments whose scatter about their line is no larger than their noise (one-sided chi-square test).
+
+    noise is the relative noise variance of the curve (see _relative_noise); the critical ratio
+    is the Wilson-Hilferty approximation of the chi-square quantile at LINEARITY_LEVEL. The
+    estimate is only as good as the curve is smooth between its points, so R² must still reach
+    NOISY_R2_MIN: coarse steps across a strongly curved stretch would otherwise pass as noise.
+    """
+    dof = np.maximum(n - 2, 1)
+    z = NormalDist().inv_cdf(LINEARITY_LEVEL)
+    critical = (1 - 2 / (9 * dof) + z * np.sqrt(2 / (9 * dof)))**3
+    expected = noise * (fitter.syy[stop] - fitter.syy[start]) / n
+    return (rss / dof <= critical * expected) & (r2 >= NOISY_R2_MIN)
+
+
+def _best_window(fitter, start, stop, r2_min, slope_sign, min_span, y_range, noise=0.0):
+    """Pick the window whose x-intercept is best determined; returns an index into start/stop or None.
+
+    Minimising the standard error of the intercept trades segment length against curvature:
+    extending a window over the bend at the endpoint inflates the residuals faster than the
+    extra points shrink the error. Windows within numerical noise of the minimum are ties,
+    and the longest of those wins.
+    """
+    slope, intercept, r2, rss, n = fitter.fit(start, stop)
+    span = np.abs(slope) * (fitter.x[stop - 1] - fitter.x[start])
+    ok = np.isfinite(slope) & (span >= min_span * y_range) & ((r2 >= r2_min) | _consistent_with_noise(fitter, start, stop, r2, rss, n, noise))
+    if slope_sign:
+        ok &= np.sign(slope) == slope_sign
+    if not ok.any():
+        return None
+    _, stderr = fitter.x_intercept(start, stop, slope, intercept, rss, n)
+    stderr = np.where(ok & np.isfinite(stderr), stderr, np.inf)
+    tolerance = 1e-12 * max(np.ptp(fitter.x), 1.0)
+    ties = stderr <= stderr.min() * (1 + 1e-6) + tolerance
+    return int(np.argmax(np.where(ties, n, -1)))
+
+
+def find_linear_region(volume, g, min_points=5, r2_min=0.999, slope_sign=0, min_span=0.1, max_candidates=256):
+    """Find the linear segment of a Gran function that best determines its volume intercept.
+
+    Segment boundaries are first searched on a grid of at most max_candidates indices
+    (all O(max_candidates²) windows are scored at once from prefix sums), then refined
+    point by point around the best coarse window. A window counts as linear if its R²
+    reaches r2_min or if its residuals are no larger than the pH noise of the curve allows (see
+    _consistent_with_noise): noise puts a ceiling on the R² of a Gran branch however many
+    points it has, while on noise-free curves the noise estimate is only rounding error.
+    slope_sign restricts the search to falling (-1) or rising (+1) branches and min_span
+    requires the fitted line to cover that fraction of the Gran function's range, which
+    rejects flat tails near zero. Returns a LinearFit, or None if no segment is linear.
+    """
+    fitter = SegmentFitter(volume, g)
+    n = len(fitter)
+    if n < min_points:
+        return None
+    finite = np.isfinite(fitter.y)
+    if not finite.all():
+        raise ValueError("Gran function contains non-finite values.")
+    y_range = np.ptp(fitter.y)
+    if y_range == 0:
+        return None
+    noise = _relative_noise(volume, fitter.y)
+
+    if n + 1 <= max_candidates:
+        boundaries = np.arange(n + 1)
+    else:
+        boundaries = np.unique(np.linspace(0, n, max_candidates).round().astype(int))
+    start, stop = _candidate_windows(boundaries, min_points)
+    best = _best_window(fitter, start, stop, r2_min, slope_sign, min_span, y_range, noise)
+    if best is None:
+        return None
+    best_start, best_stop = start[best], stop[best]
+
+    # Refine the coarse boundaries to single-point resolution; on long curves this takes several
+    # rounds, each scoring at most max_candidates² windows around the current best one
+    step = int(np.max(np.diff(boundaries)))
+    while step > 1:
+        starts, next_step = _refine_boundaries(best_start, step, n, max_candidates)
+        stops, _ = _refine_boundaries(best_stop, step, n, max_candidates)
+        start, stop = np.meshgrid(starts, stops, indexing='ij')
+        keep = (stop - start) >= min_points
+        start, stop = start[keep], stop[keep]
+        refined = _best_window(fitter, start, stop, r2_min, slope_sign, min_span, y_range, noise)
+        if refined is not None:
+            best_start, best_stop = start[refined], stop[refined]
+        step = next_step
+    return fitter.to_fit(best_start, best_stop)
+
+
+def _refine_boundaries(index, step, n, max_candidates):
+    """Boundary indices within ±step of index (at most max_candidates of them) and their spacing."""
+    low, high = max(index - step, 0), min(index + step, n)
+    if high - low + 1 <= max_candidates:
+        return np.arange(low, high + 1), 1
+    grid = np.unique(np.append(np.linspace(low, high, max_candidates).round().astype(int), index))
+    return grid, int(np.max(np.diff(grid)))
+
+
+def find_endpoint(volume, g1, g2=None, confidence=0.95, **search):
+    """Locate the equivalence volume from the linear branches of a G1 (and optionally G2) Gran plot.
+
+    Each Gran branch is linear in v and reaches G = 0 at the equivalence volume, so each
+    fitted line is intersected with the volume axis. Intersections that cannot be the
+    endpoint of their branch are dropped (see plausible_fits); with both branches left the two
+    intersections are combined by inverse-variance weighting. Extra keyword arguments are passed
+    on to find_linear_region. Returns an Endpoint, or None if no plausible linear branch is found.
+    """
+    volume = np.asarray(volume, dtype=float)
+    fit1 = find_linear_region(volume, g1, slope_sign=-1, **search)
+    fit2 = None if g2 is None else find_linear_region(volume, g2, slope_sign=1, **search)
+    return combine_fits(plausible_fits(volume, fit1, fit2), confidence)
+
+
+def plausible_fits(volume, fit1=None, fit2=None, tolerance=3.0):
+    """The fits of a G1 (falling, before the endpoint) and a G2 (rising, after it) branch whose intercepts can be the endpoint.
+
+    An intercept must lie within the titrated volume range and on the correct side of its own
+    branch: the G1 points before it, the G2 points after it. With both branches, each
+    intercept must also lie between the end of the G1 branch and the start of the G2 branch.
+    The points next to the endpoint are near G = 0 and fit a branch equally well on either
+    side of it, so every bound is relaxed by tolerance times the volume step at the end of the
+    branch that faces the endpoint plus the noise of the branch in volume units (residual
+    standard deviation / |slope|). Returns a list of the kept fits (None entries are skipped).
+    """
+    def slack(fit, edge, inner):
+        x = volume[fit.start:fit.stop]
+        sxx = np.sum((x - x.mean())**2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # stderr = s / |slope| * sqrt(1/n + (mean x - x0)² / sxx), solved for s / |slope|
+            noise = fit.stderr / np.sqrt(1.0 / x.size + (x.mean() - fit.x_intercept)**2 / sxx)
+        noise = noise if np.isfinite(noise) else 0.0
+        return tolerance * (abs(volume[edge] - volume[inner]) + noise)
+
+    def within(fit, low, high, margin):
+        return low - margin <= fit.x_intercept <= high + margin
+
+    low, high = volume[0], volume[-1]
+    g1_end = low if fit1 is None else volume[fit1.stop - 1]
+    g2_start = high if fit2 is None else volume[fit2.start]
+    if g1_end > g2_start:  # overlapping branches: only check each against its own points
+        g1_end, g2_start = low, high
+    fits = []
+    if fit1 is not None and within(fit1, max(low, volume[fit1.stop - 1]), g2_start, slack(fit1, fit1.stop - 1, fit1.stop - 2)):
+        fits.append(fit1)
+    if fit2 is not None and within(fit2, g1_end, min(high, volume[fit2.start]), slack(fit2, fit2.start, fit2.start + 1)):
+        fits.append(fit2)
+    return fits
+
+
+def combine_fits(fits, confidence=0.95):
+    """Combine the volume intercepts of one or more LinearFits by inverse-variance weighting.
+
+    If the intercepts scatter more than their standard errors allow (reduced chi-square above
+    1, e.g. two branches further apart than their combined standard error), the standard error
+    and confidence interval are widened by the Birge ratio sqrt(chi-square / (n - 1)).
+    Exact fits (noise-free curves) have stderr 0, so their interval has zero width.
+    Returns an Endpoint with a t-based confidence interval, or None if no fit has a finite intercept.
+    """
+    fits = [fit for fit in fits if np.isfinite(fit.x_intercept) and np.isfinite(fit.stderr)]
+    if not fits:
+        return None
+
+    x0 = np.array([fit.x_intercept for fit in fits])
+    se = np.array([fit.stderr for fit in fits])
+    if np.any(se == 0):
+        # Exact (noise-free) fits: average only those, the others carry no weight
+        weights = (se == 0).astype(float)
+        stderr = 0.0
+        volume_eq = float(np.sum(weights * x0) / np.sum(weights))
+    else:
+        weights = 1.0 / se**2
+        stderr = float(np.sqrt(1.0 / np.sum(weights)))
+        volume_eq = float(np.sum(weights * x0) / np.sum(weights))
+        if len(fits) > 1:
+            reduced_chi2 = float(np.sum(weights * (x0 - volume_eq)**2)) / (len(fits) - 1)
+            stderr *= float(np.sqrt(max(reduced_chi2, 1.0)))
+    dof = sum(fit.stop - fit.start - 2 for fit in fits)
+    half_width = float(t_quantile(0.5 + confidence / 2, dof)) * stderr
+    r2 = min(fit.r2 for fit in fits)
+    return Endpoint(volume_eq, float(r2), volume_eq - half_width, volume_eq + half_width, stderr, tuple(fits))
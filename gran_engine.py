@@ -0,0 +1,142 @@
+# gran_engine.py: Headless Gran engine for PyGranTitEQP
+# Computes all G1's and G2's and their first and second derivatives from volume/pH arrays (NumPy only, no plotting)
+
+import numpy as np
+
+# Gran functions in plotting order: all G1's (row 2 of the 7x4 grid) followed by all G2's (row 5)
+# Each entry: (name, formula, uses V in the volume term, sign of pH in the exponent)
+GRAN_FUNCTIONS = (
+    ('StrongAcid_G1', '(v + V) * 10^(-pH)', True, -1),
+    ('StrongBase_G1', '(v + V) * 10^(pH)', True, 1),
+    ('WeakAcid_G1', 'v * 10^(-pH)', False, -1),
+    ('WeakBase_G1', 'v * 10^(pH)', False, 1),
+    ('StrongAcid_G2', '(v + V) * 10^(pH)', True, 1),
+    ('StrongBase_G2', '(v + V) * 10^(-pH)', True, -1),
+    ('WeakAcid_G2', '(v + V) * 10^(pH)', True, 1),
+    ('WeakBase_G2', '(v + V) * 10^(-pH)', True, -1),
+)
+GRAN_NAMES = tuple(entry[0] for entry in GRAN_FUNCTIONS)
+
+# Indices into the second axis of the stacked result
+G, DG, D2G = 0, 1, 2
+
+_USES_V = np.array([entry[2] for entry in GRAN_FUNCTIONS], dtype=float)[:, None]
+_PH_SIGN = np.array([entry[3] for entry in GRAN_FUNCTIONS], dtype=float)[:, None]
+
+
+def gran_index(name):
+    """Return the row of a Gran function in the stacked result, e.g. gran_index('StrongAcid_G1') -> 0."""
+    try:
+        return GRAN_NAMES.index(name)
+    except ValueError:
+        raise ValueError(f"Unknown Gran function '{name}'. Choose from: {', '.join(GRAN_NAMES)}") from None
+
+
+def _segment_extremes(pH, offsets):
+    """Largest and smallest pH of every curve [offsets[i], offsets[i + 1]) of a concatenated array."""
+    if offsets is None:
+        return np.max(pH), np.min(pH)
+    starts = np.asarray(offsets)[:-1]
+    return np.maximum.reduceat(pH, starts), np.minimum.reduceat(pH, starts)
+
+
+def gran_log_scale(pH, offsets=None):
+    """log10 of the normalization factor of each Gran function: max(pH) for 10^pH rows, -min(pH) for 10^-pH rows.
+
+    With offsets (concatenated curves, see gran_functions) the result has one column per curve.
+    """
+    pH = np.asarray(pH, dtype=float)
+    high, low = _segment_extremes(pH, offsets)
+    return np.where(_PH_SIGN > 0, high, -low) if offsets is not None else np.where(_PH_SIGN[:, 0] > 0, high, -low)
+
+
+def gran_functions(volume, pH, V=25.0, normalize=False, dtype=np.float64, offsets=None):
+    """Evaluate all eight Gran functions at once; returns an array of shape (8, n).
+
+    With normalize=True each function is divided by 10^gran_log_scale(pH), i.e. the exponent is
+    shifted to at most 0 before exponentiation. Values then stay within the volume term instead
+    of spanning 10^-14 to 10^14, which makes float32 safe; linear regions, R² and x-intercepts
+    are unchanged. volume and pH may hold several concatenated curves, curve i spanning
+    offsets[i]:offsets[i + 1]; each is then normalized on its own. V is a scalar or one value
+    per point.
+    """
+    volume = np.asarray(volume, dtype=dtype)
+    pH = np.asarray(pH, dtype=dtype)
+    # Only two distinct exponentials exist (10^pH and 10^-pH), so compute them once
+    if normalize:
+        high, low = _segment_extremes(pH, offsets)
+        if offsets is not None:
+            counts = np.diff(offsets)
+            high, low = np.repeat(high, counts), np.repeat(low, counts)
+        up = np.power(dtype(10.0), pH - high)
+        down = np.power(dtype(10.0), low - pH)
+    else:
+        up = np.power(dtype(10.0), pH)
+        down = 1.0 / up
+    volume_term = volume + (_USES_V * V).astype(dtype)  # (8, n): v or (v + V)
+    return volume_term * np.where(_PH_SIGN > 0, up, down)
+
+
+def segment_gradient(y, x, offsets):
+    """np.gradient(y[..., a:b], x[a:b], axis=-1) of every curve [a, b) of concatenated arrays at once.
+
+    Second-order central differences inside each curve and one-sided differences at its
+    ends, so no difference reaches across a curve boundary. Every curve needs 2 points.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    offsets = np.asarray(offsets)
+    grad = np.empty(y.shape, dtype=np.result_type(y, x, float))
+    first, last = offsets[:-1], offsets[1:] - 1
+    with np.errstate(divide='ignore', invalid='ignore'):  # boundary-crossing values are overwritten below
+        left, right = np.diff(x)[:-1], np.diff(x)[1:]
+        grad[..., 1:-1] = ((left * left) * y[..., 2:] - (right * right) * y[..., :-2]
+                           + (right * right - left * left) * y[..., 1:-1]) / (left * right * (left + right))
+    grad[..., first] = (y[..., first + 1] - y[..., first]) / (x[first + 1] - x[first])
+    grad[..., last] = (y[..., last] - y[..., last - 1]) / (x[last] - x[last - 1])
+    return grad
+
+
+def gran_derivatives(g, volume, smoothing=None, offsets=None):
+    """Return first and second derivatives of stacked Gran functions g (8, n) with respect to volume.
+
+    By default they are finite differences (np.gradient). With smoothing=(window, order) they
+    are the analytic derivatives of Savitzky-Golay polynomials (see preprocess.savgol), which
+    do not amplify measurement noise the way chained differences do. With offsets, g and
+    volume hold concatenated curves and each is differentiated on its own.
+    """
+    if smoothing is not None:
+        from preprocess import savgol
+        window, order = smoothing
+        _, dg, d2g = savgol(volume, g, window, order, deriv=2, offsets=offsets)
+        return dg, d2g
+    if offsets is not None:
+        dg = segment_gradient(g, volume, offsets)
+        return dg, segment_gradient(dg, volume, offsets)
+    dg = np.gradient(g, volume, axis=-1)    # dG/dv
+    d2g = np.gradient(dg, volume, axis=-1)  # d²G/dv², reusing dG/dv instead of recomputing it
+    return dg, d2g
+
+
+def compute_gran(volume, pH, V=25.0, normalize=False, dtype=np.float64, smoothing=None, offsets=None, out=None):
+    """Compute all Gran functions and their derivatives.
+
+    Returns an array of shape (8, 3, n): axis 0 follows GRAN_NAMES, axis 1 is {G, dG/dv, d²G/dv²}.
+    normalize and dtype are passed to gran_functions; multiply row i of a normalized result by
+    10^gran_log_scale(pH)[i] to recover the unnormalized values. smoothing is passed to
+    gran_derivatives; offsets marks concatenated curves (see gran_functions). With out, an
+    (8, 3, n) array of dtype (e.g. a view of shared memory), the result is written there.
+    """
+    volume = np.asarray(volume, dtype=dtype)
+    pH = np.asarray(pH, dtype=dtype)
+    if volume.ndim != 1 or volume.shape != pH.shape:
+        raise ValueError("volume and pH must be 1-D arrays of the same length.")
+    if volume.size < 3 or (offsets is not None and np.min(np.diff(offsets)) < 3):
+        raise ValueError("At least 3 data points are needed to compute second derivatives.")
+    shape = (len(GRAN_FUNCTIONS), 3, volume.size)
+    if out is not None and (out.shape != shape or out.dtype != dtype):
+        raise ValueError(f"out must be an array of shape {shape} and dtype {np.dtype(dtype)}.")
+    result = np.empty(shape, dtype=dtype) if out is None else out
+    result[:, G] = gran_functions(volume, pH, V, normalize, dtype, offsets)
+    result[:, DG], result[:, D2G] = gran_derivatives(result[:, G], volume, smoothing, offsets)
+    return result
@@ -0,0 +1,271 @@
+# ingest.py: Asynchronous multi-instrument ingestion service for PyGranTitEQP
+# Serves many concurrent autotitrator streams over TCP or Unix sockets in one event loop and feeds every point to StreamingGran
+
+import argparse
+import asyncio
+import csv
+import sys
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from method import TITRATION_TYPES
+from streaming import StreamingGran
+
+# Longest accepted line in bytes
+LINE_LIMIT = 4096
+# Bytes read from a connection at once; a connection stops being read from the socket (TCP flow control) while
+# twice this much is buffered and unprocessed
+BUFFER_BYTES = 65536
+# Pending connections the listening socket queues; large so that hundreds of instruments can connect at once
+BACKLOG = 1024
+RESULT_FIELDS = ['instrument', 'titration', 'points', 'provisional', 'volume_eq', 'ci_low', 'ci_high', 'stderr', 'r2',
+                 'branches', 'seconds', 'status']
+
+
+def parse_point(line):
+    """(volume, response) from a data line; the two numbers may be separated by whitespace, ',' or ';'."""
+    fields = line.replace(';', ' ').replace(',', ' ').split()
+    if len(fields) != 2:
+        raise ValueError(f"expected 'volume response', got {line!r}")
+    return float(fields[0]), float(fields[1])
+
+
+def parse_header(line, settings):
+    """Update settings (instrument, titration, V) from a '# key=value ...' header line."""
+    for field in line.lstrip('#').split():
+        key, _, value = field.partition('=')
+        if key in ('id', 'instrument'):
+            settings['instrument'] = value
+        elif key == 'titration':
+            if value not in TITRATION_TYPES:
+                raise ValueError(f"Unknown titration type '{value}'. Choose from: {', '.join(TITRATION_TYPES)}")
+            settings['titration'] = value
+        elif key == 'V':
+            settings['V'] = float(value)
+        else:
+            raise ValueError(f"Unknown header field '{key}'")
+
+
+def final_endpoint(volume, pH, titration, V):
+    """Endpoint of a completed curve from the full (non-incremental) linear-region search."""
+    from endpoint import find_endpoint
+    from gran_engine import gran_functions, gran_index
+    gran = gran_functions(volume, pH, V, normalize=True)
+    return find_endpoint(volume, gran[gran_index(titration + '_G1')], gran[gran_index(titration + '_G2')])
+
+
+class Session:
+    """One titration on one connection: its settings, the StreamingGran and the points received so far."""
+
+    __slots__ = ('instrument', 'titration', 'V', 'stream', 'volume', 'response', 'provisional', 'started')
+
+    def __init__(self, instrument, titration, V):
+        self.instrument = instrument
+        self.titration = titration
+        self.V = V
+        self.stream = StreamingGran(titration, V)
+        self.volume = array('d')
+        self.response = array('d')
+        self.provisional = None
+        self.started = time.perf_counter()
+
+
+class IngestServer:
+    """Asyncio server that evaluates (volume, response) streams of many instruments in one thread.
+
+    Protocol (text lines, one connection per instrument): an optional header
+    '# id=<name> titration=<type> V=<mL>', then one 'volume response' line per reading, then
+    'END'. Another titration may follow on the same connection. The server answers
+    'ENDPOINT <volume> <ci_low> <ci_high>' once StreamingGran reports a provisional endpoint
+    (so dosing can stop) and 'RESULT ...' or 'RESULT none' after END; bad lines get 'ERROR <reason>'.
+
+    Every point is handled in O(1) by StreamingGran as it arrives. A connection is only read
+    while its points are being processed and its replies have drained, so a fast instrument is
+    slowed down by TCP flow control instead of filling memory. The final full-curve evaluation
+    after END runs in a shared pool of `workers` threads, not one thread per instrument.
+    on_result is called with a result row (dict of RESULT_FIELDS) for every finished titration.
+    """
+
+    def __init__(self, titration='StrongAcid', V=25.0, workers=2, on_result=None):
+        self.titration = titration
+        self.V = V
+        self.on_result = on_result
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.connections = 0
+        self.active = 0
+        self.points = 0
+        self.completed = 0
+
+    async def _reply(self, writer, text):
+        writer.write(text.encode('ascii') + b'\n')
+        await writer.drain()
+
+    async def _finish(self, session, writer):
+        """Evaluate a completed curve, report its result row and answer the instrument."""
+        row = dict(instrument=session.instrument, titration=session.titration, points=len(session.volume),
+                   provisional=None if session.provisional is None else session.provisional.volume)
+        endpoint = None
+        if len(session.volume) >= 3:
+            volume = np.frombuffer(session.volume, dtype=float)
+            pH = np.frombuffer(session.response, dtype=float)
+            loop = asyncio.get_running_loop()
+            try:
+                endpoint = await loop.run_in_executor(self.executor, final_endpoint, volume, pH, session.titration, session.V)
+            except ValueError as e:
+                row['status'] = f'error: {e}'
+        if endpoint is not None:
+            row.update(volume_eq=endpoint.volume, ci_low=endpoint.ci_low, ci_high=endpoint.ci_high,
+                       stderr=endpoint.stderr, r2=endpoint.r2, branches=len(endpoint.fits), status='ok')
+            await self._reply(writer, f"RESULT {endpoint.volume:.6g} {endpoint.ci_low:.6g} {endpoint.ci_high:.6g}")
+        else:
+            row.setdefault('status', 'no linear region')
+            await self._reply(writer, "RESULT none")
+        row['seconds'] = time.perf_counter() - session.started
+        self.completed += 1
+        if self.on_result is not None:
+            self.on_result(row)
+
+    def _point(self, line, state):
+        """Handle one header or reading line; returns the reply line or None."""
+        session = state['session']
+        if line.startswith('#'):
+            if session is not None:
+                raise ValueError("header after the first reading; send END first")
+            parse_header(line, state['settings'])
+            return None
+        volume, response = parse_point(line)
+        if session is None:
+            settings = state['settings']
+            session = state['session'] = Session(settings['instrument'], settings['titration'], settings['V'])
+        endpoint = session.stream.add(volume, response)
+        session.volume.append(volume)
+        session.response.append(response)
+        self.points += 1
+        if endpoint is not None and session.provisional is None:
+            session.provisional = endpoint
+            return f"ENDPOINT {endpoint.volume:.6g} {endpoint.ci_low:.6g} {endpoint.ci_high:.6g}"
+        return None
+
+    async def _lines(self, lines, state, writer):
+        """Handle the complete lines of one read, then wait until the replies have been sent."""
+        for line in lines:
+            line = line.decode('ascii', errors='replace').strip()
+            if not line:
+                continue
+            if line.upper() == 'END':
+                if state['session'] is not None:
+                    await self._finish(state['session'], writer)
+                state['session'] = None
+                continue
+            try:
+                reply = self._point(line, state)
+            except ValueError as e:
+                reply = f"ERROR {e}"
+            if reply is not None:
+                writer.write(reply.encode('ascii') + b'\n')
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        """Serve one instrument connection until it closes.
+
+        Whatever has arrived is read in one block of up to BUFFER_BYTES and its lines are
+        handled without awaiting, which keeps the event loop overhead per point small; the
+        connection then yields to the others before it is read again.
+        """
+        self.connections += 1
+        self.active += 1
+        peer = writer.get_extra_info('peername') or writer.get_extra_info('sockname')
+        state = dict(session=None, settings=dict(instrument=str(peer), titration=self.titration, V=self.V))
+        partial = b''
+        try:
+            while True:
+                block = await reader.read(BUFFER_BYTES)
+                if not block:
+                    break
+                lines = (partial + block).split(b'\n')
+                partial = lines.pop()
+                if len(partial) > LINE_LIMIT:
+                    await self._reply(writer, f"ERROR line longer than {LINE_LIMIT} bytes")
+                    partial = b''
+                    break
+                await self._lines(lines, state, writer)
+                await asyncio.sleep(0)
+            await self._lines([partial], state, writer)
+            if state['session'] is not None:  # connection closed without END
+                await self._finish(state['session'], writer)
+        except ConnectionError:
+            pass
+        finally:
+            self.active -= 1
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, host='127.0.0.1', port=0, unix_path=None):
+        """Start listening on a TCP port (0: any free port) or a Unix socket; returns the asyncio Server."""
+        if unix_path:
+            return await asyncio.start_unix_server(self.handle, unix_path, limit=BUFFER_BYTES, backlog=BACKLOG)
+        return await asyncio.start_server(self.handle, host, port, limit=BUFFER_BYTES, backlog=BACKLOG)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve live autotitrator streams and evaluate their Gran endpoints.")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: %(default)s)")
+    parser.add_argument('-p', '--port', type=int, default=5555, help="TCP port (default: %(default)s)")
+    parser.add_argument('--unix', metavar='PATH', help="Listen on a Unix socket instead of TCP")
+    parser.add_argument('-o', '--output', default='-', help="Results table (CSV), one row per titration; '-' for stdout (default: %(default)s)")
+    parser.add_argument('-t', '--titration', default='StrongAcid', choices=TITRATION_TYPES,
+                        help="Titration type of instruments that send no header (default: %(default)s)")
+    parser.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Default initial volume in mL (default: %(default)s)")
+    parser.add_argument('-j', '--workers', type=int, default=2, help="Threads for the final evaluations (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    stream = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    writer = csv.DictWriter(stream, fieldnames=RESULT_FIELDS, restval='')
+    writer.writeheader()
+
+    def write_row(row):
+        writer.writerow(row)
+        stream.flush()
+
+    server = IngestServer(args.titration, args.initial_volume, args.workers, write_row)
+    try:
+        listener = await server.start(args.host, args.port, args.unix)
+        where = args.unix or ', '.join(str(s.getsockname()) for s in listener.sockets)
+        print(f"Listening on {where}", file=sys.stderr)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+        if stream is not sys.stdout:
+            stream.close()
+
+
+def main(argv=None):
+    """Main function of the ingestion server."""
+    args = parse_args(argv)
+    if args.workers < 1:
+        print("Error: --workers must be at least 1.", file=sys.stderr)
+        return 1
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,162 @@
+# instrument.py: Per-stage timing instrumentation for PyGranTitEQP
+# Records wall time, CPU time and allocations of the load/validate/compute/fit/plot/save stages as JSON lines or callbacks
+
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Set to a JSONL path to profile any entry point without changing code
+PROFILE_ENV = 'PYGRANTITEQP_PROFILE'
+STAGES = ('load', 'validate', 'compute', 'fit', 'plot', 'save')
+
+_profiler = None    # the active Profiler, or None when instrumentation is off
+_NULL = nullcontext()  # returned by stage() when off, so a disabled stage costs one global lookup
+
+
+class JsonlWriter:
+    """Sink that appends every record as one JSON line to a file.
+
+    Each line is written with a single O_APPEND write, so the worker processes of a batch can
+    share one file.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+    def __call__(self, record):
+        os.write(self._fd, (json.dumps(record, default=str) + '\n').encode('utf-8'))
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+class Profiler:
+    """Times nested stages and passes one record (dict) per finished stage to a sink callable.
+
+    A record holds the stage name, the labels given to it and to all enclosing stages (e.g. the
+    file), wall and CPU seconds, the process id and, with memory=True, the peak of memory
+    allocated during the stage in bytes (via tracemalloc, which slows NumPy-heavy code down).
+    """
+
+    def __init__(self, sink, memory=False):
+        self.sink = sink
+        self.memory = memory
+        self._stack = []  # [labels, peak of finished child stages] per open stage
+
+    @contextmanager
+    def stage(self, name, **labels):
+        if self._stack:
+            labels = dict(self._stack[-1][0], **labels)
+        frame = [labels, 0]
+        self._stack.append(frame)
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            self._stack.pop()
+            record = dict(labels, stage=name, wall=wall, cpu=cpu, pid=os.getpid())
+            if self.memory:
+                peak = max(tracemalloc.get_traced_memory()[1], frame[1])
+                record['alloc_peak'] = peak - base
+                if self._stack:
+                    self._stack[-1][1] = max(self._stack[-1][1], peak)
+            self.sink(record)
+
+
+def enable(sink, memory=False):
+    """Turn instrumentation on; sink is a callable taking a record or a JSONL file path. Returns the Profiler."""
+    global _profiler
+    disable()
+    _profiler = Profiler(JsonlWriter(sink) if isinstance(sink, str) else sink, memory)
+    return _profiler
+
+
+def disable():
+    """Turn instrumentation off (closing a JSONL file opened by enable)."""
+    global _profiler
+    if _profiler is not None and isinstance(_profiler.sink, JsonlWriter):
+        _profiler.sink.close()
+    if _profiler is not None and _profiler.memory and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _profiler = None
+
+
+@contextmanager
+def profiling(sink, memory=False):
+    """Instrument the enclosed block: with profiling('profile.jsonl'): ..."""
+    profiler = enable(sink, memory)
+    try:
+        yield profiler
+    finally:
+        disable()
+
+
+def stage(name, **labels):
+    """Context manager timing one pipeline stage; a no-op unless instrumentation is enabled."""
+    if _profiler is None:
+        return _NULL
+    return _profiler.stage(name, **labels)
+
+
+def timed(name):
+    """Decorator form of stage() for functions that are one stage, e.g. @timed('load') on load_data."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def load_records(file_path):
+    """Read the records of a JSONL profile."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def slowest(records, n=10, stage_name=None, key='wall'):
+    """The n records with the largest key (wall, cpu or alloc_peak), optionally of one stage only."""
+    selected = [r for r in records if stage_name is None or r['stage'] == stage_name]
+    return sorted(selected, key=lambda r: r.get(key, 0), reverse=True)[:n]
+
+
+def main(argv=None):
+    """Print the slowest stages of a JSONL profile."""
+    parser = argparse.ArgumentParser(description="Show the slowest stages of a PyGranTitEQP profile (JSON lines).")
+    parser.add_argument('profile', help="JSONL file written with batch.py --profile or $" + PROFILE_ENV)
+    parser.add_argument('-n', '--top', type=int, default=10, help="Number of records to show (default: %(default)s)")
+    parser.add_argument('-s', '--stage', help="Only show this stage")
+    parser.add_argument('-k', '--key', choices=('wall', 'cpu', 'alloc_peak'), default='wall', help="Sort key (default: %(default)s)")
+    args = parser.parse_args(argv)
+    records = load_records(args.profile)
+    if not records:
+        print(f"Error: no records in '{args.profile}'.", file=sys.stderr)
+        return 1
+    for record in slowest(records, args.top, args.stage, args.key):
+        memory = f" {record['alloc_peak'] / 2**20:9.1f} MiB" if 'alloc_peak' in record else ''
+        print(f"{record['stage']:10s} {record['wall'] * 1000:10.1f} ms {record['cpu'] * 1000:10.1f} ms cpu{memory}  {record.get('file', '')}")
+    return 0
+
+
+if os.environ.get(PROFILE_ENV):
+    enable(os.environ[PROFILE_ENV])
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,182 @@
+# loader.py: Titration data file reader for PyGranTitEQP
+# Parses .dat/.txt/.csv exports (volume plus one or more response columns) into contiguous float64 arrays, without pandas
+
+import io
+import mmap
+import re
+
+import numpy as np
+
+SNIFF_BYTES = 8192
+MMAP_CHUNK_BYTES = 16 * 1024 * 1024
+COMMENT = '#'
+
+
+def _is_number(field):
+    try:
+        float(field.replace(',', '.'))
+        return True
+    except ValueError:
+        return False
+
+
+def _split(line, delimiter):
+    return line.split(delimiter) if delimiter else line.split()
+
+
+def sniff_format(lines):
+    """Detect the layout of a titration file from its first lines.
+
+    Returns (delimiter, skip_lines, decimal_comma, column_names): delimiter None means
+    whitespace, skip_lines is the number of raw lines before the first data row and
+    column_names holds the header fields (None if the file has no header row). Comma-separated
+    fields may be padded with spaces.
+    """
+    # Decide the delimiter on the first data line: a header may use a different separator style
+    probe = next((line for line in lines if line.strip() and _is_number(re.split(r'[;,\s]+', line.strip())[0])), None)
+    if probe is None:
+        raise ValueError("no numeric data lines found")
+    if ';' in probe:
+        delimiter = ';'
+    elif ',' in probe and '\t' not in probe and all(_is_number(field) for field in probe.split(',') if field.strip()):
+        delimiter = ','  # fields may be padded with spaces ("0.0, 3.0"); decimal commas split into non-numbers ("1,5 3,2")
+    else:
+        delimiter = None  # whitespace (spaces or tabs)
+
+    column_names = None
+    for skip_lines, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith(COMMENT):
+            continue
+        fields = _split(stripped, delimiter)
+        if all(_is_number(field) for field in fields if field.strip()):
+            decimal_comma = delimiter != ',' and ',' in stripped
+            return delimiter, skip_lines, decimal_comma, column_names
+        column_names = [field.strip() for field in fields]
+    raise ValueError("no numeric data lines found")
+
+
+def _read_sample(file_path):
+    """First lines of a file for format detection (a possibly truncated last line is dropped)."""
+    with open(file_path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+    lines = sample.decode('utf-8', errors='replace').splitlines()
+    return lines[:-1] if len(sample) == SNIFF_BYTES and len(lines) > 1 else lines
+
+
+def _parse(text, delimiter, decimal_comma):
+    if decimal_comma:
+        text = text.replace(',', '.')
+    return np.loadtxt(io.StringIO(text), delimiter=delimiter, comments=COMMENT, ndmin=2, dtype=np.float64)
+
+
+def _load_mmap(file_path, delimiter, skip_lines, decimal_comma):
+    """Parse a file from a read-only memory map in bounded chunks that end on a line break."""
+    blocks = []
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        pos = 0
+        for _ in range(skip_lines):
+            pos = mm.find(b'\n', pos) + 1
+        size = len(mm)
+        while pos < size:
+            end = mm.find(b'\n', min(pos + MMAP_CHUNK_BYTES, size))
+            end = size if end < 0 else end + 1
+            text = mm[pos:end].decode('utf-8', errors='replace')
+            if text.strip():
+                blocks.append(_parse(text, delimiter, decimal_comma))
+            pos = end
+    if not blocks:
+        return np.empty((0, 0))
+    return np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+
+def load_columns(file_path, use_mmap=False):
+    """Read all numeric columns of a titration file.
+
+    Returns (data, column_names): data is a C-contiguous float64 array of shape (n, k), and
+    column_names is the list of header fields or None if the file has no header row. With
+    use_mmap=True the file is parsed in chunks from a memory map instead of a file buffer.
+    """
+    delimiter, skip_lines, decimal_comma, column_names = sniff_format(_read_sample(file_path))
+    if use_mmap:
+        data = _load_mmap(file_path, delimiter, skip_lines, decimal_comma)
+    elif decimal_comma:
+        with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+            text = ''.join(f.readlines()[skip_lines:])
+        data = _parse(text, delimiter, decimal_comma)
+    else:
+        data = np.loadtxt(file_path, delimiter=delimiter, skiprows=skip_lines, comments=COMMENT, ndmin=2,
+                          dtype=np.float64, encoding='utf-8')
+    if data.shape[0] == 0:
+        raise ValueError(f"'{file_path}' contains no data rows")
+    return np.ascontiguousarray(data), column_names
+
+
+def load_titration(file_path, response_column=1, use_mmap=False):
+    """Read a titration file and return (volume, response) as contiguous float64 arrays.
+
+    The first column is the titrant volume; response_column selects the measured response
+    (pH or potential).
+    """
+    data, _ = load_columns(file_path, use_mmap)
+    if data.shape[1] <= response_column:
+        raise ValueError(f"'{file_path}' has {data.shape[1]} column(s); response column {response_column} is missing")
+    return np.ascontiguousarray(data[:, 0]), np.ascontiguousarray(data[:, response_column])
+
+
+def load_blocks(file_path):
+    """Read a file that holds several curves, each under its own header row (e.g. GranTED CSV exports).
+
+    GranTED exports repeat 'V [mL];<sample> TitrationEQP1 E' and '... dE/dV' header rows, one
+    pair per determination, separated by blank lines; sample names may contain the delimiter.
+    All numeric rows are parsed in one np.loadtxt call. Returns a list of (title, data) with
+    title the header text after the first (volume) field and data a float64 array of shape (n, k).
+    """
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        lines = [line.strip() for line in f]
+    delimiter, _, decimal_comma, _ = sniff_format(lines)
+    titles, counts, rows = [], [], []
+    for line in lines:
+        if not line or line.startswith(COMMENT):
+            continue
+        first = _split(line, delimiter)[0]
+        if _is_number(first):
+            if not titles:
+                titles.append('')
+                counts.append(0)
+            rows.append(line)
+            counts[-1] += 1
+        else:
+            rest = line[len(first):]
+            titles.append(rest.lstrip(delimiter or None).strip())
+            counts.append(0)
+    if not rows:
+        raise ValueError(f"'{file_path}' contains no data rows")
+    data = _parse('\n'.join(rows), delimiter, decimal_comma)
+    bounds = np.cumsum([0] + counts)
+    return [(title, np.ascontiguousarray(data[start:stop]))
+            for title, start, stop in zip(titles, bounds[:-1], bounds[1:]) if stop > start]
+
+
+def load_block_corpus(file_paths, quantity='E', response_column=1):
+    """Read the curves of many multi-block files into ragged arrays for one vectorized pass.
+
+    Only blocks whose title ends with quantity are kept ('E' skips the 'dE/dV' blocks; None
+    keeps all). Returns (volume, response, offsets, sources): the curves concatenated into two
+    float64 arrays, curve i spanning offsets[i]:offsets[i + 1], and sources[i] = (file, block
+    number, title). Unreadable files raise.
+    """
+    volumes, responses, sources = [], [], []
+    for file_path in file_paths:
+        for number, (title, data) in enumerate(load_blocks(file_path)):
+            if quantity is not None and not (title == quantity or title.endswith(' ' + quantity)):
+                continue
+            if data.shape[1] <= response_column:
+                raise ValueError(f"'{file_path}' block {number} has no response column {response_column}")
+            volumes.append(data[:, 0])
+            responses.append(data[:, response_column])
+            sources.append((file_path, number, title))
+    offsets = np.cumsum([0] + [v.size for v in volumes])
+    if not volumes:
+        return np.empty(0), np.empty(0), offsets, sources
+    return np.concatenate(volumes), np.concatenate(responses), offsets, sources
@@ -0,0 +1,134 @@
+# method.py: Method files (method.json) and method-driven analysis for PyGranTitEQP
+# Reads/writes the method parameters that the GUI proposes next to a data file and evaluates a file with them
+
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from endpoint import find_endpoint
+from gran_engine import compute_gran, gran_index, gran_log_scale, G
+from instrument import stage
+
+METHOD_FILE = 'method.json'
+TITRATION_TYPES = ('StrongAcid', 'StrongBase', 'WeakAcid', 'WeakBase')
+
+# The GUI's choices; "don't know" evaluates every matching titration type
+DEFAULT_METHOD = {
+    'titration_type': "don't know",      # 'acid', 'basic' or "don't know"
+    'titration_strength': "don't know",  # 'strong', 'weak' or "don't know"
+    'analyte_volume': 25.0,              # V in mL
+    'titrant_concentration': None,       # mol/L
+    'k': 1.0,                            # Schwarz constant
+    'window': None,                      # analysis window [v_min, v_max] in mL (None or a None bound: open)
+}
+_CHOICES = {'titration_type': ('acid', 'basic', "don't know"), 'titration_strength': ('strong', 'weak', "don't know")}
+
+# gran holds the normalized (8, 3, n) result of compute_gran; row i times 10^log_scale[i] gives the Gran values
+# endpoints maps each titration type to its Endpoint (or None)
+Analysis = namedtuple('Analysis', ['volume', 'pH', 'gran', 'log_scale', 'endpoints'])
+
+
+def make_method(**params):
+    """Return a complete, validated method dict: DEFAULT_METHOD updated with params."""
+    unknown = set(params) - set(DEFAULT_METHOD)
+    if unknown:
+        raise ValueError(f"Unknown method parameter(s): {', '.join(sorted(unknown))}")
+    method = dict(DEFAULT_METHOD, **params)
+    for name, choices in _CHOICES.items():
+        if method[name] not in choices:
+            raise ValueError(f"Invalid {name} '{method[name]}'. Choose from: {', '.join(choices)}")
+    method['analyte_volume'] = float(method['analyte_volume'])
+    method['k'] = float(method['k'])
+    if method['titrant_concentration'] is not None:
+        method['titrant_concentration'] = float(method['titrant_concentration'])
+    method['window'] = _make_window(method['window'])
+    return method
+
+
+def _make_window(window):
+    if window is None:
+        return None
+    try:
+        if isinstance(window, str):
+            raise TypeError
+        low, high = (None if bound is None else float(bound) for bound in window)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid window {window!r}: expected [v_min, v_max] in mL") from None
+    if low is not None and high is not None and low >= high:
+        raise ValueError(f"Invalid window {window!r}: v_min must be smaller than v_max")
+    return None if low is None and high is None else [low, high]
+
+
+def load_method(file_path):
+    """Read a method.json; parameters missing from the file take their default values."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return make_method(**json.load(f))
+
+
+def save_method(method, file_path):
+    """Write a method dict as method.json."""
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(make_method(**method), f, indent=2)
+
+
+def method_titrations(method):
+    """Titration types selected by the method's titration type and strength."""
+    kind = {'acid': ('Acid',), 'basic': ('Base',)}.get(method['titration_type'], ('Acid', 'Base'))
+    strength = {'strong': ('Strong',), 'weak': ('Weak',)}.get(method['titration_strength'], ('Strong', 'Weak'))
+    return tuple(t for t in TITRATION_TYPES if any(t.startswith(s) for s in strength) and any(t.endswith(k) for k in kind))
+
+
+def window_slice(volume, window):
+    """Slice of the (increasing) volumes that lie inside a method window [v_min, v_max]; None selects all."""
+    if window is None:
+        return slice(None)
+    low, high = window
+    start = 0 if low is None else int(np.searchsorted(volume, low, side='left'))
+    stop = len(volume) if high is None else int(np.searchsorted(volume, high, side='right'))
+    return slice(start, stop)
+
+
+def apply_window(volume, pH, window):
+    """Volume and pH restricted to a method window (views, no copy); raises ValueError if too few points remain."""
+    selected = window_slice(volume, window)
+    volume, pH = volume[selected], pH[selected]
+    if volume.size < 3:  # compute_gran needs 3 points for the second derivatives
+        raise ValueError(f"fewer than 3 data points in the analysis window {window}")
+    return volume, pH
+
+
+def analyse(volume, pH, method, dtype=np.float64):
+    """Gran functions and endpoints of all titration types for one curve under a method; returns an Analysis.
+
+    The curve is cut to the method's window before anything is computed, so the Analysis
+    holds only the points inside it.
+    """
+    with stage('validate'):
+        volume = np.asarray(volume, dtype=float)
+        pH = np.asarray(pH, dtype=float)
+        if np.any(np.diff(volume) < 0):
+            raise ValueError("volumes are not monotonically increasing")
+        volume, pH = apply_window(volume, pH, method['window'])
+    with stage('compute'):
+        gran = compute_gran(volume, pH, method['analyte_volume'], normalize=True, dtype=dtype)
+    endpoints = {}
+    with stage('fit'):
+        for titration in TITRATION_TYPES:
+            g1 = gran[gran_index(titration + '_G1'), G]
+            g2 = gran[gran_index(titration + '_G2'), G]
+            endpoints[titration] = find_endpoint(volume, g1, g2)
+    return Analysis(volume, pH, gran, gran_log_scale(pH), endpoints)
+
+
+def analyse_file(file_path, method, dtype=np.float64):
+    """Load a titration file and analyse it under a method; returns an Analysis."""
+    from loader import load_titration
+    with stage('load'):
+        volume, pH = load_titration(file_path)
+    return analyse(volume, pH, method, dtype)
+
+
+def unscaled_gran(analysis):
+    """The (8, 3, n) Gran values of an Analysis without normalization, e.g. for plotting."""
+    return analysis.gran * np.power(10.0, analysis.log_scale)[:, None, None]
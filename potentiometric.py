@@ -0,0 +1,166 @@
+# potentiometric.py: E-based (mV) Gran engine for PyGranTitEQP
+# Gran functions of electrode potentials via the Nernst slope, evaluated in the log domain for many curves at once
+
+import argparse
+import math
+import sys
+
+import numpy as np
+
+from endpoint import find_endpoint
+
+GAS_CONSTANT = 8.314462618     # J/(mol K)
+FARADAY = 96485.33212          # C/mol
+KELVIN = 273.15
+
+# Gran functions of the potential, in stacking order
+# Each entry: (name, formula, uses V in the volume term, sign of d * E / S in the exponent), where S is
+# the Nernst slope and d = +1 for curves whose potential rises during the titration, -1 otherwise
+POTENTIAL_FUNCTIONS = (
+    ('Ion_G1', '(v + V) * 10^(-d * E/S)', True, -1),
+    ('Ion_G2', '(v + V) * 10^(d * E/S)', True, 1),
+    ('Redox_G1', 'v * 10^(-d * E/S)', False, -1),
+    ('Redox_G2', '10^(d * E/S)', None, 1),
+)
+POTENTIAL_NAMES = tuple(entry[0] for entry in POTENTIAL_FUNCTIONS)
+# Ion: ion-selective (incl. pH) electrodes, precipitation and complexometric titrations; Redox: Pt electrode
+METHODS = ('Ion', 'Redox')
+
+
+def nernst_slope(temperature=25.0, electrons=1):
+    """Nernst slope in mV per decade of activity at a temperature in °C (59.16 mV at 25 °C, n = 1)."""
+    return 1000.0 * math.log(10.0) * GAS_CONSTANT * (temperature + KELVIN) / (abs(electrons) * FARADAY)
+
+
+def potential_index(name):
+    """Return the row of a potential Gran function in the stacked result, e.g. potential_index('Ion_G1') -> 0."""
+    try:
+        return POTENTIAL_NAMES.index(name)
+    except ValueError:
+        raise ValueError(f"Unknown Gran function '{name}'. Choose from: {', '.join(POTENTIAL_NAMES)}") from None
+
+
+def _segment_ids(offsets):
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def potential_direction(E, offsets):
+    """+1 for curves whose potential rises from first to last point, -1 otherwise; one value per curve."""
+    offsets = np.asarray(offsets)
+    return np.where(E[offsets[1:] - 1] >= E[offsets[:-1]], 1.0, -1.0)
+
+
+def potential_gran(volume, E, offsets=None, V=25.0, temperature=25.0, electrons=1):
+    """Evaluate all potential Gran functions for one or more concatenated curves; returns an array (4, n).
+
+    Curve i spans offsets[i]:offsets[i + 1] (default: a single curve). 10^(±E/S) overflows for
+    large potentials or small slopes, so the exponent is kept in the log domain and shifted by
+    its maximum over each curve before exponentiation: every curve is scaled to a peak volume
+    term, which leaves the linear regions and their x-intercepts unchanged. V is the initial
+    volume, a scalar or one value per curve.
+    """
+    volume = np.asarray(volume, dtype=float)
+    E = np.asarray(E, dtype=float)
+    if volume.ndim != 1 or volume.shape != E.shape:
+        raise ValueError("volume and E must be 1-D arrays of the same length.")
+    offsets = np.array([0, volume.size]) if offsets is None else np.asarray(offsets)
+    if offsets[0] != 0 or offsets[-1] != volume.size or np.any(np.diff(offsets) < 1):
+        raise ValueError("offsets must rise from 0 to len(volume) with at least one point per curve.")
+    ids = _segment_ids(offsets)
+    starts = offsets[:-1]
+    # Exponent of 10^(d * E/S) per point; the sign per function is applied below
+    exponent = (potential_direction(E, offsets) / nernst_slope(temperature, electrons))[ids] * E
+    total = volume + np.broadcast_to(np.asarray(V, dtype=float), starts.shape)[ids]
+
+    rows = []
+    for _, _, uses_V, sign in POTENTIAL_FUNCTIONS:
+        signed = sign * exponent
+        peak = np.maximum.reduceat(signed, starts)[ids]
+        volume_term = 1.0 if uses_V is None else (total if uses_V else volume)
+        rows.append(volume_term * np.power(10.0, signed - peak))
+    return np.stack(rows)
+
+
+def potential_endpoints(volume, E, offsets=None, method='Ion', V=25.0, temperature=25.0, electrons=1, **search):
+    """Gran endpoint of every curve; returns a list with one Endpoint (or None) per curve."""
+    if method not in METHODS:
+        raise ValueError(f"Unknown method '{method}'. Choose from: {', '.join(METHODS)}")
+    volume = np.asarray(volume, dtype=float)
+    offsets = np.array([0, volume.size]) if offsets is None else np.asarray(offsets)
+    gran = potential_gran(volume, E, offsets, V, temperature, electrons)
+    g1 = gran[potential_index(method + '_G1')]
+    g2 = gran[potential_index(method + '_G2')]
+    endpoints = []
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        try:
+            endpoints.append(find_endpoint(volume[start:stop], g1[start:stop], g2[start:stop], **search))
+        except ValueError:
+            endpoints.append(None)  # too few points for a linear region
+    return endpoints
+
+
+RESULT_FIELDS = ['file', 'block', 'title', 'method', 'points', 'volume_eq', 'ci_low', 'ci_high', 'stderr', 'r2', 'branches', 'status']
+
+
+def evaluate_corpus(files, method='Ion', V=25.0, temperature=25.0, electrons=1):
+    """Evaluate the E curves of all files (multi-block GranTED CSVs included) in one pass; yields result rows."""
+    from loader import load_block_corpus
+    curves = []
+    for file_path in files:
+        try:
+            curves.append(load_block_corpus([file_path]))
+        except Exception as e:
+            yield dict(file=file_path, method=method, status=f'error: {e}')
+    curves = [curve for curve in curves if curve[3]]
+    if not curves:
+        return
+    volume = np.concatenate([curve[0] for curve in curves])
+    E = np.concatenate([curve[1] for curve in curves])
+    sizes = np.concatenate([np.diff(curve[2]) for curve in curves])
+    offsets = np.concatenate([[0], np.cumsum(sizes)])
+    sources = [source for curve in curves for source in curve[3]]
+
+    endpoints = potential_endpoints(volume, E, offsets, method, V, temperature, electrons)
+    for (file_path, block, title), start, stop, endpoint in zip(sources, offsets[:-1], offsets[1:], endpoints):
+        row = dict(file=file_path, block=block, title=title, method=method, points=stop - start)
+        if np.any(np.diff(volume[start:stop]) < 0):
+            row['status'] = 'error: volumes are not monotonically increasing'
+        elif endpoint is None:
+            row['status'] = 'no linear region'
+        else:
+            row.update(volume_eq=endpoint.volume, ci_low=endpoint.ci_low, ci_high=endpoint.ci_high,
+                       stderr=endpoint.stderr, r2=endpoint.r2, branches=len(endpoint.fits), status='ok')
+        yield row
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Gran endpoint evaluation of potentiometric (mV) titration files.")
+    parser.add_argument('inputs', nargs='+', help="Data files, glob patterns or directories (e.g. 'data/Project GranTED')")
+    parser.add_argument('-o', '--output', default='gran_potential_results.csv', help="Results table (CSV); '-' for stdout (default: %(default)s)")
+    parser.add_argument('-m', '--method', choices=METHODS, default='Ion', help="Gran functions to use (default: %(default)s)")
+    parser.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Initial volume to be titrated in mL (default: %(default)s)")
+    parser.add_argument('-T', '--temperature', type=float, default=25.0, help="Temperature in °C (default: %(default)s)")
+    parser.add_argument('-n', '--electrons', type=int, default=1, help="Electron number / ion charge of the Nernst slope (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function of the potentiometric command-line interface."""
+    from batch import expand_inputs, write_results
+    args = parse_args(argv)
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("Error: no data files matched the given inputs.", file=sys.stderr)
+        return 1
+    if args.electrons == 0:
+        print("Error: --electrons must not be 0.", file=sys.stderr)
+        return 1
+    rows = evaluate_corpus(files, args.method, args.initial_volume, args.temperature, args.electrons)
+    count = write_results(rows, args.output, RESULT_FIELDS)
+    if args.output != '-':
+        print(f"Evaluated {len(files)} files, {count} results written to '{args.output}'", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+# preprocess.py: Data cleaning for PyGranTitEQP
+# Savitzky-Golay smoothing and derivatives for non-uniform volume spacing, and Hampel (rolling median/MAD) outlier rejection
+
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Points per block of the non-uniform Savitzky-Golay path, to bound the memory of the per-point weights
+BLOCK_POINTS = 65536
+# Scales the median absolute deviation to the standard deviation of normally distributed data
+MAD_SCALE = 1.4826
+
+
+def _check_window(n, window, order=None):
+    if window < 3 or window % 2 == 0:
+        raise ValueError(f"window must be an odd number of at least 3 points, got {window}.")
+    if n < window:
+        raise ValueError(f"At least {window} data points are needed for a window of {window}.")
+    if order is not None and not 0 <= order < window:
+        raise ValueError(f"order must be between 0 and window - 1, got {order}.")
+
+
+def _local_weights(dx, order):
+    """Least-squares polynomial weights for windows of offsets dx (..., window) from the evaluation point.
+
+    Returns (..., order + 1, window): row j applied to the window's values gives the j-th
+    derivative at the evaluation point. Offsets are scaled to the window's half width first,
+    which keeps the normal equations well conditioned for any volume unit.
+    """
+    scale = np.max(np.abs(dx), axis=-1, keepdims=True)
+    scale[scale == 0] = 1.0
+    u = dx / scale
+    A = np.empty(u.shape + (order + 1,))                      # (..., window, order + 1): 1, u, u², ...
+    A[..., 0] = 1.0
+    for j in range(1, order + 1):
+        A[..., j] = A[..., j - 1] * u
+    powers = np.arange(order + 1)
+    At = np.swapaxes(A, -1, -2)
+    coefficients = np.linalg.solve(At @ A, At)                # (..., order + 1, window)
+    factorials = np.array([math.factorial(j) for j in powers], dtype=float)
+    return coefficients * (factorials[:, None] / scale[..., None] ** powers[:, None])
+
+
+def savgol(x, y, window=7, order=2, deriv=2, offsets=None):
+    """Savitzky-Golay smoothing and analytic derivatives for (possibly non-uniformly spaced) x.
+
+    Fits a polynomial of the given order to the window points around every point (shifted
+    inwards at the ends) and returns an array (deriv + 1, ..., n) holding the smoothed y and its
+    first ... deriv-th derivatives with respect to x. y may stack several curves on leading
+    axes, e.g. the (8, n) Gran functions. For evenly spaced x all interior points share one
+    set of weights, so each derivative is a single convolution (a product with a sliding
+    window view); otherwise the weights are solved per point, in blocks of BLOCK_POINTS.
+    With offsets, x and y hold concatenated curves (curve i spans offsets[i]:offsets[i + 1])
+    and no window reaches across a curve boundary.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = x.size
+    if y.shape[-1] != n:
+        raise ValueError("y must have len(x) values along its last axis.")
+    if not 0 <= deriv <= order:
+        raise ValueError(f"deriv must be between 0 and order, got {deriv}.")
+    half = window // 2
+    step = np.diff(x)
+    if offsets is None:
+        _check_window(n, window, order)
+        starts = np.clip(np.arange(n) - half, 0, n - window)
+    else:
+        offsets = np.asarray(offsets)
+        sizes = np.diff(offsets)
+        _check_window(int(sizes.min()), window, order)
+        starts = np.clip(np.arange(n) - half, np.repeat(offsets[:-1], sizes), np.repeat(offsets[1:] - window, sizes))
+        step = np.delete(step, offsets[1:-1] - 1)  # steps across curve boundaries
+    result = np.empty((deriv + 1,) + y.shape)
+
+    if np.allclose(step, step[0], rtol=1e-9, atol=0.0):
+        weights = _local_weights((np.arange(window) - half) * step[0], order)[:deriv + 1]
+        interior = sliding_window_view(y, window, axis=-1) @ weights.T  # (..., n - 2 half, deriv + 1)
+        result[..., half:n - half] = np.moveaxis(interior, -1, 0)
+        points = np.flatnonzero(starts != np.arange(n) - half)  # the shifted windows at the ends
+    else:
+        points = np.arange(n)
+    for first in range(0, points.size, BLOCK_POINTS):
+        block = points[first:first + BLOCK_POINTS]
+        index = starts[block, None] + np.arange(window)
+        weights = _local_weights(x[index] - x[block, None], order)[:, :deriv + 1]
+        values = np.einsum('pjw,...pw->j...p', weights, y[..., index])
+        result[..., block] = values
+    return result
+
+
+def _point_windows(y, window):
+    """The window of every point of y: centred, shifted inwards at the ends; a view-based (n, window) array."""
+    _check_window(y.size, window)
+    starts = np.clip(np.arange(y.size) - window // 2, 0, y.size - window)
+    return sliding_window_view(y, window)[starts]
+
+
+def rolling_median(y, window=7):
+    """Median of the window around every point of y (shifted inwards at the ends); O(n * window)."""
+    return np.median(_point_windows(np.asarray(y, dtype=float), window), axis=-1)
+
+
+def hampel(y, window=7, n_sigmas=3.0, min_deviation=0.0):
+    """Outlier mask of the Hampel filter: points farther than n_sigmas robust deviations from their window median.
+
+    The robust deviation is MAD_SCALE times the median absolute deviation from the window
+    median. On a monotonic stretch the window median is the point itself, so steep parts of
+    a titration curve are never flagged. min_deviation (e.g. the pH resolution) keeps windows
+    of identical values, where the MAD is 0, from flagging every small step.
+    """
+    y = np.asarray(y, dtype=float)
+    windows = _point_windows(y, window)
+    median = np.median(windows, axis=-1)
+    mad = MAD_SCALE * np.median(np.abs(windows - median[:, None]), axis=-1)
+    return np.abs(y - median) > np.maximum(n_sigmas * mad, min_deviation)
+
+
+def clean(volume, pH, window=7, n_sigmas=3.0, min_deviation=0.0):
+    """Drop points with missing values and Hampel outliers in pH; returns (volume, pH, dropped mask)."""
+    volume = np.asarray(volume, dtype=float)
+    pH = np.asarray(pH, dtype=float)
+    dropped = ~(np.isfinite(volume) & np.isfinite(pH))
+    keep = np.flatnonzero(~dropped)
+    if keep.size >= window:
+        dropped[keep[hampel(pH[keep], window, n_sigmas, min_deviation)]] = True
+    return volume[~dropped], pH[~dropped], dropped
@@ -0,0 +1,128 @@
+# render.py: Reusable 7x4 Gran figure for PyGranTitEQP
+# Builds the figure and its Line2D artists once and swaps the data per dataset with set_data (headless Agg or interactive)
+
+import numpy as np
+
+from gran_engine import GRAN_FUNCTIONS, G, DG, D2G
+
+FIGSIZE = (16, 28)
+STYLE = 'seaborn-v0_8'
+REPORT_DPI = 300
+PREVIEW_DPI = 72
+
+# Row 2-4 (G1's and their derivatives) and row 5-7 (G2's and their derivatives) styling per column
+G1_COLORS = ['green', 'olive', 'orange', 'purple']
+G2_COLORS = ['red', 'brown', 'cyan', 'magenta']
+LINE_STYLES = ['-', '-', '--', ':']
+MARKERS = ['o', 'o', 's', '^']
+
+
+def _grid_spec():
+    """Yield (row, col, gran_row, quantity, line kwargs, ylabel, title) for rows 2-7 of the 7x4 grid."""
+    for block, (group, colors) in enumerate((('G1', G1_COLORS), ('G2', G2_COLORS))):
+        for col in range(4):
+            gran_row = 4 * block + col
+            name, formula = GRAN_FUNCTIONS[gran_row][:2]
+            style = dict(marker=MARKERS[col], linestyle=LINE_STYLES[col], color=colors[col])
+            yield (1 + 3 * block, col, gran_row, G, dict(style, label=f'{name} = {formula}'), f'Gran {group}', f'{name} Plot')
+            yield (2 + 3 * block, col, gran_row, DG, dict(style, label=f'd({name})/dv'), f'd{group}/dv', f'First Derivative of {name}')
+            yield (3 + 3 * block, col, gran_row, D2G, dict(style, label=f'd²({name})/dv²'), f'd²{group}/dv²', f'Second Derivative of {name}')
+
+
+class GranFigure:
+    """Titration curve, all G1's and G2's and their derivatives in a 7x4 grid, built once and reused.
+
+    With headless=True the figure is rendered by the Agg canvas directly and pyplot is never
+    imported, so nothing can block; otherwise the figure is created through pyplot and show()
+    opens it in the interactive backend.
+    """
+
+    def __init__(self, headless=True, figsize=FIGSIZE, style=STYLE):
+        import matplotlib.style
+        self.headless = headless
+        with matplotlib.style.context(style):
+            if headless:
+                from matplotlib.backends.backend_agg import FigureCanvasAgg
+                from matplotlib.figure import Figure
+                self.fig = Figure(figsize=figsize)
+                FigureCanvasAgg(self.fig)
+            else:
+                import matplotlib.pyplot as plt
+                self.fig = plt.figure(figsize=figsize)
+            self.axes = self.fig.subplots(7, 4, sharex=True)
+            empty = np.empty(0)
+
+            # Row 1: Titration curve in all 4 columns
+            self.curve_lines = []
+            for col in range(4):
+                ax = self.axes[0, col]
+                self.curve_lines.append(ax.plot(empty, empty, marker='o', linestyle='-', color='blue', label='Titration Data')[0])
+                ax.set_ylabel('pH')
+                ax.set_title('Titration Curve')
+
+            # Rows 2-7: Gran functions and their first and second derivatives
+            self.gran_lines = []
+            for row, col, gran_row, quantity, line_kwargs, ylabel, title in _grid_spec():
+                ax = self.axes[row, col]
+                line = ax.plot(empty, empty, **line_kwargs)[0]
+                self.gran_lines.append((line, gran_row, quantity))
+                ax.set_ylabel(ylabel)
+                ax.set_title(title)
+            for ax in self.axes.flat:
+                ax.grid(True)
+                ax.legend()
+            for col in range(4):
+                self.axes[6, col].set_xlabel('Volume Added (mL)')
+        self._laid_out = False
+
+    def update(self, volume, pH, gran, xlim=None):
+        """Swap in a new dataset; gran is the (8, 3, n) array from gran_engine.compute_gran.
+
+        With xlim=(vmin, vmax) the x-axis is limited to that range and every y-axis is scaled
+        to the data inside it (10% margin); otherwise all axes autoscale to the full data.
+        """
+        volume = np.asarray(volume)
+        for line in self.curve_lines:
+            line.set_data(volume, pH)
+        for line, gran_row, quantity in self.gran_lines:
+            line.set_data(volume, gran[gran_row, quantity])
+
+        mask = None
+        if xlim is not None:
+            mask = (volume >= xlim[0]) & (volume <= xlim[1])
+            if not mask.any():
+                mask = None  # no data in range: scale to the full data
+        for ax in self.axes.flat:
+            if mask is None:
+                ax.relim()
+                ax.autoscale_view()
+            else:
+                y = ax.lines[0].get_ydata()[mask]
+                y_min, y_max = np.min(y), np.max(y)
+                y_margin = (y_max - y_min) * 0.1
+                if y_margin > 0:
+                    ax.set_ylim(y_min - y_margin, y_max + y_margin)
+        if xlim is not None:
+            self.axes[0, 0].set_xlim(*xlim)  # shared by all axes
+        if not self._laid_out:
+            self.fig.tight_layout()
+            self._laid_out = True
+        if not self.headless:
+            self.fig.canvas.draw_idle()
+
+    def save(self, output_file, dpi=REPORT_DPI):
+        """Render the current dataset to a file; use PREVIEW_DPI for quick previews."""
+        self.fig.savefig(output_file, dpi=dpi)
+
+    def show(self):
+        """Open the figure in the interactive backend (blocks until closed)."""
+        if self.headless:
+            raise RuntimeError("A headless GranFigure cannot be shown; create it with headless=False.")
+        import matplotlib.pyplot as plt
+        plt.show()
+
+    def close(self):
+        """Release the figure (needed for pyplot-managed figures)."""
+        if not self.headless:
+            import matplotlib.pyplot as plt
+            plt.close(self.fig)
@@ -0,0 +1,175 @@
+# replicates.py: Replicate comparison for PyGranTitEQP
+# Groups replicate files, evaluates all their curves as one ragged batch and reports per-group equivalence-volume statistics
+
+import argparse
+import os
+import re
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from endpoint import find_endpoint
+from gran_engine import gran_functions, gran_index
+
+RESPONSES = ('pH', 'mV')
+# Gran functions of mV data (see potentiometric.METHODS)
+METHODS = ('Ion', 'Redox')
+# Trailing replicate number of a file name: 00_HCl_TRIS_01.csv and 00_HCl_TRIS_02.csv belong to group 00_HCl_TRIS
+_REPLICATE_SUFFIX = re.compile(r'^(.*?)[_\-\s]+(\d+)$')
+
+# Per group: number of curves with an endpoint, Gran mean/standard deviation/relative standard deviation (%),
+# mean of the G1-branch intercepts and the mean/standard deviation of the paired Gran - G1 difference (NaN if undefined)
+ReplicateStats = namedtuple('ReplicateStats', ['group', 'curves', 'count', 'mean', 'std', 'rsd',
+                                               'g1_mean', 'g1_difference_mean', 'g1_difference_std'])
+STATS_FIELDS = list(ReplicateStats._fields)
+
+
+def replicate_key(file_path):
+    """Group key of a file: its directory and name without extension and trailing replicate number."""
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    match = _REPLICATE_SUFFIX.match(stem)
+    return os.path.join(os.path.dirname(file_path), match.group(1) if match else stem)
+
+
+def group_files(files):
+    """Group files by replicate_key; returns {key: sorted files} in key order."""
+    groups = {}
+    for file_path in files:
+        groups.setdefault(replicate_key(file_path), []).append(file_path)
+    return {key: sorted(groups[key]) for key in sorted(groups)}
+
+
+def load_groups(groups):
+    """Stack every curve of every replicate file into ragged arrays.
+
+    Multi-block files (GranTED exports) contribute one curve per block; derivative blocks
+    ('dE/dV') are skipped. Returns (volume, response, offsets, curve_group, sources): curve i
+    spans offsets[i]:offsets[i + 1], belongs to group curve_group[i] (index into the group list)
+    and came from sources[i] = (file, block number).
+    """
+    from loader import load_blocks
+    volumes, responses, curve_group, sources = [], [], [], []
+    for group, files in enumerate(groups.values()):
+        for file_path in files:
+            for number, (title, data) in enumerate(load_blocks(file_path)):
+                if title.endswith('dE/dV') or data.shape[1] < 2:
+                    continue
+                volumes.append(data[:, 0])
+                responses.append(data[:, 1])
+                curve_group.append(group)
+                sources.append((file_path, number))
+    offsets = np.cumsum([0] + [v.size for v in volumes])
+    if not volumes:
+        return np.empty(0), np.empty(0), offsets, np.empty(0, dtype=int), sources
+    return np.concatenate(volumes), np.concatenate(responses), offsets, np.array(curve_group), sources
+
+
+def curve_endpoints(volume, response, offsets, response_type='pH', titration='StrongAcid', V=25.0,
+                    temperature=25.0, electrons=1, method='Ion'):
+    """Gran and G1-branch equivalence volumes of every stacked curve; returns two arrays (NaN where none is found).
+
+    The Gran functions of all curves are evaluated in one pass over the stacked arrays
+    (titration selects the pH functions, method the mV functions). The Gran endpoint combines
+    the G1 and G2 branches; the G1 value is the x-intercept of the G1 (pre-endpoint) branch of
+    that fit alone, so the paired difference shows how far G2 pulls the combined endpoint. A
+    curve that cannot be fitted (e.g. non-finite Gran values) is left NaN.
+    """
+    if response_type == 'pH':
+        gran = gran_functions(volume, response, V, normalize=True, offsets=offsets)
+        g1 = gran[gran_index(titration + '_G1')]
+        g2 = gran[gran_index(titration + '_G2')]
+    elif response_type == 'mV':
+        from potentiometric import potential_gran, potential_index
+        if method not in METHODS:
+            raise ValueError(f"Unknown method '{method}'. Choose from: {', '.join(METHODS)}")
+        gran = potential_gran(volume, response, offsets, V, temperature, electrons)
+        g1 = gran[potential_index(method + '_G1')]
+        g2 = gran[potential_index(method + '_G2')]
+    else:
+        raise ValueError(f"Unknown response type '{response_type}'. Choose from: {', '.join(RESPONSES)}")
+
+    gran_ve = np.full(len(offsets) - 1, np.nan)
+    g1_ve = np.full(len(offsets) - 1, np.nan)
+    for i, (start, stop) in enumerate(zip(offsets[:-1], offsets[1:])):
+        v = volume[start:stop]
+        if np.any(np.diff(v) < 0):
+            continue
+        try:
+            endpoint = find_endpoint(v, g1[start:stop], g2[start:stop])
+        except ValueError:
+            continue
+        if endpoint is None:
+            continue
+        gran_ve[i] = endpoint.volume
+        for fit in endpoint.fits:
+            if fit.slope < 0:  # the G1 branch
+                g1_ve[i] = fit.x_intercept
+    return gran_ve, g1_ve
+
+
+def group_statistics(values, curve_group, n_groups):
+    """Count, mean and sample standard deviation of values per group, ignoring NaN (np.bincount, no Python loop)."""
+    valid = np.isfinite(values)
+    groups = curve_group[valid]
+    x = values[valid]
+    count = np.bincount(groups, minlength=n_groups).astype(float)
+    total = np.bincount(groups, weights=x, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = total / count
+        deviation = x - mean[groups]
+        std = np.sqrt(np.bincount(groups, weights=deviation * deviation, minlength=n_groups) / (count - 1))
+    std[count < 2] = np.nan
+    return count, mean, std
+
+
+def compare_replicates(files, response_type='pH', titration='StrongAcid', V=25.0, temperature=25.0, electrons=1,
+                       method='Ion'):
+    """Group replicate files, evaluate all their curves and return one ReplicateStats per group."""
+    groups = group_files(files)
+    volume, response, offsets, curve_group, _ = load_groups(groups)
+    gran_ve, g1_ve = curve_endpoints(volume, response, offsets, response_type, titration, V, temperature, electrons,
+                                          method)
+    n_groups = len(groups)
+    curves = np.bincount(curve_group, minlength=n_groups)
+    count, mean, std = group_statistics(gran_ve, curve_group, n_groups)
+    _, g1_mean, _ = group_statistics(g1_ve, curve_group, n_groups)
+    _, difference_mean, difference_std = group_statistics(gran_ve - g1_ve, curve_group, n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rsd = 100.0 * std / np.abs(mean)
+    return [ReplicateStats(key, int(curves[i]), int(count[i]), mean[i], std[i], rsd[i],
+                           g1_mean[i], difference_mean[i], difference_std[i])
+            for i, key in enumerate(groups)]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replicate statistics of Gran equivalence volumes.")
+    parser.add_argument('inputs', nargs='+', help="Data files, glob patterns or directories")
+    parser.add_argument('-o', '--output', default='-', help="Statistics table (CSV); '-' for stdout (default: %(default)s)")
+    parser.add_argument('-r', '--response', choices=RESPONSES, default='pH', help="Measured response (default: %(default)s)")
+    parser.add_argument('-t', '--titration', default='StrongAcid',
+                        choices=('StrongAcid', 'StrongBase', 'WeakAcid', 'WeakBase'), help="Titration type for pH data (default: %(default)s)")
+    parser.add_argument('-m', '--method', choices=METHODS, default='Ion',
+                        help="Gran functions for mV data: Ion (ion-selective or pH electrode) or Redox (Pt electrode) (default: %(default)s)")
+    parser.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Initial volume to be titrated in mL (default: %(default)s)")
+    parser.add_argument('-T', '--temperature', type=float, default=25.0, help="Temperature in °C for mV data (default: %(default)s)")
+    parser.add_argument('-n', '--electrons', type=int, default=1, help="Electron number for mV data (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function of the replicate command-line interface."""
+    from batch import expand_inputs, write_results
+    args = parse_args(argv)
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("Error: no data files matched the given inputs.", file=sys.stderr)
+        return 1
+    stats = compare_replicates(files, args.response, args.titration, args.initial_volume, args.temperature, args.electrons,
+                               args.method)
+    write_results((s._asdict() for s in stats), args.output, STATS_FIELDS)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,264 @@
+# results_store.py: Columnar results store for PyGranTitEQP
+# Appends raw curves, Gran arrays, fits and endpoints to a directory of chunked NumPy columns that can be read back curve by curve
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+from endpoint import Endpoint, LinearFit
+from gran_engine import G, GRAN_NAMES, gran_index
+from method import TITRATION_TYPES
+from schwarz import SCHWARZ_FUNCTIONS
+
+STORE_VERSION = 1
+MANIFEST = 'store.json'
+# Curves are split into chunks of at most this many points, so a compressed chunk is decompressed in one small piece
+CHUNK_POINTS = 1 << 20
+# Per-curve columns: endpoint values in the order of Endpoint, and up to two branch fits in the order of LinearFit
+ENDPOINT_COLUMNS = Endpoint._fields[:-1]
+MAX_FITS = 2
+
+# One stored curve; gran is normalized as in method.Analysis (row i times 10^log_scale[i] gives the Gran values),
+# endpoints maps each stored titration type to its Endpoint (or None), meta holds source, block, title, V and k
+StoredCurve = namedtuple('StoredCurve', ['volume', 'response', 'gran', 'log_scale', 'endpoints', 'meta'])
+TABLE_FIELDS = ['curve', 'source', 'block', 'title', 'titration', 'points', 'volume_eq', 'ci_low', 'ci_high', 'stderr', 'r2',
+                'branches', 'status']
+
+
+def _write_json(file_path, value):
+    """Write JSON atomically (temporary file and rename), so readers never see a partial manifest."""
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(file_path) or '.')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(value, f, indent=1)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _endpoint_columns(endpoints, n_curves):
+    """Endpoints (one list per titration type) as NaN-padded arrays (titrations, curves, ...)."""
+    values = np.full((len(endpoints), n_curves, len(ENDPOINT_COLUMNS)), np.nan)
+    fits = np.full((len(endpoints), n_curves, MAX_FITS, len(LinearFit._fields)), np.nan)
+    for t, row in enumerate(endpoints):
+        for i, endpoint in enumerate(row):
+            if endpoint is not None:
+                values[t, i] = endpoint[:-1]
+                fits[t, i, :len(endpoint.fits)] = endpoint.fits
+    return values, fits
+
+
+def _endpoint(values, fits):
+    """Endpoint from one row of the endpoint columns, or None."""
+    if np.isnan(values[0]):
+        return None
+    fits = tuple(LinearFit(int(fit[0]), int(fit[1]), *map(float, fit[2:])) for fit in fits if not np.isnan(fit[0]))
+    return Endpoint(*map(float, values), fits)
+
+
+class ResultStore:
+    """Directory of analysed curves, appended to chunk by chunk and read back without recomputation.
+
+    Every chunk holds one column per array: the raw curves (volume, response and their
+    offsets), the normalized (8, 3, n) Gran functions and derivatives with their per-curve
+    log scale, the endpoint values and branch fits of every titration type and a JSON list of
+    curve metadata. Uncompressed chunks are directories of .npy files that are memory-mapped,
+    so reading one curve touches only its own bytes; compressed chunks are .npz archives that
+    are decompressed column by column. store.json lists the chunks and is replaced atomically
+    after a chunk is complete, so readers only ever see whole chunks. Only one process may
+    append at a time.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._open = {}  # chunk name -> {column: array}
+        manifest_path = os.path.join(directory, MANIFEST)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+            if self.manifest.get('version') != STORE_VERSION:
+                raise ValueError(f"'{directory}' is a results store of version {self.manifest.get('version')}, expected {STORE_VERSION}")
+        else:
+            self.manifest = {'version': STORE_VERSION, 'gran_names': list(GRAN_NAMES), 'chunks': []}
+        self._first = np.cumsum([0] + [chunk['curves'] for chunk in self.manifest['chunks']])
+
+    def __len__(self):
+        return int(self._first[-1])
+
+    def __repr__(self):
+        return f"<ResultStore '{self.directory}': {len(self)} curves in {len(self.manifest['chunks'])} chunks>"
+
+    def append(self, curves, titrations=TITRATION_TYPES, k=1.0, dtype=np.float64, compress=False, smoothing=None):
+        """Analyse a TitrationSet and append it; returns the store indices of its curves (a range).
+
+        Every curve needs at least 3 points (see TitrationSet.validate). k is the Schwarz
+        constant recorded with the curves (see schwarz()).
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        first = len(self)
+        start = 0
+        while start < len(curves):
+            # Whole curves, at most CHUNK_POINTS points per chunk (a longer curve gets a chunk of its own)
+            stop = int(np.searchsorted(curves.offsets, curves.offsets[start] + CHUNK_POINTS, side='right')) - 1
+            stop = min(max(stop, start + 1), len(curves))
+            self._write_chunk(curves.subset(slice(start, stop)), tuple(titrations), k, dtype, compress, smoothing)
+            start = stop
+        return range(first, len(self))
+
+    def _write_chunk(self, curves, titrations, k, dtype, compress, smoothing):
+        gran = curves.compute_gran(dtype=dtype, smoothing=smoothing)
+        endpoints = [curves.endpoints(titration, gran[:, G]) for titration in titrations]
+        values, fits = _endpoint_columns(endpoints, len(curves))
+        columns = dict(offsets=curves.offsets.astype(np.int64), volume=curves.volume, response=curves.response, gran=gran,
+                       log_scale=curves.gran_log_scale(), endpoints=values, fits=fits)
+        meta = [dict(source=c.source, block=c.block, title=c.title, V=c.V, k=float(k)) for c in curves.curves]
+        name = f"chunk_{len(self.manifest['chunks']):06d}"
+        if compress:
+            np.savez_compressed(os.path.join(self.directory, name + '.npz'), meta=np.array(json.dumps(meta)), **columns)
+        else:
+            os.makedirs(os.path.join(self.directory, name), exist_ok=True)
+            for column, array in columns.items():
+                np.save(os.path.join(self.directory, name, column + '.npy'), array)
+            _write_json(os.path.join(self.directory, name, 'meta.json'), meta)
+        self.manifest['chunks'].append(dict(name=name, curves=len(curves), points=int(curves.volume.size),
+                                            compressed=bool(compress), titrations=list(titrations)))
+        _write_json(os.path.join(self.directory, MANIFEST), self.manifest)
+        self._first = np.append(self._first, self._first[-1] + len(curves))
+
+    def _chunk(self, c):
+        """Columns of chunk c: memory-mapped .npy files or a lazily decompressing NpzFile."""
+        chunk = self.manifest['chunks'][c]
+        name = chunk['name']
+        if name not in self._open:
+            if chunk['compressed']:
+                archive = np.load(os.path.join(self.directory, name + '.npz'), allow_pickle=False)
+                columns = {'meta': json.loads(str(archive['meta']))}
+                columns.update((column, archive[column]) for column in ('offsets', 'endpoints', 'fits'))
+                columns['archive'] = archive
+            else:
+                path = os.path.join(self.directory, name)
+                with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+                    columns = {'meta': json.load(f)}
+                for entry in os.listdir(path):
+                    if entry.endswith('.npy'):
+                        columns[entry[:-4]] = np.load(os.path.join(path, entry), mmap_mode='r')
+            self._open[name] = columns
+        return self._open[name]
+
+    def _column(self, c, column):
+        columns = self._chunk(c)
+        if column not in columns:
+            columns[column] = columns['archive'][column]  # decompressed on first use only
+        return columns[column]
+
+    def _locate(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"curve {i} out of range for a store of {len(self)} curves")
+        i %= len(self)
+        c = int(np.searchsorted(self._first, i, side='right')) - 1
+        return c, i - int(self._first[c])
+
+    def curve(self, i):
+        """Curve i with its stored results; the arrays are read-only views (memory-mapped when uncompressed)."""
+        c, j = self._locate(i)
+        offsets = self._column(c, 'offsets')
+        start, stop = int(offsets[j]), int(offsets[j + 1])
+        titrations = self.manifest['chunks'][c]['titrations']
+        values, fits = self._column(c, 'endpoints'), self._column(c, 'fits')
+        endpoints = {titration: _endpoint(values[t, j], fits[t, j]) for t, titration in enumerate(titrations)}
+        return StoredCurve(self._column(c, 'volume')[start:stop], self._column(c, 'response')[start:stop],
+                           self._column(c, 'gran')[..., start:stop], np.asarray(self._column(c, 'log_scale')[:, j]),
+                           endpoints, self._chunk(c)['meta'][j])
+
+    def __getitem__(self, i):
+        return self.curve(i)
+
+    def schwarz(self, i):
+        """The four Schwarz functions of curve i with its k, shape (4, n).
+
+        Each Schwarz function is 10^k times the Gran G1 of its titration type, so it is
+        computed from the stored Gran rows instead of being stored twice.
+        """
+        curve = self.curve(i)
+        rows = [gran_index(name[len('Schwarz_'):]) for name, _, _, _ in SCHWARZ_FUNCTIONS]
+        return curve.gran[rows, G] * np.power(10.0, curve.log_scale[rows] + curve.meta['k'])[:, None]
+
+    def rows(self):
+        """One result row (dict of TABLE_FIELDS) per curve and titration type; reads only the endpoint columns."""
+        for c, chunk in enumerate(self.manifest['chunks']):
+            meta, offsets = self._chunk(c)['meta'], self._column(c, 'offsets')
+            values, fits = self._column(c, 'endpoints'), self._column(c, 'fits')
+            for j in range(chunk['curves']):
+                base = dict(curve=int(self._first[c]) + j, source=meta[j]['source'], block=meta[j]['block'],
+                            title=meta[j]['title'], points=int(offsets[j + 1] - offsets[j]))
+                for t, titration in enumerate(chunk['titrations']):
+                    row = dict(base, titration=titration)
+                    endpoint = _endpoint(values[t, j], fits[t, j])
+                    if endpoint is None:
+                        row['status'] = 'no linear region'
+                    else:
+                        row.update(volume_eq=endpoint.volume, ci_low=endpoint.ci_low, ci_high=endpoint.ci_high,
+                                   stderr=endpoint.stderr, r2=endpoint.r2, branches=len(endpoint.fits), status='ok')
+                    yield row
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Store analysed titration curves in a columnar results store, or export its table.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    append = commands.add_parser('append', help="Analyse data files and append them to a store")
+    append.add_argument('store', help="Store directory (created if missing)")
+    append.add_argument('inputs', nargs='+', help="Data files, glob patterns or directories")
+    append.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Initial volume to be titrated in mL (default: %(default)s)")
+    append.add_argument('-k', type=float, default=1.0, help="Schwarz constant recorded with the curves (default: %(default)s)")
+    append.add_argument('-t', '--titration', choices=TITRATION_TYPES, action='append',
+                        help="Titration type(s) to evaluate; repeat for several (default: all)")
+    append.add_argument('-q', '--quantity', default=None, help="Only keep blocks whose title ends with this, e.g. E (default: all)")
+    append.add_argument('--compress', action='store_true', help="Write compressed chunks (smaller, but not memory-mapped)")
+    table = commands.add_parser('table', help="Write the endpoint table of a store as CSV")
+    table.add_argument('store', help="Store directory")
+    table.add_argument('-o', '--output', default='-', help="Results table (CSV); '-' for stdout (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function of the results store command-line interface."""
+    from batch import expand_inputs, write_results
+    args = parse_args(argv)
+    if args.command == 'table':
+        if not os.path.exists(os.path.join(args.store, MANIFEST)):
+            print(f"Error: '{args.store}' is not a results store.", file=sys.stderr)
+            return 1
+        write_results(ResultStore(args.store).rows(), args.output, TABLE_FIELDS)
+        return 0
+
+    from titration_set import TitrationSet
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("Error: no data files matched the given inputs.", file=sys.stderr)
+        return 1
+    try:
+        curves = TitrationSet.from_files(files, args.quantity, V=args.initial_volume)
+        store = ResultStore(args.store)
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    valid = curves.validate(response_range=None).valid
+    if not np.any(valid):
+        print("Error: no valid curves (at least 3 points with increasing volumes) in the given files.", file=sys.stderr)
+        return 1
+    if not np.all(valid):
+        print(f"Skipping {np.count_nonzero(~valid)} invalid curve(s)", file=sys.stderr)
+    added = store.append(curves.subset(valid), args.titration or TITRATION_TYPES, args.k, compress=args.compress)
+    print(f"Appended {len(added)} curves to '{args.store}' ({len(store)} in total)", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# schwarz.py: Schwarz function parameter sweeps for PyGranTitEQP
+# Rates the linearity of the Schwarz functions over whole (k, V) grids from closed-form window moments (NumPy only)
+
+from collections import namedtuple
+
+import numpy as np
+
+# Schwarz functions: Gran G1's with an extra constant k in the exponent
+# Each entry: (name, formula, uses V in the volume term, sign of pH in the exponent)
+SCHWARZ_FUNCTIONS = (
+    ('Schwarz_StrongAcid_G1', '(v + V) * 10^(k - pH)', True, -1),
+    ('Schwarz_StrongBase_G1', '(v + V) * 10^(k + pH)', True, 1),
+    ('Schwarz_WeakAcid_G1', 'v * 10^(k - pH)', False, -1),
+    ('Schwarz_WeakBase_G1', 'v * 10^(k + pH)', False, 1),
+)
+SCHWARZ_NAMES = tuple(entry[0] for entry in SCHWARZ_FUNCTIONS)
+
+# Linearity criteria and whether larger values are better
+CRITERIA = {'r2': True, 'stderr': False, 'residual': False}
+
+# r2, x_intercept, stderr and residual have shape (len(k), len(V)); slope has shape (len(V),) and holds
+# the slope for k = 0 (the slope for any k is 10^k times it)
+SchwarzSweep = namedtuple('SchwarzSweep', ['name', 'k', 'V', 'r2', 'x_intercept', 'stderr', 'residual', 'slope'])
+
+
+def schwarz_index(name):
+    """Return the position of a Schwarz function in SCHWARZ_FUNCTIONS."""
+    try:
+        return SCHWARZ_NAMES.index(name)
+    except ValueError:
+        raise ValueError(f"Unknown Schwarz function '{name}'. Choose from: {', '.join(SCHWARZ_NAMES)}") from None
+
+
+def schwarz_functions(volume, pH, k=1.0, V=25.0, normalize=False, dtype=np.float64):
+    """Evaluate all four Schwarz functions for one or more k; returns an array of shape (4, len(k), n).
+
+    10^(k ± pH) is computed as 10^k * 10^(±pH), so the exponentials are evaluated once for all k.
+    With normalize=True the exponents are shifted by their maxima (max k and max ±pH) before
+    exponentiation, as in gran_engine.gran_functions, so large k cannot overflow even in float32.
+    """
+    volume = np.asarray(volume, dtype=dtype)
+    pH = np.asarray(pH, dtype=dtype)
+    k = np.atleast_1d(np.asarray(k, dtype=dtype))
+    if normalize:
+        scale = np.power(dtype(10.0), k - np.max(k))[:, None]  # (len(k), 1)
+        up = np.power(dtype(10.0), pH - np.max(pH))
+        down = np.power(dtype(10.0), np.min(pH) - pH)
+    else:
+        scale = np.power(dtype(10.0), k)[:, None]
+        up = np.power(dtype(10.0), pH)
+        down = 1.0 / up
+    rows = [(volume + V if uses_V else volume) * (up if sign > 0 else down) for _, _, uses_V, sign in SCHWARZ_FUNCTIONS]
+    return np.stack(rows)[:, None, :] * scale
+
+
+def sweep(volume, pH, k, V, name='Schwarz_StrongAcid_G1', window=None):
+    """Rate the linearity of one Schwarz function on every combination of k and V.
+
+    The function is (v + V) * 10^k * h with h = 10^(±pH), so over the fit window every least-squares
+    sum is a polynomial in V whose coefficients are six sums of h, which are computed once. Each V
+    then costs O(1) regardless of the number of points, and no (V, n) array is ever built. k only
+    scales the function, so R², the x-intercept and its standard error do not depend on it: those
+    are computed per V and broadcast (as read-only views) over k, so the result stays O(len(V)).
+
+    window=(vmin, vmax) restricts the fit to that volume range (default: all points). The residual
+    criterion is the residual standard deviation of the fit expressed in volume units.
+    """
+    volume = np.asarray(volume, dtype=float)
+    pH = np.asarray(pH, dtype=float)
+    if volume.ndim != 1 or volume.shape != pH.shape:
+        raise ValueError("volume and pH must be 1-D arrays of the same length.")
+    _, _, uses_V, sign = SCHWARZ_FUNCTIONS[schwarz_index(name)]
+    k = np.atleast_1d(np.asarray(k, dtype=float))
+    V = np.atleast_1d(np.asarray(V, dtype=float))
+    if window is not None:
+        mask = (volume >= window[0]) & (volume <= window[1])
+        volume, pH = volume[mask], pH[mask]
+    n = volume.size
+    if n < 3:
+        raise ValueError("At least 3 data points inside the window are required.")
+
+    # Centre the volumes and scale h to max 1; the scale goes back into the slope at the end
+    shift = volume.mean()
+    x = volume - shift
+    exponent = sign * pH
+    log_scale = exponent.max()
+    h = np.power(10.0, exponent - log_scale)
+    hh = h * h
+    a0, a1, b2 = h.sum(), (x * h).sum(), (x * x * h).sum()
+    c0, c1, c2 = hh.sum(), (x * hh).sum(), (x * x * hh).sum()
+    sxx = (x * x).sum()
+
+    # Function = (x + w) * h with w = shift + V (or just shift when V is not used)
+    w = shift + V if uses_V else np.full(V.shape, shift)
+    sy = a1 + w * a0
+    sxy = b2 + w * a1
+    syy = c2 + 2.0 * w * c1 + w * w * c0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        syy_c = np.maximum(syy - sy * sy / n, 0.0)
+        slope = sxy / sxx
+        mean_y = sy / n
+        rss = np.maximum(syy_c - slope * sxy, 0.0)
+        r2 = np.where(syy_c > 0, 1.0 - rss / syy_c, 0.0)
+        s = np.sqrt(rss / max(n - 2, 1))
+        x_intercept = shift - mean_y / slope
+        stderr = s / np.abs(slope) * np.sqrt(1.0 / n + mean_y**2 / (slope**2 * sxx))
+        residual = s / np.abs(slope)
+
+    shape = (k.size, V.size)
+    return SchwarzSweep(name, k, V, np.broadcast_to(r2, shape), np.broadcast_to(x_intercept, shape),
+                        np.broadcast_to(stderr, shape), np.broadcast_to(residual, shape), slope * 10.0**log_scale)
+
+
+def branch_window(volume, pH, name, V=25.0):
+    """Volume range (vmin, vmax) of the linear G1 branch of a Schwarz function at analyte volume V, or None.
+
+    The branch is searched as in endpoint.find_endpoint; k only scales the function, so it is
+    searched at k = 0.
+    """
+    from endpoint import find_linear_region
+    volume = np.asarray(volume, dtype=float)
+    values = schwarz_functions(volume, pH, 0.0, V, normalize=True)[schwarz_index(name), 0]
+    fit = find_linear_region(volume, values, slope_sign=-1)
+    return None if fit is None else (float(volume[fit.start]), float(volume[fit.stop - 1]))
+
+
+def best(result, criterion='r2'):
+    """Optimal (V, value) of a SchwarzSweep for a criterion in CRITERIA ('r2', 'stderr' or 'residual').
+
+    k is not part of the optimum: it only scales the function, so every criterion is the same for
+    all k. V is None for the weak-acid/base functions, which do not depend on it.
+    """
+    if criterion not in CRITERIA:
+        raise ValueError(f"Unknown criterion '{criterion}'. Choose from: {', '.join(CRITERIA)}")
+    values = getattr(result, criterion)[0]  # the same for every k
+    if np.all(np.isnan(values)):
+        return None
+    j = np.nanargmax(values) if CRITERIA[criterion] else np.nanargmin(values)
+    uses_V = SCHWARZ_FUNCTIONS[schwarz_index(result.name)][2]
+    return (float(result.V[j]) if uses_V else None), float(values[j])
+
+
+def sweep_all(volume, pH, V, window=None, criteria=tuple(CRITERIA), branch_V=25.0):
+    """Sweep all four Schwarz functions over V; returns {name: {criterion: (V, value)}} with the optima.
+
+    Without a window each function is fitted over its own linear G1 branch (see branch_window,
+    searched at analyte volume branch_V); a line through the whole curve would also span the
+    endpoint. Functions without a linear branch get None for every criterion.
+    """
+    optima = {}
+    for name in SCHWARZ_NAMES:
+        fit_window = window if window is not None else branch_window(volume, pH, name, branch_V)
+        if fit_window is None:
+            optima[name] = dict.fromkeys(criteria)
+            continue
+        result = sweep(volume, pH, 0.0, V, name, fit_window)
+        optima[name] = {criterion: best(result, criterion) for criterion in criteria}
+    return optima
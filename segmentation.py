@@ -0,0 +1,231 @@
+# segmentation.py: Multi-endpoint detection for PyGranTitEQP
+# Splits a titration curve into linear pieces by dynamic programming and locates every equivalence point (polyprotic curves) in one pass
+
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+from endpoint import SegmentFitter, combine_fits, find_linear_region
+from gran_engine import gran_functions, gran_index
+
+# inflection: volume of the steepest point of the jump (maximum of dpH/dv); endpoint: Endpoint from the Gran
+# branches on either side (None if none is linear or usable); start/stop: index range of the jump segment (stop
+# exclusive); status: 'ok', 'no linear region' or 'outside jump' (every Gran intercept missed the jump, so the
+# inflection is the equivalence volume)
+EquivalencePoint = namedtuple('EquivalencePoint', ['inflection', 'endpoint', 'start', 'stop', 'status'])
+RESULT_FIELDS = ['file', 'titration', 'endpoint', 'inflection', 'volume_eq', 'ci_low', 'ci_high', 'stderr', 'r2', 'branches', 'status']
+
+
+def _boundary_grid(n, max_candidates):
+    if n + 1 <= max_candidates:
+        return np.arange(n + 1)
+    return np.unique(np.linspace(0, n, max_candidates).round().astype(int))
+
+
+def _segmentations(fitter, boundaries, max_segments, min_points):
+    """Least-squares optimal piecewise-linear segmentations with 1 ... max_segments pieces.
+
+    Dynamic programming over the boundary grid: the residual sum of squares of every
+    candidate piece comes from the prefix sums of the fitter (O(1) each), and each extra
+    piece costs one vectorized min over the grid², i.e. O(max_segments * len(boundaries)²) in
+    total, independent of the number of points. Returns {pieces: boundary indices}.
+    """
+    m = len(boundaries)
+    start, stop = np.meshgrid(boundaries, boundaries, indexing='ij')
+    valid = (stop - start) >= min_points
+    _, _, _, rss, _ = fitter.fit(np.where(valid, start, 0), np.where(valid, stop, min_points))
+    cost = np.where(valid, rss, np.inf)
+
+    best = np.full(m, np.inf)
+    best[0] = 0.0
+    previous = []  # previous[k][j]: grid index where the last of k + 1 pieces ending at j starts
+    segmentations = {}
+    for pieces in range(1, max_segments + 1):
+        total = best[:, None] + cost
+        previous.append(np.argmin(total, axis=0))
+        best = total[previous[-1], np.arange(m)]
+        if not np.isfinite(best[-1]):
+            break
+        path = [m - 1]
+        for k in range(pieces - 1, -1, -1):
+            path.append(previous[k][path[-1]])
+        segmentations[pieces] = boundaries[np.array(path[::-1])]
+    return segmentations
+
+
+def segment_curve(volume, y, n_segments, min_points=3, max_candidates=256):
+    """Boundary indices (n_segments + 1 values from 0 to len(volume)) of the best piecewise-linear fit of y(volume).
+
+    Boundaries are searched on a grid of at most max_candidates indices. Raises ValueError if
+    the curve is too short for n_segments pieces of min_points points.
+    """
+    fitter = SegmentFitter(volume, y)
+    segmentations = _segmentations(fitter, _boundary_grid(len(fitter), max_candidates), n_segments, min_points)
+    if n_segments not in segmentations:
+        raise ValueError(f"Curve too short for {n_segments} segments of at least {min_points} points.")
+    return segmentations[n_segments]
+
+
+def _jumps(fitter, volume, bounds, direction, min_ratio, min_rise):
+    """Index ranges of the jumps of a segmentation: runs of steep pieces between flatter ones.
+
+    Every piece whose slope is a local maximum starts a run, which is extended over its
+    neighbours while they are at least 1/min_ratio as steep. A run is a jump if it rises by
+    at least min_rise and is enclosed by flatter pieces other than the first and last one:
+    the pieces at the curve ends often hold the steep initial rise of a weak acid or base,
+    which is no equivalence point.
+    """
+    slope, _, _, _, _ = fitter.fit(bounds[:-1], bounds[1:])
+    slope = direction * slope * fitter.y_scale
+    rise = slope * (volume[bounds[1:] - 1] - volume[bounds[:-1]])
+    jumps = []
+    for i in range(1, len(slope) - 1):
+        if not (slope[i] > 0 and slope[i] > slope[i - 1] and slope[i] >= slope[i + 1]):
+            continue
+        low, high = i, i
+        while low > 0 and slope[low - 1] * min_ratio >= slope[i]:
+            low -= 1
+        while high < len(slope) - 1 and slope[high + 1] * min_ratio >= slope[i]:
+            high += 1
+        if low < 2 or high > len(slope) - 3 or np.sum(rise[low:high + 1]) < min_rise:
+            continue
+        if jumps and jumps[-1][0] == bounds[low]:
+            continue  # a second peak within the same run
+        jumps.append((bounds[low], bounds[high + 1]))
+    return jumps
+
+
+def _steepest(fitter, start, stop, width, direction):
+    """Centre index of the steepest run of width points within [start, stop).
+
+    The slope of each run is its least-squares dpH/dv from the prefix sums, so on long, noisy
+    curves the noise of the point-to-point derivative averages out.
+    """
+    width = max(2, min(width, stop - start))
+    starts = np.arange(start, stop - width + 1)
+    slope, _, _, _, _ = fitter.fit(starts, starts + width)
+    return int(starts[np.argmax(direction * slope)] + width // 2)
+
+
+def _branch_fit(volume, g, first, last, slope_sign, **search):
+    """Linear Gran branch within [first, last) with indices relative to the whole curve, or None."""
+    if last - first < search.get('min_points', 5):
+        return None
+    fit = find_linear_region(volume[first:last], g[first:last], slope_sign=slope_sign, **search)
+    return None if fit is None else fit._replace(start=fit.start + first, stop=fit.stop + first)
+
+
+def find_equivalence_points(volume, pH, titration='WeakAcid', V=25.0, max_endpoints=4, min_ratio=3.0, min_rise=0.5,
+                            min_points=3, max_candidates=256, confidence=0.95, **search):
+    """Locate all equivalence points of a (polyprotic) titration curve; returns a list of EquivalencePoint.
+
+    The pH curve is segmented once into 4 * max_endpoints + 1 linear pieces; runs of pieces
+    at least min_ratio times steeper than the plateaus around them and rising by at least
+    min_rise pH units are the jumps (see _jumps). The inflection of each jump is the maximum
+    of dpH/dv, and the endpoint is refined with the Gran branch of the plateau before it: the titration's G1 for the first, (v - Ve_prev) * 10^(∓pH) for later ones, whose
+    x-intercept is the next equivalence volume. The last endpoint also uses the titration's G2
+    after the jump. A branch whose intercept lies outside the volume range of its jump is
+    dropped: e.g. a G2 branch behind a buffer region (an equivalence point too weak to show a
+    jump) extrapolates to that later equivalence point, and the plateau before a jump whose
+    predecessor was missed extrapolates to the missed one. If no branch is left, the
+    inflection is the result (status 'outside jump'). Extra keyword arguments are passed on to
+    find_linear_region.
+    """
+    volume = np.asarray(volume, dtype=float)
+    pH = np.asarray(pH, dtype=float)
+    if volume.ndim != 1 or volume.shape != pH.shape:
+        raise ValueError("volume and pH must be 1-D arrays of the same length.")
+    if np.any(np.diff(volume) < 0):
+        raise ValueError("volumes are not monotonically increasing")
+    direction = 1.0 if pH[-1] >= pH[0] else -1.0  # pH rises when an acid is titrated
+    fitter = SegmentFitter(volume, pH)
+    pieces = 4 * max_endpoints + 1  # room for a plateau on each side and up to three pieces per jump
+    segmentations = _segmentations(fitter, _boundary_grid(volume.size, max_candidates), pieces, min_points)
+    if not segmentations:
+        return []
+    jumps = _jumps(fitter, volume, segmentations[max(segmentations)], direction, min_ratio, min_rise)[:max_endpoints]
+    if not jumps:
+        return []
+
+    width = max(3, volume.size // max_candidates)
+    inflections = [_steepest(fitter, start, stop, width, direction) for start, stop in jumps]
+    gran = gran_functions(volume, pH, V, normalize=True)
+    exponent = -direction * pH
+    decade = np.power(10.0, exponent - exponent.max())
+
+    points = []
+    previous_volume, first = 0.0, 0
+    for k, ((start, stop), peak) in enumerate(zip(jumps, inflections)):
+        if k == 0:
+            g = gran[gran_index(titration + '_G1')]
+        else:
+            g = (volume - previous_volume) * decade  # zero at the previous equivalence volume
+        fits = [_branch_fit(volume, g, first, peak, -1, **search)]
+        if k == len(jumps) - 1:
+            fits.append(_branch_fit(volume, gran[gran_index(titration + '_G2')], peak + 1, volume.size, 1, **search))
+        fits = [fit for fit in fits if fit is not None]
+        inside = [fit for fit in fits if volume[start] <= fit.x_intercept <= volume[stop - 1]]
+        endpoint = combine_fits(inside, confidence)
+        status = 'ok' if endpoint is not None else 'outside jump' if fits else 'no linear region'
+        points.append(EquivalencePoint(float(volume[peak]), endpoint, int(start), int(stop), status))
+        previous_volume = volume[peak] if endpoint is None else endpoint.volume
+        first = peak + 1
+    return points
+
+
+def evaluate_file(file_path, titration='WeakAcid', V=25.0, max_endpoints=4):
+    """Equivalence points of one file as result rows (one per endpoint). Never raises."""
+    from loader import load_titration
+    try:
+        volume, pH = load_titration(file_path)
+        points = find_equivalence_points(volume, pH, titration, V, max_endpoints)
+    except Exception as e:
+        return [dict(file=file_path, titration=titration, status=f'error: {e}')]
+    if not points:
+        return [dict(file=file_path, titration=titration, status='no equivalence point')]
+    rows = []
+    for number, point in enumerate(points, 1):
+        row = dict(file=file_path, titration=titration, endpoint=number, inflection=point.inflection)
+        endpoint = point.endpoint
+        if point.status == 'outside jump':
+            row.update(volume_eq=point.inflection, status='inflection: Gran endpoint outside the jump')
+        elif endpoint is None:
+            row['status'] = point.status
+        else:
+            row.update(volume_eq=endpoint.volume, ci_low=endpoint.ci_low, ci_high=endpoint.ci_high,
+                       stderr=endpoint.stderr, r2=endpoint.r2, branches=len(endpoint.fits), status='ok')
+        rows.append(row)
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find all equivalence points of (polyprotic) titration curves.")
+    parser.add_argument('inputs', nargs='+', help="Data files, glob patterns or directories")
+    parser.add_argument('-o', '--output', default='-', help="Results table (CSV); '-' for stdout (default: %(default)s)")
+    parser.add_argument('-t', '--titration', default='WeakAcid',
+                        choices=('StrongAcid', 'StrongBase', 'WeakAcid', 'WeakBase'), help="Titration type of the first endpoint (default: %(default)s)")
+    parser.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Initial volume to be titrated in mL (default: %(default)s)")
+    parser.add_argument('-m', '--max-endpoints', type=int, default=4, help="Largest number of endpoints per curve (default: %(default)s)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Main function of the multi-endpoint command-line interface."""
+    from batch import expand_inputs, write_results
+    args = parse_args(argv)
+    files = expand_inputs(args.inputs)
+    if not files:
+        print("Error: no data files matched the given inputs.", file=sys.stderr)
+        return 1
+    if args.max_endpoints < 1:
+        print("Error: --max-endpoints must be at least 1.", file=sys.stderr)
+        return 1
+    rows = (row for file_path in files for row in evaluate_file(file_path, args.titration, args.initial_volume, args.max_endpoints))
+    write_results(rows, args.output, RESULT_FIELDS)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
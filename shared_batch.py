@@ -0,0 +1,208 @@
+# shared_batch.py: Shared-memory batch evaluation for PyGranTitEQP
+# Places all curves and the result arrays in shared memory so that worker processes read their curves and write their results in place
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import instrument
+from endpoint import find_endpoint
+from gran_engine import G, GRAN_FUNCTIONS, compute_gran, gran_index
+from method import TITRATION_TYPES, apply_window, make_method
+from titration_set import TitrationSet
+
+# Points per task; bounds the temporaries of each worker, so peak memory does not grow with the number of files
+CHUNK_POINTS = 1 << 18
+# Columns of the endpoint table returned by evaluate_set; all NaN where a titration type has no linear region
+ENDPOINT_FIELDS = ('volume_eq', 'ci_low', 'ci_high', 'stderr', 'r2', 'branches')
+
+_attached = {}  # name -> (SharedMemory or None, array) of the blocks this worker process has opened
+
+
+def _create(shape, dtype):
+    """New shared memory block with an array view of it; returns (block, array, spec to attach with)."""
+    dtype = np.dtype(dtype)
+    block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return block, np.ndarray(shape, dtype, buffer=block.buf), (block.name, shape, dtype.str)
+
+
+def _attach(spec):
+    """Array view of a shared block (name, shape, dtype), or of a .npy file for a path; opened once per process."""
+    name, shape, dtype = spec
+    if name not in _attached:
+        if name.endswith('.npy'):
+            _attached[name] = None, np.load(name, mmap_mode='r+')
+        else:
+            block = shared_memory.SharedMemory(name=name)
+            _attached[name] = block, np.ndarray(shape, dtype, buffer=block.buf)
+    return _attached[name][1]
+
+
+def _chunks(offsets, chunk_points, workers=1):
+    """Contiguous curve ranges (first, last) of about chunk_points points each (at least one curve).
+
+    Chunks are made smaller if needed so that there are at least `workers` of them (given
+    enough curves); otherwise a batch of many short curves would fit in one chunk and run serially.
+    """
+    chunk_points = max(1, min(chunk_points, -(-int(offsets[-1]) // max(workers, 1))))
+    chunks = []
+    first, n = 0, offsets.size - 1
+    while first < n:
+        last = int(np.searchsorted(offsets, offsets[first] + chunk_points, side='right')) - 1
+        last = min(max(last, first + 1), n)
+        chunks.append((first, last))
+        first = last
+    return chunks
+
+
+def _evaluate_chunk(buffers, first, last, titrations, dtype):
+    """Gran functions and endpoints of curves first:last, written into the result buffers in place.
+
+    A curve whose evaluation raises ValueError keeps its NaN row; returns {(titration index,
+    curve index): message} of those curves (usually empty).
+    """
+    offsets = buffers['offsets']
+    start, stop = offsets[first], offsets[last]
+    local = offsets[first:last + 1] - start
+    volume = buffers['volume'][start:stop]
+    gran = buffers.get('gran')
+    with instrument.stage('compute', curves=f'{first}:{last}'):
+        V = np.repeat(buffers['V'][first:last], np.diff(local))
+        result = compute_gran(volume, buffers['response'][start:stop], V, normalize=True, dtype=dtype, offsets=local,
+                              out=None if gran is None else gran[..., start:stop])
+    endpoints = buffers['endpoints']
+    errors = {}
+    with instrument.stage('fit', curves=f'{first}:{last}'):
+        for t, titration in enumerate(titrations):
+            g1 = result[gran_index(titration + '_G1'), G]
+            g2 = result[gran_index(titration + '_G2'), G]
+            for i, (a, b) in enumerate(zip(local[:-1], local[1:]), first):
+                try:
+                    endpoint = find_endpoint(volume[a:b], g1[a:b], g2[a:b])
+                except ValueError as e:
+                    errors[t, i] = str(e)
+                    continue
+                if endpoint is not None:
+                    endpoints[t, i] = (endpoint.volume, endpoint.ci_low, endpoint.ci_high, endpoint.stderr,
+                                       endpoint.r2, len(endpoint.fits))
+    return errors
+
+
+def _chunk_job(specs, first, last, titrations, dtype):
+    """Process-pool entry point: attach the shared buffers and evaluate one chunk; returns only the (rare) error messages."""
+    return _evaluate_chunk({key: _attach(spec) for key, spec in specs.items()}, first, last, titrations, dtype)
+
+
+def evaluate_set(curves, titrations=TITRATION_TYPES, workers=None, dtype=np.float64, gran_file=None, chunk_points=CHUNK_POINTS,
+                 profile=None, profile_memory=False, errors=None):
+    """Gran endpoints of every curve of a TitrationSet, computed by worker processes through shared memory.
+
+    The buffers of the set are copied once into shared memory blocks; each worker attaches
+    to them, evaluates chunks of about chunk_points points and writes the endpoints (and, with
+    gran_file, the normalized (8, 3, n_points) compute_gran result into that memory-mapped
+    .npy file) in place, so no array is pickled and the memory used does not grow with the
+    number of workers. Every curve needs at least 3 points and increasing volumes (see
+    TitrationSet.validate). Returns (endpoints, gran): endpoints has shape (len(titrations),
+    len(curves), len(ENDPOINT_FIELDS)); gran is the memory-mapped array or None. The endpoint
+    row of a curve whose evaluation raised ValueError stays NaN; pass a dict as errors to
+    receive {(titration index, curve index): message} of those curves.
+    """
+    errors = {} if errors is None else errors
+    titrations = tuple(titrations)
+    workers = workers or os.cpu_count() or 1
+    gran = None
+    if gran_file is not None:
+        gran = np.lib.format.open_memmap(gran_file, mode='w+', dtype=dtype, shape=(len(GRAN_FUNCTIONS), 3, curves.volume.size))
+    chunks = _chunks(curves.offsets, chunk_points, workers)
+    if workers == 1 or len(chunks) == 1:
+        endpoints = np.full((len(titrations), len(curves), len(ENDPOINT_FIELDS)), np.nan)
+        buffers = dict(volume=curves.volume, response=curves.response, offsets=curves.offsets,
+                       V=np.array([curve.V for curve in curves.curves], dtype=float), endpoints=endpoints)
+        if gran is not None:
+            buffers['gran'] = gran
+        with instrument.profiling(profile, profile_memory) if profile else nullcontext():
+            for first, last in chunks:
+                errors.update(_evaluate_chunk(buffers, first, last, titrations, dtype))
+        return endpoints, gran
+
+    blocks, specs = [], {}
+    try:
+        for key, array in (('volume', curves.volume), ('response', curves.response), ('offsets', curves.offsets),
+                           ('V', np.array([curve.V for curve in curves.curves], dtype=float))):
+            block, shared, specs[key] = _create(array.shape, array.dtype)
+            blocks.append(block)
+            shared[...] = array
+        block, endpoints, specs['endpoints'] = _create((len(titrations), len(curves), len(ENDPOINT_FIELDS)), np.float64)
+        blocks.append(block)
+        endpoints[...] = np.nan
+        if gran is not None:
+            gran.flush()
+            specs['gran'] = (os.path.abspath(gran_file), gran.shape, gran.dtype.str)
+        initializer = instrument.enable if profile else None
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=initializer,
+                                 initargs=(profile, profile_memory) if profile else ()) as pool:
+            for future in [pool.submit(_chunk_job, specs, first, last, titrations, dtype) for first, last in chunks]:
+                errors.update(future.result())
+        endpoints = endpoints.copy()  # small: one row per curve and titration type
+        del shared
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return endpoints, gran
+
+
+def _load(file_path, window):
+    """Volume and pH of one file, checked and cut to the window as method.analyse does."""
+    from loader import load_titration
+    with instrument.stage('load', file=file_path):
+        volume, pH = load_titration(file_path)
+    if np.any(np.diff(volume) < 0):
+        raise ValueError("volumes are not monotonically increasing")
+    if not (np.all(np.isfinite(volume)) and np.all(np.isfinite(pH))):
+        raise ValueError("volume or pH contains non-finite values")
+    return apply_window(volume, pH, window)
+
+
+def run_shared_batch(files, V=25.0, titrations=TITRATION_TYPES, workers=None, dtype=np.float64, window=None,
+                     profile=None, profile_memory=False):
+    """Evaluate all files like batch.run_batch, but with the curves and results in shared memory.
+
+    The files are read by this process into one TitrationSet, then evaluated by evaluate_set.
+    Yields the same result rows as batch.evaluate_file, in input order.
+    """
+    window = make_method(analyte_volume=V, window=window)['window']
+    curves, errors, failed = [], {}, {}
+    with instrument.profiling(profile, profile_memory) if profile else nullcontext():
+        for file_path in files:
+            try:
+                curves.append(_load(file_path, window))
+            except Exception as e:
+                errors[file_path] = e
+    endpoints = None
+    if curves:
+        curve_set = TitrationSet.from_arrays(curves, V)
+        sizes = curve_set.sizes
+        del curves
+        endpoints, _ = evaluate_set(curve_set, titrations, workers, dtype, profile=profile, profile_memory=profile_memory,
+                                    errors=failed)
+        del curve_set
+    i = 0
+    for file_path in files:
+        if file_path in errors:
+            for titration in titrations:
+                yield dict(file=file_path, titration=titration, points='', status=f'error: {errors[file_path]}')
+            continue
+        for t, titration in enumerate(titrations):
+            row = dict(file=file_path, titration=titration, points=int(sizes[i]))
+            if (t, i) in failed:
+                row['status'] = f'error: {failed[t, i]}'
+            elif np.isnan(endpoints[t, i, 0]):
+                row['status'] = 'no linear region'
+            else:
+                row.update(zip(ENDPOINT_FIELDS, endpoints[t, i].tolist()), branches=int(endpoints[t, i, -1]), status='ok')
+            yield row
+        i += 1
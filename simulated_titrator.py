@@ -0,0 +1,175 @@
+# simulated_titrator.py: Simulated autotitrators for PyGranTitEQP
+# Replays simulation.py curves and data files to the ingestion server at configurable rates, for testing and load tests
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+
+import numpy as np
+
+# Titration type of each simulation.py curve
+SIMULATED_CURVES = {'strong_acid': 'StrongAcid', 'strong_base': 'StrongBase', 'weak_acid': 'WeakAcid', 'weak_base': 'WeakBase'}
+
+# replies: the server's answer lines; seconds: connection to last reply; lag: largest delay behind the send schedule
+RunResult = namedtuple('RunResult', ['instrument', 'points', 'replies', 'seconds', 'lag'])
+
+
+def _simulation():
+    """The simulation module of data/simulated_data (not a package, so it is imported from its directory)."""
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'simulated_data')
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    import simulation
+    return simulation
+
+
+def load_source(source, step=0.1, v_max=50.0, sigma_pH=0.0, seed=None):
+    """(volume, pH, titration) of a simulation.py curve name (see SIMULATED_CURVES) or a data file.
+
+    Simulated curves are sampled every step mL up to v_max with optional normal pH noise; the
+    titration type of a data file is None (the server's default applies).
+    """
+    if source in SIMULATED_CURVES:
+        volume = np.arange(0.0, v_max + step / 2, step)
+        pH = getattr(_simulation(), source + '_curve')(volume)
+        if sigma_pH:
+            pH = pH + np.random.default_rng(seed).normal(0.0, sigma_pH, size=pH.size)
+        return volume, pH, SIMULATED_CURVES[source]
+    from loader import load_titration
+    volume, pH = load_titration(source)
+    return volume, pH, None
+
+
+async def run_instrument(volume, pH, instrument='sim', titration=None, V=25.0, rate=10.0, host='127.0.0.1', port=5555,
+                         unix_path=None, stop_at_endpoint=False):
+    """Send one curve to the ingestion server at `rate` points per second (0: as fast as possible); returns a RunResult.
+
+    The readings are sent on a fixed schedule, so a server that applies backpressure shows up
+    as lag. With stop_at_endpoint=True dosing stops at the server's first ENDPOINT reply, as
+    a real titrator would.
+    """
+    if unix_path:
+        reader, writer = await asyncio.open_unix_connection(unix_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    replies = []
+    endpoint_seen = asyncio.Event()
+
+    async def receive():
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            reply = line.decode('ascii', errors='replace').strip()
+            replies.append(reply)
+            if reply.startswith('ENDPOINT'):
+                endpoint_seen.set()
+            if reply.startswith('RESULT'):
+                return
+
+    receiver = asyncio.create_task(receive())
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    lag = 0.0
+    sent = 0
+    header = f"# id={instrument} V={V}" + (f" titration={titration}" if titration else '')
+    writer.write(header.encode('ascii') + b'\n')
+    for v, p in zip(volume.tolist(), pH.tolist()):
+        if rate > 0:
+            due = start + sent / rate
+            delay = due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                lag = max(lag, -delay)
+        if stop_at_endpoint and endpoint_seen.is_set():
+            break
+        writer.write(f"{v:.6f} {p:.6f}\n".encode('ascii'))
+        await writer.drain()  # blocks while the server is not reading: backpressure
+        sent += 1
+    writer.write(b"END\n")
+    await writer.drain()
+    await receiver
+    writer.close()
+    await writer.wait_closed()
+    return RunResult(instrument, sent, replies, loop.time() - start, lag)
+
+
+async def load_test(sources, instruments=10, rate=10.0, host='127.0.0.1', port=5555, unix_path=None, V=25.0,
+                    sigma_pH=0.0, step=0.1, stop_at_endpoint=False):
+    """Run `instruments` simulated titrators at once (cycling through sources); returns their RunResults."""
+    curves = [load_source(source, step, sigma_pH=sigma_pH, seed=i) for i, source in enumerate(sources)]
+    runs = []
+    for i in range(instruments):
+        volume, pH, titration = curves[i % len(curves)]
+        runs.append(run_instrument(volume, pH, f'sim{i:04d}', titration, V, rate, host, port, unix_path, stop_at_endpoint))
+    return await asyncio.gather(*runs)
+
+
+def summarize(results, seconds):
+    """Throughput and lag of a load test as text."""
+    points = sum(result.points for result in results)
+    lags = [result.lag for result in results]
+    answered = sum(any(reply.startswith('RESULT') for reply in result.replies) for result in results)
+    return (f"{len(results)} instruments, {points} points in {seconds:.2f} s ({points / seconds:.0f} points/s), "
+            f"{answered} results; send lag median {statistics.median(lags) * 1000:.1f} ms, max {max(lags) * 1000:.1f} ms")
+
+
+async def _run(args):
+    server = listener = None
+    if args.serve:
+        from ingest import IngestServer
+        server = IngestServer(V=args.initial_volume)
+        listener = await server.start(args.host, 0, args.unix)  # any free port
+        if args.unix is None:
+            args.port = listener.sockets[0].getsockname()[1]
+    try:
+        start = time.perf_counter()
+        results = await load_test(args.sources, args.instruments, args.rate, args.host, args.port, args.unix, args.initial_volume,
+                                  args.noise, args.step, args.stop_at_endpoint)
+        seconds = time.perf_counter() - start
+    finally:
+        if listener is not None:
+            listener.close()
+            await listener.wait_closed()
+            server.close()
+    if args.verbose:
+        for result in results:
+            print(f"{result.instrument}: {result.points} points, {' | '.join(result.replies)}")
+    print(summarize(results, seconds))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay titration curves to the ingestion server as simulated instruments.")
+    parser.add_argument('sources', nargs='*', default=list(SIMULATED_CURVES),
+                        help="simulation.py curves (strong_acid, weak_base, ...) or data files (default: all simulated curves)")
+    parser.add_argument('-n', '--instruments', type=int, default=10, help="Number of concurrent instruments (default: %(default)s)")
+    parser.add_argument('-r', '--rate', type=float, default=10.0, help="Points per second per instrument; 0 for unthrottled (default: %(default)s)")
+    parser.add_argument('--host', default='127.0.0.1', help="Server address (default: %(default)s)")
+    parser.add_argument('-p', '--port', type=int, default=5555, help="Server TCP port (default: %(default)s)")
+    parser.add_argument('--unix', metavar='PATH', help="Connect to a Unix socket instead of TCP")
+    parser.add_argument('--serve', action='store_true', help="Start an ingestion server in this process (self-contained load test)")
+    parser.add_argument('-V', '--initial-volume', type=float, default=25.0, help="Initial volume in mL (default: %(default)s)")
+    parser.add_argument('--step', type=float, default=0.1, help="Volume step of simulated curves in mL (default: %(default)s)")
+    parser.add_argument('--noise', type=float, default=0.0, help="Standard deviation of pH noise of simulated curves (default: %(default)s)")
+    parser.add_argument('--stop-at-endpoint', action='store_true', help="Stop dosing at the first ENDPOINT reply")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Print the replies of every instrument")
+    args = parser.parse_args(argv)
+    if args.instruments < 1 or args.rate < 0:
+        print("Error: --instruments must be at least 1 and --rate at least 0.", file=sys.stderr)
+        return 1
+    try:
+        asyncio.run(_run(args))
+    except (OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,221 @@
+# streaming.py: Incremental Gran evaluation for live autotitrator feeds
+# Takes (volume, pH) points one at a time, updates G1/G2 and running regression sums in O(1), and reports a provisional endpoint
+
+from collections import deque
+from functools import lru_cache
+from statistics import NormalDist
+
+import numpy as np
+
+from endpoint import LinearFit, combine_fits, t_quantile
+from gran_engine import GRAN_FUNCTIONS, gran_index
+
+SLOPE_SIGNS = (-1, 1)  # G1 falls towards the endpoint, G2 rises after it
+
+
+@lru_cache(maxsize=1024)
+def _band_quantile(p, dof):
+    """Student-t quantile of the prediction band, cached as it is needed for every point."""
+    return float(t_quantile(p, dof))
+
+
+class RunningFit:
+    """Least-squares line through a growing set of points, updated in O(1) per point (Welford's method).
+
+    Centred moments are used instead of raw sums, so Gran values of 10^12 and more do not
+    lose precision to cancellation.
+    """
+
+    __slots__ = ('start', 'n', 'first_x', 'last_x', 'mean_x', 'mean_y', 'cxx', 'cxy', 'cyy')
+
+    def __init__(self, start=0):
+        self.start = start
+        self.n = 0
+        self.first_x = self.last_x = None
+        self.mean_x = self.mean_y = 0.0
+        self.cxx = self.cxy = self.cyy = 0.0
+
+    def added(self, x, y):
+        """Return a new RunningFit that also contains (x, y); self is left unchanged."""
+        new = RunningFit(self.start)
+        new.n = self.n + 1
+        new.first_x = x if self.first_x is None else self.first_x
+        new.last_x = x
+        dx = x - self.mean_x
+        dy = y - self.mean_y
+        new.mean_x = self.mean_x + dx / new.n
+        new.mean_y = self.mean_y + dy / new.n
+        new.cxx = self.cxx + dx * (x - new.mean_x)
+        new.cxy = self.cxy + dx * (y - new.mean_y)
+        new.cyy = self.cyy + dy * (y - new.mean_y)
+        return new
+
+    @property
+    def slope(self):
+        return self.cxy / self.cxx if self.cxx > 0 else np.nan
+
+    @property
+    def r2(self):
+        if self.cxx <= 0 or self.cyy <= 0:
+            return 0.0
+        return self.cxy * self.cxy / (self.cxx * self.cyy)
+
+    def to_fit(self):
+        """LinearFit of the points so far (start/stop are point indices, stop exclusive)."""
+        slope = self.slope
+        intercept = self.mean_y - slope * self.mean_x
+        rss = max(self.cyy - slope * self.cxy, 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x0 = -intercept / slope
+            s = np.sqrt(rss / max(self.n - 2, 1))
+            stderr = s / abs(slope) * np.sqrt(1.0 / self.n + self.mean_y**2 / (slope**2 * self.cxx))
+        return LinearFit(self.start, self.start + self.n, float(slope), float(intercept), float(self.r2), float(x0), float(stderr))
+
+
+class StreamingGran:
+    """Incremental Gran accumulator for one titration.
+
+    Both Gran branches are grown point by point. A point that falls outside the prediction
+    band of the current line (the Student-t equivalent of reject_z standard errors) restarts a
+    branch that is not yet established from the last min_points points, kept in a fixed-size
+    buffer; an established branch skips one such point and closes on the second in a row.
+    Every add() is therefore O(1). A branch is established once it has min_points points,
+    R² >= r2_min and the expected slope sign (G1 falling, G2 rising); after that only the
+    prediction band and the slope sign decide whether it takes a point. The G2 branch is only
+    grown from the points after the closed G1 branch, i.e. after the endpoint has been passed,
+    and endpoint() reports a provisional result as soon as G2 is established with a plausible
+    intercept.
+    """
+
+    def __init__(self, titration='StrongAcid', V=25.0, min_points=5, r2_min=0.999, reject_z=4.0, confidence=0.95):
+        self.titration = titration
+        self.V = V
+        self.min_points = min_points
+        self.r2_min = r2_min
+        self.reject_z = reject_z
+        self._reject_p = NormalDist().cdf(reject_z)
+        self.confidence = confidence
+        # (uses V, sign of pH) of the G1 and G2 functions of this titration type
+        self._terms = [GRAN_FUNCTIONS[gran_index(f'{titration}_{g}')][2:] for g in ('G1', 'G2')]
+        self.count = 0
+        self.first_volume = self.last = None
+        self.branches = [RunningFit(0), None]  # G1, G2
+        self.open = [True, True]
+        self._misses = [0, 0]
+        self._locked = [False, False]  # established once; R² is not checked again
+        self._recent = deque(maxlen=min_points)
+
+    def gran_values(self, volume, pH):
+        """G1 and G2 of a single point."""
+        return tuple((volume + (self.V if uses_V else 0.0)) * 10.0 ** (sign * pH) for uses_V, sign in self._terms)
+
+    def _on_line(self, fit, x, y):
+        """True if (x, y) lies inside the prediction band of fit (always true below 3 points).
+
+        The band is the Student-t equivalent of reject_z standard errors, so it is wide while
+        the scatter is estimated from few points. Gran functions are positive, so a point where
+        the line has already crossed zero (past the endpoint of a G1 branch) is never on it.
+        """
+        if fit.n < 3 or fit.cxx <= 0:
+            return True
+        slope = fit.slope
+        predicted = fit.mean_y + slope * (x - fit.mean_x)
+        s = np.sqrt(max(fit.cyy - slope * fit.cxy, 0.0) / (fit.n - 2))
+        s = max(s, 1e-9 * abs(fit.mean_y))  # floor for noise-free data
+        band = _band_quantile(self._reject_p, fit.n - 2) * s * np.sqrt(1.0 + 1.0 / fit.n + (x - fit.mean_x)**2 / fit.cxx)
+        return predicted > 0 and abs(y - predicted) <= band
+
+    def _established(self, fit, slope_sign):
+        return (fit is not None and fit.n >= self.min_points and fit.r2 >= self.r2_min
+                and np.sign(fit.slope) == slope_sign)
+
+    def _restart(self, column, after=0):
+        """New branch from the buffered recent points from index `after` on (column 2: G1, 3: G2)."""
+        recent = [point for point in self._recent if point[0] >= after]
+        fit = RunningFit(recent[0][0])
+        for point in recent:
+            fit = fit.added(point[1], point[column])
+        return fit
+
+    def _grow(self, branch, x, y):
+        """Offer a point to branch 0 (G1) or 1 (G2); returns False once an established branch has closed."""
+        fit = self.branches[branch]
+        slope_sign = SLOPE_SIGNS[branch]
+        # G2 only takes points after the last point of the closed G1 branch
+        after = 0 if branch == 0 else self.branches[0].start + self.branches[0].n
+        on_line = fit is not None and self._on_line(fit, x, y)
+        if self._locked[branch] or self._established(fit, slope_sign):
+            self._locked[branch] = True
+            trial = fit.added(x, y)
+            if on_line and np.sign(trial.slope) == slope_sign:
+                self.branches[branch] = trial
+                self._misses[branch] = 0
+                return True
+            # A single outlier is skipped; the second rejected point in a row closes the branch
+            self._misses[branch] += 1
+            return self._misses[branch] < 2
+        fit = fit.added(x, y) if on_line else self._restart(2 + branch, after)
+        if fit.n > self.min_points and (fit.r2 < self.r2_min or np.sign(fit.slope) != slope_sign):
+            fit = self._restart(2 + branch, after)
+        self.branches[branch] = fit
+        return True
+
+    def add(self, volume, pH):
+        """Add one (volume, pH) reading; returns the current provisional Endpoint or None."""
+        if self.last is not None and volume < self.last[0]:
+            raise ValueError(f"Volume decreased from {self.last[0]} to {volume} mL")
+        if self.last is None:
+            self.first_volume = volume
+        index = self.count
+        self.count += 1
+        self.last = (volume, pH)
+        g1, g2 = self.gran_values(volume, pH)
+        self._recent.append((index, volume, g1, g2))
+
+        if self.open[0]:
+            self.open[0] = self._grow(0, volume, g1)
+        # The G2 branch is only searched after the endpoint, i.e. once the G1 branch has closed
+        if not self.open[0] and self.open[1]:
+            self.open[1] = self._grow(1, volume, g2)
+        return self.endpoint()
+
+    def extend(self, points):
+        """Add many (volume, pH) readings; returns the provisional Endpoint after the last one."""
+        endpoint = None
+        for volume, pH in points:
+            endpoint = self.add(volume, pH)
+        return endpoint
+
+    def _plausible(self, fit, tolerance=3.0):
+        """True if the x-intercept of fit lies between the end of the G1 and the start of the G2 branch.
+
+        The last G1 or first G2 reading may fall on the endpoint itself, so both bounds are
+        relaxed by one G1 volume step plus tolerance standard errors of the intercept.
+        """
+        g1, g2 = self.branches
+        slack = (g1.last_x - g1.first_x) / (g1.n - 1)
+        if np.isfinite(fit.stderr):
+            slack += tolerance * fit.stderr
+        return max(self.first_volume, g1.last_x - slack) <= fit.x_intercept <= g2.first_x + slack
+
+    @property
+    def post_branch_established(self):
+        """True once the linear branch after the endpoint has been found.
+
+        Its x-intercept must also be plausible: between the end of the G1 branch and the start of the G2 branch.
+        """
+        if self.open[0] or not self._locked[1]:
+            return False
+        return self._plausible(self.branches[1].to_fit())
+
+    def endpoint(self):
+        """Provisional Endpoint from the G1 and established G2 branches, or None before the G2 branch is established.
+
+        The G1 fit (established, as it has closed) is left out if its intercept is not plausible.
+        """
+        if self.open[0] or not self._locked[1]:
+            return None
+        fit1, fit2 = self.branches[0].to_fit(), self.branches[1].to_fit()
+        if not self._plausible(fit2):
+            return None
+        return combine_fits([fit1, fit2] if self._plausible(fit1) else [fit2], self.confidence)
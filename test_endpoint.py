@@ -0,0 +1,30 @@
+# test_endpoint.py: Tests of the linear-region search and endpoint location in endpoint.py
+# Checks dense noise-free curves and noisy curves whose Gran branches never reach R² = 0.999
+
+import numpy as np
+import pytest
+
+from ingest import final_endpoint
+from simulated_titrator import load_source
+
+
+@pytest.mark.parametrize('n', [50_000, 100_000])
+@pytest.mark.parametrize('source', ['strong_acid', 'weak_base'])
+def test_dense_noise_free_curve(source, n):
+    """Both branches of a dense curve end a few points past the endpoint; the step slack must allow that."""
+    volume, pH, titration = load_source(source, 50.0 / (n - 1), 50.0)
+    endpoint = final_endpoint(volume, pH, titration, 25.0)
+    assert endpoint is not None and len(endpoint.fits) == 2
+    assert endpoint.volume == pytest.approx(25.0, abs=1e-3)
+    assert all(type(value) is float for value in (endpoint.volume, endpoint.ci_low, endpoint.ci_high, endpoint.stderr))
+
+
+@pytest.mark.parametrize('n', [200, 1000])
+def test_noisy_curve(n):
+    """With 0.01 pH noise R² stays below 0.999, but the branches are linear within their noise."""
+    for seed in range(5):
+        volume, pH, titration = load_source('strong_acid', 50.0 / (n - 1), 50.0, 0.01, seed)
+        endpoint = final_endpoint(volume, pH, titration, 25.0)
+        assert endpoint is not None
+        assert endpoint.volume == pytest.approx(25.0, abs=0.05)
+        assert endpoint.ci_low < endpoint.volume < endpoint.ci_high
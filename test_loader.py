@@ -0,0 +1,24 @@
+# test_loader.py: Tests of the titration file reader in loader.py
+# Checks delimiter, header and decimal-comma detection on small files of every supported layout
+
+import numpy as np
+import pytest
+
+from loader import load_columns, sniff_format
+
+
+@pytest.mark.parametrize('text, delimiter, decimal_comma', [
+    ("volume,pH\n0.0,3.0\n0.5,3.1\n", ',', False),
+    ("volume, pH\n0.0, 3.0\n0.5, 3.1\n", ',', False),
+    ("volume;pH\n0,0;3,0\n0,5;3,1\n", ';', True),
+    ("volume\tpH\n0.0\t3.0\n0.5\t3.1\n", None, False),
+    ("volume pH\n0,0 3,0\n0,5 3,1\n", None, True),
+])
+def test_delimiters(tmp_path, text, delimiter, decimal_comma):
+    detected, skip_lines, detected_decimal_comma, _ = sniff_format(text.splitlines())
+    assert (detected, skip_lines, detected_decimal_comma) == (delimiter, 1, decimal_comma)
+    path = tmp_path / 'curve.csv'
+    path.write_text(text)
+    data, column_names = load_columns(path)
+    assert column_names == ['volume', 'pH']
+    np.testing.assert_allclose(data, [[0.0, 3.0], [0.5, 3.1]])
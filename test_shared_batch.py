@@ -0,0 +1,27 @@
+# test_shared_batch.py: Tests of the shared-memory batch evaluation in shared_batch.py
+# Checks that batches of many short curves are split over the workers
+
+import numpy as np
+
+from shared_batch import _chunks, evaluate_set
+from simulated_titrator import load_source
+from titration_set import TitrationSet
+
+
+def test_small_curves_are_split_over_workers():
+    """2,000 curves of 62 points fit in one CHUNK_POINTS chunk, but four workers still get a chunk each."""
+    offsets = np.arange(0, 62 * 2000 + 1, 62)
+    chunks = _chunks(offsets, 1 << 18, workers=4)
+    assert len(chunks) >= 4
+    assert chunks[0][0] == 0 and chunks[-1][1] == 2000
+    assert all(a[1] == b[0] for a, b in zip(chunks[:-1], chunks[1:]))
+    assert len(_chunks(offsets, 1 << 18, workers=1)) == 1
+
+
+def test_evaluate_set_with_workers_matches_serial():
+    volume, pH, _ = load_source('strong_acid', step=0.5)
+    curves = TitrationSet.from_arrays([(volume, pH)] * 40)
+    serial, _ = evaluate_set(curves, ('StrongAcid',), workers=1)
+    parallel, _ = evaluate_set(curves, ('StrongAcid',), workers=2)
+    np.testing.assert_allclose(parallel, serial)
+    np.testing.assert_allclose(serial[0, :, 0], 25.0, atol=0.01)
@@ -0,0 +1,25 @@
+# test_streaming.py: Tests of the incremental Gran evaluation in streaming.py
+# Compares the provisional endpoint of noisy simulated curves with the full linear-region search
+
+import pytest
+
+from ingest import final_endpoint
+from simulated_titrator import load_source
+from streaming import StreamingGran
+
+
+@pytest.mark.parametrize('source', ['strong_acid', 'weak_acid', 'strong_base'])
+def test_provisional_endpoint_matches_find_endpoint(source):
+    """Noisy curves (0.25 mL steps, pH noise 0.002, endpoint at 25 mL): the first provisional endpoint agrees with find_endpoint."""
+    for seed in range(40):
+        volume, pH, titration = load_source(source, step=0.25, sigma_pH=0.002, seed=seed)
+        stream = StreamingGran(titration, V=25.0)
+        provisional = None
+        for v, p in zip(volume, pH):
+            provisional = stream.add(v, p)
+            if provisional is not None:
+                break
+        final = final_endpoint(volume, pH, titration, 25.0)
+        assert provisional is not None, f"seed {seed}: no provisional endpoint"
+        assert provisional.volume == pytest.approx(final.volume, abs=0.05), f"seed {seed}"
+        assert provisional.volume == pytest.approx(25.0, abs=0.05), f"seed {seed}"
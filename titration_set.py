@@ -0,0 +1,169 @@
+# titration_set.py: Ragged container of many titration curves for PyGranTitEQP
+# Holds all curves in two flat float64 buffers with an offsets index, so validation, Gran functions and derivatives run over the whole set at once
+
+from collections import namedtuple
+
+import numpy as np
+
+from gran_engine import compute_gran, gran_functions, gran_index, gran_log_scale
+
+# Per-curve results of TitrationSet.validate (arrays with one value per curve)
+Validation = namedtuple('Validation', ['points', 'monotonic', 'out_of_range', 'valid'])
+
+
+class Curve:
+    """Metadata of one curve of a TitrationSet: where it came from and the initial volume V in mL."""
+
+    __slots__ = ('source', 'block', 'title', 'V')
+
+    def __init__(self, source=None, block=None, title='', V=25.0):
+        self.source = source
+        self.block = block
+        self.title = title
+        self.V = V
+
+    def __repr__(self):
+        return f"Curve(source={self.source!r}, block={self.block!r}, title={self.title!r}, V={self.V!r})"
+
+
+class TitrationSet:
+    """Many titration curves of different lengths in one flat volume and one flat response buffer.
+
+    Curve i spans offsets[i]:offsets[i + 1] of both buffers and curves[i] holds its metadata.
+    Compared with one DataFrame per curve this costs two floats per point plus one small
+    record per curve, and every operation below is a handful of NumPy calls over all points.
+    """
+
+    __slots__ = ('volume', 'response', 'offsets', 'curves')
+
+    def __init__(self, volume, response, offsets, curves=None):
+        self.volume = np.ascontiguousarray(volume, dtype=float)
+        self.response = np.ascontiguousarray(response, dtype=float)
+        self.offsets = np.asarray(offsets, dtype=np.intp)
+        if self.volume.ndim != 1 or self.volume.shape != self.response.shape:
+            raise ValueError("volume and response must be 1-D arrays of the same length.")
+        if (self.offsets.ndim != 1 or self.offsets.size < 1 or self.offsets[0] != 0
+                or self.offsets[-1] != self.volume.size or np.any(np.diff(self.offsets) < 1)):
+            raise ValueError("offsets must rise from 0 to len(volume) with at least one point per curve.")
+        self.curves = [Curve() for _ in range(len(self))] if curves is None else list(curves)
+        if len(self.curves) != len(self):
+            raise ValueError(f"{len(self.curves)} curve records for {len(self)} curves.")
+
+    @classmethod
+    def from_arrays(cls, curves, V=25.0):
+        """Build a set from (volume, response) pairs, e.g. the columns of loaded DataFrames."""
+        curves = [(np.asarray(v, dtype=float).ravel(), np.asarray(r, dtype=float).ravel()) for v, r in curves]
+        if not curves:
+            raise ValueError("No curves given.")
+        offsets = np.cumsum([0] + [v.size for v, _ in curves])
+        return cls(np.concatenate([v for v, _ in curves]), np.concatenate([r for _, r in curves]),
+                   offsets, [Curve(V=V) for _ in curves])
+
+    @classmethod
+    def from_files(cls, file_paths, quantity=None, response_column=1, V=25.0):
+        """Read the curves of data files (every block of multi-block files) via loader.load_block_corpus.
+
+        quantity='E' keeps only the potential blocks of GranTED exports; None keeps all.
+        Unreadable files raise.
+        """
+        from loader import load_block_corpus
+        volume, response, offsets, sources = load_block_corpus(file_paths, quantity, response_column)
+        if not sources:
+            raise ValueError("No curves found in the given files.")
+        return cls(volume, response, offsets, [Curve(file_path, block, title, V) for file_path, block, title in sources])
+
+    def __len__(self):
+        return self.offsets.size - 1
+
+    def __getitem__(self, i):
+        """(volume, response) of curve i as views into the buffers."""
+        start, stop = self.offsets[i], self.offsets[i + 1]
+        return self.volume[start:stop], self.response[start:stop]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __repr__(self):
+        return f"<TitrationSet of {len(self)} curves, {self.volume.size} points>"
+
+    @property
+    def sizes(self):
+        """Number of points of every curve."""
+        return np.diff(self.offsets)
+
+    def curve_ids(self):
+        """Index of the curve of every point."""
+        return np.repeat(np.arange(len(self)), self.sizes)
+
+    def initial_volumes(self):
+        """V of every point (the initial volume of its curve), for the Gran functions."""
+        return np.array([curve.V for curve in self.curves], dtype=float)[self.curve_ids()]
+
+    def subset(self, selection):
+        """New set holding the selected curves (indices or a boolean mask over the curves); copies their points."""
+        selection = np.arange(len(self))[selection]
+        if selection.size == 0:
+            raise ValueError("No curves selected.")
+        sizes = self.sizes[selection]
+        offsets = np.cumsum(np.r_[0, sizes])
+        # Index of every kept point: its curve's start plus its position within the curve
+        points = np.repeat(self.offsets[selection] - offsets[:-1], sizes) + np.arange(offsets[-1])
+        return TitrationSet(self.volume[points], self.response[points], offsets, [self.curves[i] for i in selection])
+
+    def validate(self, response_range=(0.0, 14.0), min_points=3):
+        """Check every curve at once; returns a Validation of per-curve arrays.
+
+        monotonic: the volumes never decrease; out_of_range: number of responses outside
+        response_range (None skips the check, e.g. for potentials) or not finite; valid: both
+        checks pass and the curve has at least min_points points.
+        """
+        sizes = self.sizes
+        ids = self.curve_ids()
+        # Steps within a curve; the steps from the last point of a curve to the first of the next do not count
+        decreasing = np.diff(self.volume) < 0
+        decreasing[self.offsets[1:-1] - 1] = False
+        monotonic = np.bincount(ids[1:][decreasing], minlength=len(self)) == 0
+        monotonic &= np.bincount(ids, weights=~np.isfinite(self.volume), minlength=len(self)) == 0
+        bad = ~np.isfinite(self.response)
+        if response_range is not None:
+            low, high = response_range
+            with np.errstate(invalid='ignore'):
+                bad |= (self.response < low) | (self.response > high)
+        out_of_range = np.bincount(ids, weights=bad, minlength=len(self)).astype(int)
+        return Validation(sizes, monotonic, out_of_range, monotonic & (out_of_range == 0) & (sizes >= min_points))
+
+    def gran(self, normalize=True, dtype=np.float64):
+        """All eight Gran functions of all curves, shape (8, n_points); normalized per curve (see gran_functions)."""
+        return gran_functions(self.volume, self.response, self.initial_volumes(), normalize, dtype, self.offsets)
+
+    def gran_log_scale(self):
+        """log10 of the per-curve normalization factors of gran(), shape (8, n_curves)."""
+        return gran_log_scale(self.response, self.offsets)
+
+    def compute_gran(self, normalize=True, dtype=np.float64, smoothing=None):
+        """Gran functions and their first and second volume derivatives of all curves, shape (8, 3, n_points).
+
+        Derivatives never reach across curve boundaries; every curve needs at least 3 points
+        (or `window` points with smoothing=(window, order)).
+        """
+        return compute_gran(self.volume, self.response, self.initial_volumes(), normalize, dtype, smoothing, self.offsets)
+
+    def endpoints(self, titration='StrongAcid', gran=None, confidence=0.95, **search):
+        """Gran endpoint of every curve (an Endpoint, or None without a linear region or if the curve is invalid).
+
+        The Gran functions of all curves are evaluated in one pass (or taken from gran, as
+        returned by gran()); only the linear-region search runs per curve.
+        """
+        from endpoint import find_endpoint
+        if gran is None:
+            gran = self.gran()
+        g1, g2 = gran[gran_index(titration + '_G1')], gran[gran_index(titration + '_G2')]
+        valid = self.validate(response_range=None).valid
+        results = []
+        for i, (start, stop) in enumerate(zip(self.offsets[:-1], self.offsets[1:])):
+            if not valid[i]:
+                results.append(None)
+                continue
+            results.append(find_endpoint(self.volume[start:stop], g1[start:stop], g2[start:stop], confidence, **search))
+        return results
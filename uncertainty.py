@@ -0,0 +1,200 @@
+# uncertainty.py: Bootstrap and Monte Carlo uncertainty of Gran equivalence volumes
+# Resamples the linear-region residuals or perturbs the pH, refitting all replicates as one batched NumPy operation
+
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from endpoint import find_endpoint
+from gran_engine import GRAN_FUNCTIONS, gran_functions, gran_index
+
+# Replicates are processed in blocks of at most this many (replicate × point) values to bound memory
+MAX_BLOCK_VALUES = 4_000_000
+
+# samples holds the equivalence volume of every replicate
+Uncertainty = namedtuple('Uncertainty', ['volume', 'stderr', 'ci_low', 'ci_high', 'samples'])
+
+
+def _intercepts(x, Y):
+    """x-intercepts of the least-squares lines through (x, Y[i]) for every row of Y (batched).
+
+    x is shared by all rows (shape (m,)) or given per row (shape of Y).
+    """
+    x_mean = x.mean(axis=-1, keepdims=True)
+    xc = x - x_mean
+    slope = np.sum(xc * Y, axis=-1) / np.sum(xc * xc, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return x_mean[..., 0] - Y.mean(axis=-1) / slope
+
+
+def _combine(x0, weights):
+    """Weighted mean of the branch intercepts per replicate; x0 has shape (branches, replicates)."""
+    return np.sum(weights[:, None] * x0, axis=0) / np.sum(weights)
+
+
+def _branch_weights(fits):
+    se = np.array([fit.stderr for fit in fits])
+    return (se == 0).astype(float) if np.any(se == 0) else 1.0 / se**2
+
+
+def _summary(samples, estimate, confidence):
+    finite = samples[np.isfinite(samples)]
+    tail = 50.0 * (1.0 - confidence)
+    low, high = np.percentile(finite, [tail, 100.0 - tail]) if finite.size else (np.nan, np.nan)
+    stderr = float(np.std(finite, ddof=1)) if finite.size > 1 else np.nan
+    return Uncertainty(estimate, stderr, float(low), float(high), samples)
+
+
+def _blocks(n, n_values):
+    size = max(1, MAX_BLOCK_VALUES // max(n_values, 1))
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+def _seeds(seed, n_chunks):
+    return np.random.SeedSequence(seed).spawn(n_chunks)
+
+
+def _run(task, args, n, seed, workers):
+    """Run task(*args, n_chunk, seed_sequence) over n replicates, split over a process pool if workers > 1."""
+    if not workers or workers <= 1:
+        return task(*args, n, _seeds(seed, 1)[0])
+    sizes = [len(chunk) for chunk in np.array_split(np.arange(n), workers) if len(chunk)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(task, *args, size, child) for size, child in zip(sizes, _seeds(seed, len(sizes)))]
+        return np.concatenate([future.result() for future in futures])
+
+
+def _bootstrap_task(branches, weights, n, seed_sequence):
+    rng = np.random.default_rng(seed_sequence)
+    samples = np.empty(n)
+    m = max(x.size for x, _, _ in branches)
+    for start, stop in _blocks(n, m):
+        x0 = np.empty((len(branches), stop - start))
+        for b, (x, fitted, residuals) in enumerate(branches):
+            picks = rng.integers(0, residuals.size, size=(stop - start, residuals.size))
+            x0[b] = _intercepts(x, fitted + residuals[picks])
+        samples[start:stop] = _combine(x0, weights)
+    return samples
+
+
+def bootstrap_endpoint(volume, g1, g2=None, n_boot=2000, confidence=0.95, seed=None, workers=None, **search):
+    """Residual-bootstrap confidence interval of the equivalence volume.
+
+    The linear regions are located once with find_endpoint; then the residuals of each fitted
+    branch are resampled with replacement (rescaled by sqrt(m / (m - 2)) for the two fitted
+    parameters) and all n_boot refits are done as one batched operation per block. The branch
+    intercepts are combined with the weights of the original fit. Returns an Uncertainty with a
+    percentile interval, or None if no linear region is found.
+    """
+    volume = np.asarray(volume, dtype=float)
+    endpoint = find_endpoint(volume, g1, g2, confidence, **search)
+    if endpoint is None:
+        return None
+    branches = []
+    for fit in endpoint.fits:
+        g = g1 if fit.slope < 0 else g2  # find_endpoint fits G1 falling and G2 rising
+        x = volume[fit.start:fit.stop]
+        y = np.asarray(g, dtype=float)[fit.start:fit.stop]
+        scale = np.max(np.abs(y)) or 1.0  # refit in scaled units; intercepts are scale-invariant
+        fitted = (fit.intercept + fit.slope * x) / scale
+        m = x.size
+        residuals = (y / scale - fitted) * np.sqrt(m / max(m - 2, 1))
+        branches.append((x, fitted, residuals))
+    samples = _run(_bootstrap_task, (branches, _branch_weights(endpoint.fits)), n_boot, seed, workers)
+    return _summary(samples, endpoint.volume, confidence)
+
+
+def _model_pH(volume, pH, fit, row, V):
+    """pH of a fitted normalized Gran branch: its line converted back to pH (measured pH where the line is not positive)."""
+    _, _, uses_V, sign = GRAN_FUNCTIONS[row]
+    v = volume[fit.start:fit.stop]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_g = np.log10((fit.intercept + fit.slope * v) / (v + V if uses_V else v))
+    model = log_g + pH.max() if sign > 0 else pH.min() - log_g  # undo the shift of gran_functions(normalize=True)
+    return np.where(np.isfinite(model), model, pH[fit.start:fit.stop])
+
+
+def _monte_carlo_task(volume, models, windows, rows, V, sigma_pH, sigma_volume, weights, n, seed_sequence):
+    rng = np.random.default_rng(seed_sequence)
+    samples = np.empty(n)
+    for start, stop in _blocks(n, volume.size):
+        size = stop - start
+        noise = rng.normal(0.0, sigma_pH, size=(size, volume.size))
+        volume_sim = volume + rng.normal(0.0, sigma_volume, size=(size, volume.size)) if sigma_volume else volume
+        x0 = np.empty((len(windows), size))
+        for b, ((first, last), row, model) in enumerate(zip(windows, rows, models)):
+            _, _, uses_V, sign = GRAN_FUNCTIONS[row]
+            v = volume_sim[..., first:last]
+            exponent = sign * (model + noise[:, first:last])
+            g = (v + V if uses_V else v) * np.power(10.0, exponent - exponent.max(axis=1, keepdims=True))
+            x0[b] = _intercepts(v, g)
+        samples[start:stop] = _combine(x0, weights)
+    return samples
+
+
+def monte_carlo_endpoint(volume, pH, titration='StrongAcid', V=25.0, sigma_pH=0.002, sigma_volume=0.0,
+                         n_sim=2000, confidence=0.95, seed=None, workers=None, **search):
+    """Monte Carlo confidence interval of the equivalence volume from pH (and burette) noise.
+
+    The linear regions are located once on the measured curve. Every simulated curve adds
+    normal noise of sigma_pH to the fitted branches converted back to pH (and sigma_volume mL to
+    the volumes), re-evaluates the titration's G1 and G2 on those regions and refits them, all
+    replicates of a block in one batched operation. Perturbing the measured pH instead would
+    count its noise twice. Returns an Uncertainty with a percentile interval, or None if no
+    linear region is found.
+    """
+    volume = np.asarray(volume, dtype=float)
+    pH = np.asarray(pH, dtype=float)
+    rows = [gran_index(titration + '_G1'), gran_index(titration + '_G2')]
+    gran = gran_functions(volume, pH, V, normalize=True)
+    endpoint = find_endpoint(volume, gran[rows[0]], gran[rows[1]], confidence, **search)
+    if endpoint is None:
+        return None
+    # Map the fits back to their Gran rows (find_endpoint fits G1 falling and G2 rising)
+    fit_rows = [rows[0] if fit.slope < 0 else rows[1] for fit in endpoint.fits]
+    windows = [(fit.start, fit.stop) for fit in endpoint.fits]
+    models = [_model_pH(volume, pH, fit, row, V) for fit, row in zip(endpoint.fits, fit_rows)]
+    args = (volume, models, windows, fit_rows, V, sigma_pH, sigma_volume, _branch_weights(endpoint.fits))
+    samples = _run(_monte_carlo_task, args, n_sim, seed, workers)
+    return _summary(samples, endpoint.volume, confidence)
+
+
+def _simulation():
+    """The simulation module of data/simulated_data (not a package, so it is imported from its directory)."""
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'simulated_data')
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    import simulation
+    return simulation
+
+
+def simulated_coverage(curve='strong_acid', titration='StrongAcid', sigma_pH=0.002, trials=200, n_sim=500,
+                       step=0.4, seed=None, **params):
+    """Check the Monte Carlo interval against noise-free simulated curves of simulation.py.
+
+    Adds sigma_pH noise to the noise-free curve `trials` times and returns the fraction of
+    intervals that contain the true equivalence volume (about 0.95 for a calibrated 95% interval)
+    and the mean interval width. The default step does not sample the equivalence volume itself:
+    G is zero there whatever the pH noise, which pins both branches and makes every interval
+    cover it.
+    """
+    simulation = _simulation()
+    curve_function = getattr(simulation, curve + '_curve')
+    volume = np.arange(0.0, 50.0 + step / 2, step)
+    pH = curve_function(volume, **params)
+    C0 = params.get('Ca', params.get('Cb', 0.100))
+    V0 = params.get('V0', 25.0)
+    titrant = params.get('Cb' if 'Ca' in params or curve.endswith('acid') else 'Ca', 0.100)
+    true_volume = C0 * V0 / titrant
+    rng = np.random.default_rng(seed)
+    hits, widths = 0, []
+    for _ in range(trials):
+        noisy = pH + rng.normal(0.0, sigma_pH, size=pH.size)
+        result = monte_carlo_endpoint(volume, noisy, titration, V0, sigma_pH, n_sim=n_sim, seed=rng.integers(2**32))
+        if result is not None:
+            hits += result.ci_low <= true_volume <= result.ci_high
+            widths.append(result.ci_high - result.ci_low)
+    return hits / trials, float(np.mean(widths)) if widths else np.nan